@@ -1,4 +1,5 @@
 import logging
+from typing import Optional, List
 
 from pydantic import BaseSettings, validator, ValidationError
 
@@ -19,6 +20,49 @@ class Settings(BaseSettings):
     stripe_referral_coupon_id: str
     stripe_welcome_promo_code_id: str
     stripe_payment_success_webhook_secret: str
+    db_async_path: Optional[str] = None
+    db_pool_size: int = 10
+    db_max_overflow: int = 20
+    db_pool_pre_ping: bool = True
+    db_pool_recycle_seconds: int = 1800
+    smtp_host: str = "smtp.gmail.com"
+    smtp_port: int = 587
+    smtp_starttls: bool = True
+    smtp_login: bool = True
+    smtp_pool_size: int = 2
+    smtp_queue_size: int = 1000
+    smtp_max_attempts: int = 4
+    campaign_emails_per_second: float = 1.0
+    campaign_chunk_size: int = 100
+    campaign_stale_seconds: int = 300
+    campaign_poll_seconds: float = 60.0
+    templates_auto_reload: bool = False
+    templates_bytecode_cache_dir: Optional[str] = None
+    request_log_body_paths: List[str] = []
+    healthz_log_sample_rate: float = 0.01
+    debug: bool = False
+    slow_query_seconds: float = 0.5
+    webhook_max_attempts: int = 5
+    webhook_backoff_seconds: float = 5.0
+    webhook_poll_seconds: float = 5.0
+    stripe_api_base: Optional[str] = None
+    stripe_cache_ttl_seconds: int = 3600
+    stripe_cache_version_check_seconds: float = 5.0
+    stripe_sync_concurrency: int = 4
+    catalog_version_check_seconds: float = 5.0
+    stripe_sync_max_attempts: int = 5
+    stripe_sync_backoff_seconds: float = 1.0
+    principal_cache_ttl_seconds: int = 60
+    bcrypt_rounds: int = 12
+    password_hash_workers: int = 2
+    password_hash_queue_size: int = 32
+    event_flush_size: int = 500
+    event_flush_interval_ms: int = 1000
+    event_max_pending: int = 10000
+    event_batch_max_events: int = 500
+    event_batch_max_bytes: int = 1048576
+    rollup_interval_seconds: float = 60.0
+    dashboard_cache_ttl_seconds: int = 300
 
     class Config:
         env_file = ".env"
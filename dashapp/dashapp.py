@@ -1,17 +1,27 @@
 import logging
+import threading
+import time
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, Tuple, TypeVar
 
 import dash
 from dash import dcc, html
 from dash.dependencies import Input, Output
-from sqlalchemy.orm import Session
+from sqlalchemy import func
+from sqlalchemy.orm import Session, sessionmaker
 
-from models.event import Event
+from config import Settings
+from models.recipes import Recipe
+from models.rollups import EventHourlyCount, RecipeEventHourlyCount
+from models.signups import VerifiedSignUp
 
-# select date_format(event_timestamp,'%Y-%m-%d %H'), count(1) from events group by 1;
-# select date_format(event_timestamp,'%Y-%m-%d %H-%I'), count(1) from events group by 1;
-# select distinct event_type from events;
+# Event graphs read the hourly rollups kept by dependencies.rollups rather than scanning the events table; they trail
+# new events by up to two rollup intervals, plus dashboard_cache_ttl_seconds for the cached figures.
 
 logger = logging.getLogger("rasoibox")
+settings: Settings = Settings()
+
+T = TypeVar("T")
 
 CARD_CLASS = "card"
 LAYOUT = {
@@ -25,22 +35,53 @@ LAYOUT = {
 }
 
 
+def read_with_session(session_factory: sessionmaker, read: Callable[[Session], T]) -> T:
+    # a session per read: dash runs on the wsgi threads, and a long lived session would keep reading the snapshot of
+    # its first transaction
+    db = session_factory()
+    try:
+        return read(db)
+    finally:
+        db.close()
+
+
+# figure name -> (built at, figure); the layout is rebuilt on every page load and reuses these within the ttl.
+_figures_lock = threading.Lock()
+_figures: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+
+
+def cached_figure(name: str, session_factory: sessionmaker, build: Callable[[Session], Dict[str, Any]]) \
+        -> Dict[str, Any]:
+    cached = _figures.get(name)
+    if cached is not None and time.monotonic() - cached[0] <= settings.dashboard_cache_ttl_seconds:
+        return cached[1]
+    figure = read_with_session(session_factory, build)
+    with _figures_lock:
+        _figures[name] = (time.monotonic(), figure)
+    return figure
+
+
 def update_verified_signups_graph(db: Session):
-    statement = "select t.day, sum(t2.sign_ups) as cum_sum from (select date_format(verify_date, '%Y-%m-%d') as day, " \
-                "count(1) as sign_ups from verified_sign_ups group by 1) t join " \
-                "(select date_format(verify_date, '%Y-%m-%d') as day, count(1) as sign_ups from " \
-                "verified_sign_ups group by 1) t2 on t.day >= t2.day group by t.day, t.sign_ups order by t.day;"
-    data = db.execute(statement).all()
-    timestamps = [x[0] for x in data]
+    # one grouped query over the days; the running total is summed here
+    day = func.date(VerifiedSignUp.verify_date).label("day")
+    data = db.query(day, func.count(VerifiedSignUp.id)).filter(VerifiedSignUp.verify_date.isnot(None)).group_by(
+        "day").order_by("day").all()
+    days = [str(x[0]) for x in data]
     signups_count = [x[1] for x in data]
     return {
         'data': [{
-            'x': timestamps,
-            'y': signups_count,
+            'x': days,
+            'y': list(accumulate(signups_count)),
+            'name': 'Total',
             'line': {
                 'width': 3,
                 'shape': 'spline'
             }
+        }, {
+            'x': days,
+            'y': signups_count,
+            'name': 'Daily',
+            'type': 'bar'
         }],
         'layout': LAYOUT
     }
@@ -63,9 +104,8 @@ def recipe_likes(db):
 
 
 def unverified_traffic(db):
-    statement = "select date_format(event_timestamp, '%Y-%m-%d %H'), count(1) " \
-                "from events where code not in (select verification_code from verified_sign_ups) group by 1;"
-    data = db.execute(statement).all()
+    data = db.query(EventHourlyCount.hour, func.sum(EventHourlyCount.unverified_count)).group_by(
+        EventHourlyCount.hour).order_by(EventHourlyCount.hour).all()
     timestamps = [x[0] for x in data]
     unverified = [x[1] for x in data]
     return {
@@ -81,63 +121,99 @@ def unverified_traffic(db):
     }
 
 
-def create_dash_app(db: Session, requests_pathname_prefix: str = None) -> dash.Dash:
-    event_types_rows = db.query(Event.event_type).distinct(Event.event_type).all()
-    event_types = [x[0] for x in event_types_rows]
+def recipe_steps(db: Session):
+    # recipe events per step, one series per recipe, to see where people stop cooking
+    data = db.query(RecipeEventHourlyCount.recipe_id, Recipe.name, RecipeEventHourlyCount.step_number,
+                    func.sum(RecipeEventHourlyCount.count)).outerjoin(
+        Recipe, Recipe.id == RecipeEventHourlyCount.recipe_id).group_by(
+        RecipeEventHourlyCount.recipe_id, Recipe.name, RecipeEventHourlyCount.step_number).order_by(
+        RecipeEventHourlyCount.recipe_id, RecipeEventHourlyCount.step_number).all()
+    series: Dict[str, Dict[str, List[Any]]] = {}
+    for recipe_id, name, step_number, count in data:
+        steps = series.setdefault(name if name is not None else str(recipe_id), {'x': [], 'y': []})
+        steps['x'].append(step_number)
+        steps['y'].append(int(count))
+    return {
+        'data': [{'x': v['x'], 'y': v['y'], 'name': k, 'type': 'bar'} for k, v in series.items()],
+        'layout': LAYOUT
+    }
+
+
+def event_types(db: Session):
+    return [x[0] for x in db.query(EventHourlyCount.event_type).distinct().all()]
+
+
+def event_counts(db: Session, event_type: str):
+    return db.query(EventHourlyCount.hour, EventHourlyCount.count).filter(
+        EventHourlyCount.event_type == event_type).order_by(EventHourlyCount.hour).all()
+
 
+def create_dash_app(session_factory: sessionmaker, requests_pathname_prefix: str = None) -> dash.Dash:
     app = dash.Dash(__name__, requests_pathname_prefix=requests_pathname_prefix)
 
     app.scripts.config.serve_locally = False
     dcc._js_dist[0]['external_url'] = 'https://cdn.plot.ly/plotly-basic-latest.min.js'
 
-    if len(event_types) == 0:
-        initial_value = "No event types found"
-    else:
-        initial_value = event_types[0]
-
-    events_graph_div = html.Div([
-        html.H1('Site Events'),
-        dcc.Dropdown(
-            id='events-dropdown',
-            options=[{'label': x, 'value': x} for x in event_types],
-            value=initial_value
-        ),
-        dcc.Graph(id='events-graph')
-    ], className=CARD_CLASS)
-
-    verified_signups_graph_div = html.Div([
-        html.H1('Verified Sign Ups'),
-        dcc.Graph(id='verified-signups-graph', figure=update_verified_signups_graph(db))
-    ], className=CARD_CLASS)
-
-    recipe_likes_div = html.Div([
-        html.H1('Liked Recipes'),
-        dcc.Graph(id='liked-recipes-graph', figure=recipe_likes(db))
-    ], className=CARD_CLASS)
-
-    unverified_traffic_graph_div = html.Div([
-        html.H1('Unverified Traffic'),
-        dcc.Graph(id='unverified-traffic-graph', figure=unverified_traffic(db))
-    ], className=CARD_CLASS)
-
-    logo = html.Img(style={'margin': 'auto', 'display': 'block', 'width': '50px'}, src="assets/logo.png")
-    cards = html.Div([verified_signups_graph_div,
-                      recipe_likes_div,
-                      events_graph_div,
-                      unverified_traffic_graph_div
-                      ], className="container")
-
-    app.layout = html.Div([
-        logo,
-        cards
-    ], className="app")
+    # served as a function so the graphs are built when the dashboard is opened, not when the server imports it
+    def serve_layout():
+        event_type_options = read_with_session(session_factory, event_types)
+
+        if len(event_type_options) == 0:
+            initial_value = "No event types found"
+        else:
+            initial_value = event_type_options[0]
+
+        events_graph_div = html.Div([
+            html.H1('Site Events'),
+            dcc.Dropdown(
+                id='events-dropdown',
+                options=[{'label': x, 'value': x} for x in event_type_options],
+                value=initial_value
+            ),
+            dcc.Graph(id='events-graph')
+        ], className=CARD_CLASS)
+
+        verified_signups_graph_div = html.Div([
+            html.H1('Verified Sign Ups'),
+            dcc.Graph(id='verified-signups-graph',
+                      figure=cached_figure("verified_signups", session_factory, update_verified_signups_graph))
+        ], className=CARD_CLASS)
+
+        recipe_likes_div = html.Div([
+            html.H1('Liked Recipes'),
+            dcc.Graph(id='liked-recipes-graph', figure=cached_figure("recipe_likes", session_factory, recipe_likes))
+        ], className=CARD_CLASS)
+
+        unverified_traffic_graph_div = html.Div([
+            html.H1('Unverified Traffic'),
+            dcc.Graph(id='unverified-traffic-graph',
+                      figure=cached_figure("unverified_traffic", session_factory, unverified_traffic))
+        ], className=CARD_CLASS)
+
+        recipe_steps_graph_div = html.Div([
+            html.H1('Recipe Steps'),
+            dcc.Graph(id='recipe-steps-graph', figure=cached_figure("recipe_steps", session_factory, recipe_steps))
+        ], className=CARD_CLASS)
+
+        logo = html.Img(style={'margin': 'auto', 'display': 'block', 'width': '50px'}, src="assets/logo.png")
+        cards = html.Div([verified_signups_graph_div,
+                          recipe_likes_div,
+                          events_graph_div,
+                          unverified_traffic_graph_div,
+                          recipe_steps_graph_div
+                          ], className="container")
+
+        return html.Div([
+            logo,
+            cards
+        ], className="app")
+
+    app.layout = serve_layout
 
     @app.callback(Output('events-graph', 'figure'),
                   [Input('events-dropdown', 'value')])
     def update_events_graph(selected_dropdown_value):
-        statement = "select date_format(event_timestamp,'%Y-%m-%d %H-%I'), count(1) " \
-                    "from events where event_type=\"{}\" group by 1".format(selected_dropdown_value)
-        data = db.execute(statement).all()
+        data = read_with_session(session_factory, lambda db: event_counts(db, selected_dropdown_value))
         timestamps = [x[0] for x in data]
         event_count = [x[1] for x in data]
         return {
@@ -0,0 +1,25 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from dependencies.database import SessionLocal, insert_ignore
+from models.cache_versions import CacheVersion
+
+
+def load_cache_version(name: str) -> int:
+    db = SessionLocal()
+    try:
+        version: Optional[int] = db.query(CacheVersion.version).filter(CacheVersion.name == name).scalar()
+        return version if version is not None else 0
+    finally:
+        db.close()
+
+
+def bump_cache_version(name: str, db: Session):
+    updated = db.query(CacheVersion).filter(CacheVersion.name == name).update(
+        {CacheVersion.version: CacheVersion.version + 1, CacheVersion.updated_on: datetime.now()},
+        synchronize_session=False)
+    if updated == 0:
+        db.execute(insert_ignore(CacheVersion).values(name=name, version=1, updated_on=datetime.now()))
+    db.commit()
@@ -0,0 +1,290 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jinja2 import Environment
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from config import Settings
+from dependencies.database import SessionLocal
+from emails.base import RasoiBoxEmail, build_message
+from emails.createpassword import CreatePasswordEmail
+from emails.delivery import EmailDeliveryService
+from emails.popfest.preorder1 import PreOrder1Email
+from emails.popfest.preorder2 import PreOrder2Email
+from models.campaigns import EmailCampaign, CampaignStatusEnum
+from models.customers import Customer
+from models.orders import Order, PaymentStatusEnum
+from models.signups import VerifiedSignUp, UnverifiedSignUp
+
+logger = logging.getLogger("rasoibox")
+
+settings: Settings = Settings()
+
+# (db, after_id, limit) -> the next page of (recipient id, email) ordered by recipient id; a None email only moves the
+# cursor past a recipient that was skipped
+RecipientPage = Callable[[Session, int, int], List[Tuple[int, Optional[RasoiBoxEmail]]]]
+
+
+def preorder2_verified_recipients(db: Session, after_id: int, limit: int) -> List[Tuple[int, RasoiBoxEmail]]:
+    verified_sign_ups: List[VerifiedSignUp] = db.query(VerifiedSignUp).filter(
+        and_(VerifiedSignUp.id > after_id, VerifiedSignUp.signup_from != "GUEST_ORDER")).order_by(
+        VerifiedSignUp.id).limit(limit).all()
+    return [(x.id, PreOrder2Email(x.email, settings.from_email)) for x in verified_sign_ups]
+
+
+def preorder2_unverified_recipients(db: Session, after_id: int, limit: int) -> List[Tuple[int, RasoiBoxEmail]]:
+    unverified_sign_ups: List[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(
+        UnverifiedSignUp.id > after_id).order_by(UnverifiedSignUp.id).limit(limit).all()
+    return [(x.id, PreOrder2Email(x.email, settings.from_email)) for x in unverified_sign_ups]
+
+
+def preorder1_recipients(db: Session, after_id: int, limit: int) -> List[Tuple[int, RasoiBoxEmail]]:
+    unverified_sign_ups: List[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(
+        UnverifiedSignUp.id > after_id).order_by(UnverifiedSignUp.id).limit(limit).all()
+    return [(x.id, PreOrder1Email(x.email, settings.from_email)) for x in unverified_sign_ups]
+
+
+def create_password_recipients(db: Session, after_id: int, limit: int) \
+        -> List[Tuple[int, Optional[RasoiBoxEmail]]]:
+    customers: List[Customer] = db.query(Customer).filter(
+        and_(Customer.id > after_id, Customer.hashed_password.is_(None))).order_by(Customer.id).limit(limit).all()
+    if len(customers) == 0:
+        return []
+
+    orders_by_customer: Dict[int, Order] = {}
+    for order in db.query(Order).filter(and_(Order.customer.in_([x.id for x in customers]),
+                                             Order.payment_status == PaymentStatusEnum.COMPLETED)).all():
+        orders_by_customer.setdefault(order.customer, order)
+
+    url_base: str = settings.frontend_url_base[0:-1] if settings.frontend_url_base.endswith(
+        "/") else settings.frontend_url_base
+    recipients: List[Tuple[int, Optional[RasoiBoxEmail]]] = []
+    for customer in customers:
+        order = orders_by_customer.get(customer.id)
+        if order is None:
+            logger.warning("Could not find order for customer without password: {}".format(customer.id))
+            continue
+        recipients.append((customer.id, CreatePasswordEmail(
+            url_base=url_base,
+            first_name=order.recipient_first_name,
+            create_id=order.customer,
+            payment_intent=order.payment_intent,
+            to_email=order.recipient_email,
+            from_email=settings.from_email
+        )))
+    # the cursor still has to move past customers we skipped
+    if len(recipients) == 0 or recipients[-1][0] != customers[-1].id:
+        recipients.append((customers[-1].id, None))
+    return recipients
+
+
+CAMPAIGNS: Dict[str, RecipientPage] = {
+    "preorder2_verified": preorder2_verified_recipients,
+    "preorder2_unverified": preorder2_unverified_recipients,
+    "preorder1": preorder1_recipients,
+    "create_password": create_password_recipients,
+}
+
+# identifies this process as the sender of the campaigns it claims; the suffix tells apart a restarted process that
+# got the same pid
+OWNER: str = "{}:{}:{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[0:8])
+
+
+def create_campaign(campaign_type: str, after_id: int, db: Session) -> EmailCampaign:
+    now = datetime.now()
+    campaign = EmailCampaign(
+        campaign_type=campaign_type,
+        status=CampaignStatusEnum.RUNNING,
+        last_recipient_id=after_id,
+        sent_count=0,
+        failed_count=0,
+        started_on=now,
+        updated_on=now
+    )
+    db.add(campaign)
+    db.commit()
+    return campaign
+
+
+def claim_campaign(campaign_id: int, db: Session) -> bool:
+    # a conditional update, so of several processes trying to send the same campaign only one gets it; a campaign whose
+    # sender stopped saving progress for campaign_stale_seconds can be taken over
+    now = datetime.now()
+    claimed = db.query(EmailCampaign).filter(and_(
+        EmailCampaign.id == campaign_id,
+        EmailCampaign.status != CampaignStatusEnum.COMPLETED,
+        or_(EmailCampaign.owner.is_(None), EmailCampaign.heartbeat_on.is_(None),
+            EmailCampaign.heartbeat_on < now - timedelta(seconds=settings.campaign_stale_seconds)))).update({
+                EmailCampaign.status: CampaignStatusEnum.RUNNING,
+                EmailCampaign.owner: OWNER,
+                EmailCampaign.heartbeat_on: now,
+                EmailCampaign.last_error: None,
+                EmailCampaign.updated_on: now
+            }, synchronize_session=False)
+    db.commit()
+    return claimed == 1
+
+
+def _update_claimed(campaign_id: int, values: Dict[Any, Any], db: Session) -> bool:
+    # only while we still own the campaign; False means another process took it over
+    updated = db.query(EmailCampaign).filter(and_(EmailCampaign.id == campaign_id, EmailCampaign.owner == OWNER)) \
+        .update(values, synchronize_session=False)
+    db.commit()
+    return updated == 1
+
+
+def start_campaign(campaign_id: int, jinja_env: Environment, email_service: EmailDeliveryService) -> bool:
+    db = SessionLocal()
+    try:
+        if not claim_campaign(campaign_id, db):
+            return False
+    finally:
+        db.close()
+    threading.Thread(target=run_campaign, args=(campaign_id, jinja_env, email_service),
+                     name="email-campaign-{}".format(campaign_id), daemon=True).start()
+    return True
+
+
+def is_campaign_running(campaign: EmailCampaign) -> bool:
+    return campaign.status == CampaignStatusEnum.RUNNING and campaign.owner is not None and \
+        campaign.heartbeat_on is not None and \
+        campaign.heartbeat_on >= datetime.now() - timedelta(seconds=settings.campaign_stale_seconds)
+
+
+def run_campaign(campaign_id: int, jinja_env: Environment, email_service: EmailDeliveryService):
+    # sends a campaign this process has claimed; every recipient saves the cursor and the heartbeat
+    db = SessionLocal()
+    # campaigns get their own connection so they never starve transactional email in the delivery queue
+    connection = email_service.new_connection()
+    try:
+        campaign: EmailCampaign = db.query(EmailCampaign).filter(EmailCampaign.id == campaign_id).one()
+        next_recipients: RecipientPage = CAMPAIGNS[campaign.campaign_type]
+        send_interval_seconds: float = 1.0 / settings.campaign_emails_per_second
+        last_recipient_id: int = campaign.last_recipient_id
+        sent_count: int = campaign.sent_count
+        failed_count: int = campaign.failed_count
+        logger.info("Campaign {} ({}) resuming after recipient {}".format(campaign.id, campaign.campaign_type,
+                                                                          last_recipient_id))
+        db.rollback()
+        while True:
+            recipients = next_recipients(db, last_recipient_id, settings.campaign_chunk_size)
+            if len(recipients) == 0:
+                break
+            for recipient_id, email in recipients:
+                started = time.monotonic()
+                if email is not None:
+                    if email_service.deliver(connection, build_message(jinja_env, email)):
+                        sent_count = sent_count + 1
+                    else:
+                        failed_count = failed_count + 1
+                last_recipient_id = recipient_id
+                now = datetime.now()
+                if not _update_claimed(campaign_id, {
+                    EmailCampaign.last_recipient_id: last_recipient_id,
+                    EmailCampaign.sent_count: sent_count,
+                    EmailCampaign.failed_count: failed_count,
+                    EmailCampaign.updated_on: now,
+                    EmailCampaign.heartbeat_on: now
+                }, db):
+                    logger.warning("Campaign {} was taken over by another process, stopping.".format(campaign_id))
+                    return
+                if email is not None:
+                    time.sleep(max(0.0, send_interval_seconds - (time.monotonic() - started)))
+
+        now = datetime.now()
+        _update_claimed(campaign_id, {
+            EmailCampaign.status: CampaignStatusEnum.COMPLETED,
+            EmailCampaign.completed_on: now,
+            EmailCampaign.updated_on: now,
+            EmailCampaign.owner: None
+        }, db)
+        logger.info("Campaign {} completed: {} sent, {} failed".format(campaign_id, sent_count, failed_count))
+    except Exception as e:
+        logger.exception("Campaign {} failed.".format(campaign_id))
+        db.rollback()
+        _update_claimed(campaign_id, {
+            EmailCampaign.status: CampaignStatusEnum.FAILED,
+            EmailCampaign.last_error: str(e)[0:1000],
+            EmailCampaign.updated_on: datetime.now(),
+            EmailCampaign.owner: None
+        }, db)
+    finally:
+        connection.close()
+        db.close()
+
+
+# Picks up campaigns left RUNNING without a live sender, e.g. by a restart or a deploy, every poll_seconds.
+class CampaignSupervisor():
+    poll_seconds: float
+
+    def __init__(self, poll_seconds: float = 60.0):
+        self.poll_seconds = poll_seconds
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, jinja_env: Environment, email_service: EmailDeliveryService):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, args=(jinja_env, email_service), name="email-campaigns",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self, jinja_env: Environment, email_service: EmailDeliveryService):
+        while not self._stopping.wait(self.poll_seconds):
+            try:
+                self.resume_abandoned(jinja_env, email_service)
+            except Exception:
+                logger.exception("Failed to look for abandoned campaigns.")
+
+    def resume_abandoned(self, jinja_env: Environment, email_service: EmailDeliveryService) -> int:
+        db = SessionLocal()
+        try:
+            stale = datetime.now() - timedelta(seconds=settings.campaign_stale_seconds)
+            campaign_ids: List[int] = [x.id for x in db.query(EmailCampaign.id).filter(and_(
+                EmailCampaign.status == CampaignStatusEnum.RUNNING,
+                or_(EmailCampaign.owner.is_(None), EmailCampaign.heartbeat_on.is_(None),
+                    EmailCampaign.heartbeat_on < stale))).all()]
+        finally:
+            db.close()
+        resumed: int = 0
+        for campaign_id in campaign_ids:
+            if start_campaign(campaign_id, jinja_env, email_service):
+                logger.info("Picked up abandoned campaign {}".format(campaign_id))
+                resumed = resumed + 1
+        return resumed
+
+
+campaign_supervisor: CampaignSupervisor = CampaignSupervisor(poll_seconds=settings.campaign_poll_seconds)
+
+
+def to_campaign_dict(campaign: EmailCampaign) -> Dict:
+    return {
+        "campaign_id": campaign.id,
+        "campaign_type": campaign.campaign_type,
+        "status": campaign.status,
+        "running": is_campaign_running(campaign),
+        "owner": campaign.owner,
+        "last_recipient_id": campaign.last_recipient_id,
+        "sent_count": campaign.sent_count,
+        "failed_count": campaign.failed_count,
+        "started_on": campaign.started_on,
+        "updated_on": campaign.updated_on,
+        "heartbeat_on": campaign.heartbeat_on,
+        "completed_on": campaign.completed_on,
+        "last_error": campaign.last_error
+    }
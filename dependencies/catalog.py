@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Settings
+from dependencies.cache_versions import load_cache_version, bump_cache_version
+from dependencies.database import SessionLocal
+from models.recipes import Recipe, RecipePrice, RecipeContributor, RecipeSchedule
+
+logger = logging.getLogger("rasoibox")
+
+settings: Settings = Settings()
+
+CACHE_VERSION_NAME = "catalog"
+
+# invalidations bump a shared version every server process checks at most every catalog_version_check_seconds; in case
+# a bump is lost, never serve a snapshot older than this either
+CATALOG_TTL_SECONDS = 300
+
+
+class Catalog:
+    version: int
+    loaded_at: float
+    recipes_by_id: Dict[int, Recipe]
+    recipes_by_name: Dict[str, Recipe]
+    prices: List[RecipePrice]
+    prices_by_recipe_serving: Dict[Tuple[int, int], RecipePrice]
+    contributors_by_id: Dict[int, RecipeContributor]
+    # the weekly menu without per-user starred flags, keyed by schedule start date in date order
+    schedule: Dict[date, List[Dict[str, Any]]]
+
+    def __init__(self, version: int, recipes: List[Recipe], prices: List[RecipePrice],
+                 contributors: List[RecipeContributor], schedule: Dict[date, List[Dict[str, Any]]]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.recipes_by_id = {x.id: x for x in recipes}
+        self.recipes_by_name = {x.name: x for x in recipes}
+        self.prices = prices
+        self.prices_by_recipe_serving = {(x.recipe_id, x.serving_size): x for x in prices}
+        self.contributors_by_id = {x.id: x for x in contributors}
+        self.schedule = schedule
+
+    def get_recipe(self, recipe_id: int) -> Optional[Recipe]:
+        return self.recipes_by_id.get(recipe_id)
+
+    def get_recipe_by_name(self, name: str) -> Optional[Recipe]:
+        return self.recipes_by_name.get(name)
+
+    def get_price(self, recipe_id: int, serving_size: int) -> Optional[RecipePrice]:
+        return self.prices_by_recipe_serving.get((recipe_id, serving_size))
+
+    def get_contributor(self, contributor_id: int) -> Optional[RecipeContributor]:
+        return self.contributors_by_id.get(contributor_id)
+
+    def is_stale(self, version: int) -> bool:
+        return self.version != version or time.monotonic() - self.loaded_at > CATALOG_TTL_SECONDS
+
+
+_lock = threading.Lock()
+_version: Optional[int] = None
+_version_checked_at: float = 0.0
+_catalog: Optional[Catalog] = None
+
+
+def _load_schedule(db) -> Dict[date, List[Dict[str, Any]]]:
+    schedule: Dict[date, List[Dict[str, Any]]] = {}
+    rows = db.query(RecipeSchedule, Recipe).outerjoin(Recipe, Recipe.id == RecipeSchedule.recipe_id).order_by(
+        RecipeSchedule.schedule_start_date.asc()).all()
+    for item, recipe in rows:
+        if recipe is None:
+            logger.error("Schedule has invalid recipe_id: {} {}".format(item.id, item.recipe_id))
+        else:
+            schedule.setdefault(item.schedule_start_date, []).append({
+                "id": recipe.id,
+                "name": recipe.name,
+                "description": recipe.description,
+                "image_url": recipe.image_url
+            })
+    return schedule
+
+
+def _load_catalog(version: int) -> Catalog:
+    db = SessionLocal()
+    try:
+        recipes: List[Recipe] = db.query(Recipe).order_by(Recipe.id).all()
+        # prices stripe has no price for yet cannot be checked out, so they are not on sale
+        prices: List[RecipePrice] = db.query(RecipePrice).filter(RecipePrice.stripe_price_id.isnot(None)).order_by(
+            RecipePrice.id).all()
+        contributors: List[RecipeContributor] = db.query(RecipeContributor).all()
+        schedule: Dict[date, List[Dict[str, Any]]] = _load_schedule(db)
+        # detach the rows so they stay readable after this session closes
+        db.expunge_all()
+    finally:
+        db.close()
+    logger.info("Loaded catalog version {}: {} recipes, {} prices".format(version, len(recipes), len(prices)))
+    return Catalog(version, recipes, prices, contributors, schedule)
+
+
+def get_catalog() -> Catalog:
+    global _catalog
+    version = catalog_version()
+    catalog = _catalog
+    if catalog is not None and not catalog.is_stale(version):
+        return catalog
+
+    with _lock:
+        if _catalog is None or _catalog.is_stale(version):
+            _catalog = _load_catalog(version)
+        return _catalog
+
+
+def catalog_version() -> int:
+    global _version, _version_checked_at
+    if _version is not None and time.monotonic() - _version_checked_at < settings.catalog_version_check_seconds:
+        return _version
+    _version_checked_at = time.monotonic()
+    try:
+        _version = load_cache_version(CACHE_VERSION_NAME)
+    except Exception:
+        logger.exception("Failed to read the catalog version.")
+        if _version is None:
+            _version = 0
+    return _version
+
+
+def invalidate_catalog():
+    global _catalog, _version_checked_at
+    db = SessionLocal()
+    try:
+        bump_cache_version(CACHE_VERSION_NAME, db)
+    except Exception:
+        logger.exception("Failed to bump the catalog version, other server processes catch up within the TTL.")
+        db.rollback()
+        with _lock:
+            _catalog = None
+    finally:
+        db.close()
+    # read the bumped version on the next lookup instead of waiting for the next check
+    _version_checked_at = 0.0
@@ -1,4 +1,10 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from fastapi import Depends, HTTPException
 from jose import jwt, JWTError
@@ -10,11 +16,22 @@ from config import Settings
 from dependencies.database import get_db
 from dependencies.oauth import oauth2_scheme
 from models.customers import Customer
+from models.signups import VerifiedSignUp
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger("rasoibox")
 
 settings: Settings = Settings()
 
+# hashes made with other rounds still verify; pinning min and max to the setting makes verify_and_update hand back a
+# new hash for them at the next login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=settings.bcrypt_rounds,
+                           bcrypt__min_rounds=settings.bcrypt_rounds, bcrypt__max_rounds=settings.bcrypt_rounds)
+
+# bcrypt releases the GIL while it hashes, so a few threads hash in parallel without blocking the event loop. Requests
+# beyond what the pool can work through soon are turned away instead of queueing without bound.
+_password_pool = ThreadPoolExecutor(max_workers=settings.password_hash_workers, thread_name_prefix="password-hash")
+_password_slots = threading.BoundedSemaphore(settings.password_hash_workers + settings.password_hash_queue_size)
+
 SECRET_KEY = settings.jwt_secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 120
@@ -32,12 +49,38 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def create_customer_access_token(customer: Customer, verification_code: Optional[str]):
+    # cid and vc let authenticated requests find the customer without looking it up by email
+    return create_access_token(data={"sub": customer.email, "cid": customer.id, "vc": verification_code})
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def _run_password_task(task: Callable[..., Any], *args) -> Any:
+    if not _password_slots.acquire(blocking=False):
+        logger.warning("Password hashing pool is saturated.")
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server busy, try again.",
+                            headers={"Retry-After": "1"})
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_password_pool, task, *args)
+    finally:
+        _password_slots.release()
+
+
+async def verify_password(plain_password: str, hashed_password: Optional[str]) -> bool:
+    if hashed_password is None:
+        return False
+    return await _run_password_task(pwd_context.verify, plain_password, hashed_password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: Optional[str]) \
+        -> Tuple[bool, Optional[str]]:
+    # (verified, new hash to store when the stored one was made with outdated settings)
+    if hashed_password is None:
+        return False, None
+    return await _run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+async def get_password_hash(password: str) -> str:
+    return await _run_password_task(pwd_context.hash, password)
 
 
 def get_customer(db: Session, username: str) -> Customer:
@@ -46,18 +89,68 @@ def get_customer(db: Session, username: str) -> Customer:
         return customer
 
 
-def authenticate_customer(username: str, password: str, db: Session):
+async def authenticate_customer(username: str, password: str, db: Session):
     user = get_customer(db, username)
     if user is None:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await verify_and_update_password(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        db.commit()
+        logger.info("Rehashed password for customer {}".format(user.id))
     if not user.verified:
         return False
     return user
 
 
-async def get_current_customer(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Customer:
+# What authenticated handlers need to know about the caller, without holding on to a session.
+class Principal():
+    id: int
+    email: str
+    first_name: str
+    last_name: str
+    verified: bool
+    verification_code: Optional[str]  # of the customer's verified sign up; None while unverified
+
+    def __init__(self, customer: Customer, verification_code: Optional[str]):
+        self.id = customer.id
+        self.email = customer.email
+        self.first_name = customer.first_name
+        self.last_name = customer.last_name
+        self.verified = customer.verified
+        self.verification_code = verification_code
+
+
+# customer id -> (loaded at, principal). Writes to a customer invalidate it here; other uvicorn workers catch up after
+# the ttl.
+_principals_lock = threading.Lock()
+_principals: Dict[int, Tuple[float, Principal]] = {}
+
+
+def invalidate_principal(customer_id: int):
+    with _principals_lock:
+        _principals.pop(customer_id, None)
+
+
+def _load_principal(db: Session, customer_id: Optional[int], email: str, verification_code: Optional[str]) \
+        -> Optional[Principal]:
+    if customer_id is not None:
+        customer: Optional[Customer] = db.query(Customer).filter(Customer.id == customer_id).first()
+    else:
+        # tokens issued before they carried the customer id
+        customer = get_customer(db, username=email)
+    if customer is None:
+        return None
+    if verification_code is None:
+        verified_sign_up: Optional[VerifiedSignUp] = db.query(VerifiedSignUp).filter(
+            VerifiedSignUp.email == customer.email).first()
+        verification_code = verified_sign_up.verification_code if verified_sign_up is not None else None
+    return Principal(customer, verification_code)
+
+
+async def get_current_customer(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -70,7 +163,19 @@ async def get_current_customer(token: str = Depends(oauth2_scheme), db: Session
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    customer = get_customer(db, username=username)
-    if customer is None:
+    customer_id: Optional[int] = payload.get("cid")
+
+    cached: Optional[Tuple[float, Principal]] = _principals.get(customer_id) if customer_id is not None else None
+    if cached is not None and time.monotonic() - cached[0] <= settings.principal_cache_ttl_seconds:
+        principal: Principal = cached[1]
+    else:
+        principal = _load_principal(db, customer_id, username, payload.get("vc"))
+        if principal is None:
+            raise credentials_exception
+        with _principals_lock:
+            _principals[principal.id] = (time.monotonic(), principal)
+
+    # a token stops working once the account's email changes, as it did when customers were looked up by email
+    if principal.email != username:
         raise credentials_exception
-    return customer
+    return principal
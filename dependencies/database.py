@@ -1,14 +1,59 @@
-from sqlalchemy import create_engine
+from typing import Any, Dict, Optional
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, AsyncEngine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql.dml import Insert
 
 from config import Settings
+from middleware.query_profiler import profile_engine
 
 settings: Settings = Settings()
+
+# async drivers for the sync drivers we deploy with
+ASYNC_DRIVERS: Dict[str, str] = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def pool_options(db_path: str) -> Dict[str, Any]:
+    if make_url(db_path).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle_seconds,
+    }
+
+
+# an INSERT that skips rows whose key already exists, on mysql and on the sqlite databases used locally
+def insert_ignore(table: Any) -> Insert:
+    return insert(table).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+
+
+def to_async_db_path(db_path: str) -> str:
+    url = make_url(db_path)
+    backend: str = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError("No async driver known for {} databases; set DB_ASYNC_PATH to an async url, e.g. one with "
+                         "{}.".format(backend, " or ".join(ASYNC_DRIVERS.values())))
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
 engine = create_engine(
     settings.db_path,
+    **pool_options(settings.db_path)
 )
+profile_engine(engine, settings.slow_query_seconds)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# the async engine needs an async driver installed, so only build it once a router asks for it
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[sessionmaker] = None
+
 
 def get_db():
     try:
@@ -20,3 +65,26 @@ def get_db():
 
 def get_engine():
     return engine
+
+
+def get_async_engine() -> AsyncEngine:
+    global async_engine, AsyncSessionLocal
+    if async_engine is None:
+        async_db_path: str = settings.db_async_path if settings.db_async_path is not None else to_async_db_path(
+            settings.db_path)
+        async_engine = create_async_engine(async_db_path, **pool_options(async_db_path))
+        profile_engine(async_engine.sync_engine, settings.slow_query_seconds)
+        AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False,
+                                         expire_on_commit=False)
+    return async_engine
+
+
+async def get_async_db():
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def dispose_async_engine():
+    if async_engine is not None:
+        await async_engine.dispose()
@@ -0,0 +1,117 @@
+import zlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+import api.event
+from config import Settings
+from dependencies.events import event_buffer, site_event_row, recipe_event_row
+from models.event import Event, RecipeEvent
+
+settings: Settings = Settings()
+
+RECIPE_EVENT_FIELDS = ["recipe_id", "serving_size", "step_number"]
+
+
+def read_batch_body(body: bytes, content_encoding: Optional[str]) -> bytes:
+    if content_encoding is None or content_encoding.strip().lower() in ["", "identity"]:
+        if len(body) > settings.event_batch_max_bytes:
+            raise HTTPException(status_code=413, detail="Event batch too large")
+        return body
+    if content_encoding.strip().lower() != "gzip":
+        raise HTTPException(status_code=415, detail="Unsupported content encoding")
+    # bounded so a small compressed body cannot expand into an unbounded one
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        decompressed = decompressor.decompress(body, settings.event_batch_max_bytes)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    if decompressor.unconsumed_tail:
+        raise HTTPException(status_code=413, detail="Event batch too large")
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Invalid gzip body")
+    return decompressed
+
+
+def _parse_datetime(value: Any) -> Optional[datetime]:
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value[0:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        return None
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_optional_str(value: Any) -> bool:
+    return value is None or isinstance(value, str)
+
+
+def _fast_row(item: Dict[str, Any], recipe: bool) -> Optional[Dict[str, Any]]:
+    # the shapes the clients send; anything else goes through the pydantic models, which coerce or reject it
+    event_date = _parse_datetime(item.get("event_date"))
+    event_type = item.get("event_type")
+    code = item.get("verification_code")
+    referrer = item.get("referrer")
+    if event_date is None or not isinstance(event_type, str) or not _is_optional_str(code) or \
+            not _is_optional_str(referrer):
+        return None
+    if not recipe:
+        return site_event_row(event_type, event_date, code, referrer)
+    if not all([_is_int(item.get(x)) for x in RECIPE_EVENT_FIELDS]):
+        return None
+    return recipe_event_row(event_type, item["recipe_id"], item["serving_size"], item["step_number"], event_date,
+                            code, referrer)
+
+
+def _model_row(item: Any, recipe: bool) -> Dict[str, Any]:
+    if recipe:
+        x = api.event.RecipeEvent.parse_obj(item)
+        return recipe_event_row(x.event_type, x.recipe_id, x.serving_size, x.step_number, x.event_date,
+                                x.verification_code, x.referrer)
+    x = api.event.SiteEvent.parse_obj(item)
+    return site_event_row(x.event_type, x.event_date, x.verification_code, x.referrer)
+
+
+def parse_event_batch(body: bytes, recipe_events_only: bool) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    # (site event rows, recipe event rows); an item with a recipe_id is a recipe event
+    try:
+        items = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=422, detail="Expected a list of events")
+    if len(items) > settings.event_batch_max_events:
+        raise HTTPException(status_code=413, detail="Too many events in batch")
+
+    site_rows: List[Dict[str, Any]] = []
+    recipe_rows: List[Dict[str, Any]] = []
+    for i, item in enumerate(items):
+        recipe: bool = recipe_events_only or (isinstance(item, dict) and "recipe_id" in item)
+        row = _fast_row(item, recipe) if isinstance(item, dict) else None
+        if row is None:
+            try:
+                row = _model_row(item, recipe)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=[{**x, "loc": [i] + list(x["loc"])} for x in e.errors()])
+        if recipe:
+            recipe_rows.append(row)
+        else:
+            site_rows.append(row)
+    return site_rows, recipe_rows
+
+
+def submit_event_batch(body: bytes, content_encoding: Optional[str], recipe_events_only: bool) -> Dict[str, int]:
+    site_rows, recipe_rows = parse_event_batch(read_batch_body(body, content_encoding), recipe_events_only)
+    accepted: int = 0
+    if len(site_rows) > 0:
+        accepted = accepted + event_buffer.add_many(Event.__table__, site_rows)
+    if len(recipe_rows) > 0:
+        accepted = accepted + event_buffer.add_many(RecipeEvent.__table__, recipe_rows)
+    return {"accepted": accepted, "dropped": len(site_rows) + len(recipe_rows) - accepted}
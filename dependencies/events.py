@@ -1,22 +1,156 @@
 import logging
+import threading
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import Session
 
-from models.event import Event
+from config import Settings
+from dependencies.database import SessionLocal
+from models.event import Event, RecipeEvent
 
 logger = logging.getLogger("rasoibox")
 
+settings: Settings = Settings()
 
-def emit_event(db: Session, event_type: str, event_timestamp: datetime, code_opt: Optional[str], referrer_opt: Optional[str]):
-    try:
-        referrer = referrer_opt if referrer_opt is not None else "NONE"
-        code = code_opt if code_opt is not None else "NONE"
-        event = Event(event_type=event_type, event_timestamp=event_timestamp, code=code, referrer=referrer)
-        db.add(event)
-        db.commit()
-    except Exception as e:
-        logger.error("Failed to save event.")
-        logger.error(e)
-        return
+
+# Collects analytics events in memory and writes them on a background thread, one multi-row INSERT per table every
+# flush_size events or flush_interval_ms, whichever comes first. Request handlers only append to a list. Once
+# max_pending events are waiting, new ones are dropped and counted rather than slowing down the request path; events
+# still buffered when the server stops are flushed by stop(). A chunk the database rejects is split in halves and
+# retried until only the offending rows are left, so one bad event does not take the rest of its chunk with it.
+class EventBuffer():
+    flush_size: int
+    flush_interval_seconds: float
+    max_pending: int
+
+    def __init__(self, flush_size: int = 500, flush_interval_ms: int = 1000, max_pending: int = 10000):
+        self.flush_size = flush_size
+        self.flush_interval_seconds = flush_interval_ms / 1000.0
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._pending: Dict[Table, List[Dict[str, Any]]] = {}
+        self._pending_count: int = 0
+        self._counters: Dict[str, int] = {"accepted": 0, "dropped": 0, "flushed": 0, "failed": 0, "flushes": 0}
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, table: Table, row: Dict[str, Any]) -> bool:
+        return self.add_many(table, [row]) == 1
+
+    def add_many(self, table: Table, rows: List[Dict[str, Any]]) -> int:
+        # rows added together are written by the same INSERT unless they straddle a flush_size chunk
+        with self._lock:
+            accepted: int = max(0, min(len(rows), self.max_pending - self._pending_count))
+            if accepted > 0:
+                self._pending.setdefault(table, []).extend(rows[0:accepted])
+                self._pending_count = self._pending_count + accepted
+            self._counters["accepted"] = self._counters["accepted"] + accepted
+            self._counters["dropped"] = self._counters["dropped"] + len(rows) - accepted
+            full = self._pending_count >= self.flush_size
+        if full:
+            self._wakeup.set()
+        return accepted
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="event-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval_seconds)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            self._pending_count = 0
+        if len(pending) == 0:
+            return 0
+
+        flushed: int = 0
+        db = SessionLocal()
+        try:
+            for table, rows in pending.items():
+                for i in range(0, len(rows), self.flush_size):
+                    flushed = flushed + self._write(table, rows[i:i + self.flush_size], db)
+        finally:
+            db.close()
+        with self._lock:
+            self._counters["flushed"] = self._counters["flushed"] + flushed
+            self._counters["flushes"] = self._counters["flushes"] + 1
+        return flushed
+
+    def _write(self, table: Table, rows: List[Dict[str, Any]], db: Session) -> int:
+        try:
+            db.execute(insert(table).values(rows))
+            db.commit()
+            return len(rows)
+        except Exception as e:
+            db.rollback()
+            # a lost connection fails every row the same way, splitting would only repeat the error
+            if len(rows) == 1 or (isinstance(e, DBAPIError) and e.connection_invalidated):
+                logger.exception("Failed to write {} {}.".format(len(rows), table.name))
+                with self._lock:
+                    self._counters["failed"] = self._counters["failed"] + len(rows)
+                return 0
+        half: int = len(rows) // 2
+        return self._write(table, rows[0:half], db) + self._write(table, rows[half:], db)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "pending": self._pending_count}
+
+
+event_buffer: EventBuffer = EventBuffer(flush_size=settings.event_flush_size,
+                                        flush_interval_ms=settings.event_flush_interval_ms,
+                                        max_pending=settings.event_max_pending)
+
+
+def site_event_row(event_type: str, event_timestamp: datetime, code_opt: Optional[str],
+                   referrer_opt: Optional[str]) -> Dict[str, Any]:
+    return {
+        "event_type": event_type,
+        "event_timestamp": event_timestamp,
+        "code": code_opt if code_opt is not None else "NONE",
+        "referrer": referrer_opt if referrer_opt is not None else "NONE"
+    }
+
+
+def recipe_event_row(event_type: str, recipe_id: int, serving_size: int, step_number: int, event_timestamp: datetime,
+                     code_opt: Optional[str], referrer_opt: Optional[str]) -> Dict[str, Any]:
+    return {
+        "event_type": event_type,
+        "recipe_id": recipe_id,
+        "serving_size": serving_size,
+        "step_number": step_number,
+        "event_timestamp": event_timestamp,
+        "code": code_opt if code_opt is not None else "NONE",
+        "referrer": referrer_opt if referrer_opt is not None else "NONE"
+    }
+
+
+def emit_event(event_type: str, event_timestamp: datetime, code_opt: Optional[str], referrer_opt: Optional[str]):
+    event_buffer.add(Event.__table__, site_event_row(event_type, event_timestamp, code_opt, referrer_opt))
+
+
+def emit_recipe_event(event_type: str, recipe_id: int, serving_size: int, step_number: int,
+                      event_timestamp: datetime, code_opt: Optional[str], referrer_opt: Optional[str]):
+    event_buffer.add(RecipeEvent.__table__, recipe_event_row(event_type, recipe_id, serving_size, step_number,
+                                                             event_timestamp, code_opt, referrer_opt))
@@ -0,0 +1,41 @@
+import logging
+from contextlib import contextmanager
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import text
+
+from dependencies.database import get_engine
+
+logger = logging.getLogger("rasoibox")
+
+ALEMBIC_CONFIG_PATH = "alembic.ini"
+MIGRATION_LOCK_NAME = "rasoibox_migrations"
+MIGRATION_LOCK_TIMEOUT_SECONDS = 300
+
+
+@contextmanager
+def migration_lock():
+    # every uvicorn worker migrates on startup; a mysql named lock lets one of them at a time change the schema, and the
+    # rest find it already up to date. The lock belongs to this connection, so it is released if the process dies.
+    engine = get_engine()
+    if engine.dialect.name != "mysql":
+        yield
+        return
+    with engine.connect() as connection:
+        acquired = connection.execute(text("select get_lock(:name, :timeout)"),
+                                      {"name": MIGRATION_LOCK_NAME, "timeout": MIGRATION_LOCK_TIMEOUT_SECONDS}).scalar()
+        if acquired != 1:
+            raise RuntimeError("Timed out waiting for another process to finish migrating the database.")
+        try:
+            yield
+        finally:
+            connection.execute(text("select release_lock(:name)"), {"name": MIGRATION_LOCK_NAME})
+
+
+def upgrade_database():
+    config = Config(ALEMBIC_CONFIG_PATH)
+    # keep the server's logging setup instead of the one in alembic.ini
+    config.attributes["configure_logger"] = False
+    command.upgrade(config, "head")
+    logger.info("Database schema is up to date.")
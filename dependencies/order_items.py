@@ -0,0 +1,74 @@
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, exists
+from sqlalchemy.orm import Session
+
+from dependencies.catalog import Catalog, get_catalog
+from models.orders import Order, OrderItem
+from models.recipes import RecipePrice
+
+logger = logging.getLogger("rasoibox")
+
+
+def to_order_items(order: Order, recipe_prices: List[RecipePrice]) -> List[OrderItem]:
+    return [OrderItem(
+        order_id=order.id,
+        recipe_id=x.recipe_id,
+        serving_size=x.serving_size,
+        price=x.price,
+        order_date=order.order_date
+    ) for x in recipe_prices]
+
+
+def replace_order_items(order: Order, recipe_prices: List[RecipePrice], db: Session):
+    # an intent order can be placed again with a different cart; its items follow the latest one
+    db.query(OrderItem).filter(OrderItem.order_id == order.id).delete(synchronize_session=False)
+    db.add_all(to_order_items(order, recipe_prices))
+
+
+def items_from_recipes_json(order: Order, catalog: Catalog) -> List[OrderItem]:
+    # the breakdown keeps what was charged per recipe price id; fall back to the current price if it is missing
+    charged: Dict[str, float] = (order.order_breakdown_dollars or {}).get("items", {})
+    items: List[OrderItem] = []
+    for recipe_id, serving_size in (order.recipes or {}).items():
+        recipe_price: Optional[RecipePrice] = catalog.get_price(int(recipe_id), serving_size)
+        if recipe_price is None:
+            logger.warning("Order {} has unknown recipe {} for {} servings".format(order.user_facing_order_id,
+                                                                                   recipe_id, serving_size))
+            continue
+        items.append(OrderItem(
+            order_id=order.id,
+            recipe_id=recipe_price.recipe_id,
+            serving_size=serving_size,
+            price=charged.get(str(recipe_price.id), recipe_price.price),
+            order_date=order.order_date
+        ))
+    return items
+
+
+def order_has_recipe(order: Order, recipe_id: int, db: Session) -> bool:
+    recipe_ids: List[int] = [x.recipe_id for x in db.query(OrderItem.recipe_id).filter(
+        OrderItem.order_id == order.id).all()]
+    if len(recipe_ids) == 0:
+        # placed before order_items existed and not backfilled yet
+        return str(recipe_id) in (order.recipes or {})
+    return recipe_id in recipe_ids
+
+
+def backfill_order_items(db: Session, batch_size: int = 500) -> int:
+    catalog: Catalog = get_catalog()
+    after_id: int = 0
+    backfilled: int = 0
+    while True:
+        orders: List[Order] = db.query(Order).filter(
+            and_(Order.id > after_id, ~exists().where(OrderItem.order_id == Order.id))).order_by(Order.id).limit(
+            batch_size).all()
+        if len(orders) == 0:
+            return backfilled
+        for order in orders:
+            db.add_all(items_from_recipes_json(order, catalog))
+        db.commit()
+        backfilled += len(orders)
+        after_id = orders[-1].id
+        logger.info("Backfilled order items through order {}".format(after_id))
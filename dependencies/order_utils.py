@@ -1,13 +1,16 @@
 import datetime
 
 
-def get_pretty_estimated_delivery_date(order_date: datetime.datetime) -> str:
-    day_of_week = order_date.weekday()
+def get_days_to_delivery(day_of_week: int) -> int:
+    # the sunday after next, or the one after that when ordered from thursday on
     days_to_sunday: int
     if day_of_week < 3:
         days_to_sunday = 6 - day_of_week
     else:
         days_to_sunday = 7 + 6 - day_of_week
-    days_to_sunday = days_to_sunday + 7
-    estimated_delivery_date = order_date + datetime.timedelta(days=days_to_sunday)
+    return days_to_sunday + 7
+
+
+def get_pretty_estimated_delivery_date(order_date: datetime.datetime) -> str:
+    estimated_delivery_date = order_date + datetime.timedelta(days=get_days_to_delivery(order_date.weekday()))
     return estimated_delivery_date.strftime("%a, %b %d, %Y")
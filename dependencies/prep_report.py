@@ -0,0 +1,95 @@
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from dependencies.order_utils import get_days_to_delivery
+from models.orders import Order, OrderItem, PaymentStatusEnum
+from models.recipes import RecipeIngredient, Ingredient
+
+logger = logging.getLogger("rasoibox")
+
+# unit as written in recipe metadata -> (unit we buy in, factor to convert to it)
+UNIT_CONVERSIONS: Dict[str, Tuple[str, float]] = {
+    "g": ("g", 1.0),
+    "gram": ("g", 1.0),
+    "kg": ("g", 1000.0),
+    "oz": ("g", 28.3495),
+    "lb": ("g", 453.592),
+    "ml": ("ml", 1.0),
+    "l": ("ml", 1000.0),
+    "liter": ("ml", 1000.0),
+    "tsp": ("tsp", 1.0),
+    "teaspoon": ("tsp", 1.0),
+    "tbsp": ("tsp", 3.0),
+    "tablespoon": ("tsp", 3.0),
+    "cup": ("tsp", 48.0),
+}
+
+# weekday -> days from order to delivery, and the longest of those, from the formula the order emails use
+DAYS_TO_DELIVERY = np.array([get_days_to_delivery(x) for x in range(7)])
+MAX_DAYS_TO_DELIVERY = int(DAYS_TO_DELIVERY.max())
+
+REPORT_COLUMNS = ["ingredient_id", "ingredient", "unit", "quantity", "recipes"]
+
+
+def normalize_units(units: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    cleaned = units.fillna("").str.strip().str.lower().str.rstrip(".")
+    # "cups", "tbsps", "grams" -> singular, without touching units that are short to begin with
+    singular = cleaned.where(~((cleaned.str.len() > 2) & cleaned.str.endswith("s")), cleaned.str[0:-1])
+    normalized = singular.map({k: v[0] for k, v in UNIT_CONVERSIONS.items()})
+    factors = singular.map({k: v[1] for k, v in UNIT_CONVERSIONS.items()})
+    # units we do not know how to convert are summed as they are
+    return normalized.fillna(cleaned), factors.fillna(1.0)
+
+
+def estimated_delivery_dates(order_dates: pd.Series) -> pd.Series:
+    # vectorized get_pretty_estimated_delivery_date
+    days_to_sunday = DAYS_TO_DELIVERY[order_dates.dt.weekday.to_numpy()]
+    return (order_dates + pd.to_timedelta(days_to_sunday, unit="D")).dt.normalize()
+
+
+def load_order_items(start: date, end: date, db: Session) -> pd.DataFrame:
+    earliest_order = datetime.combine(start, datetime.min.time()) - timedelta(days=MAX_DAYS_TO_DELIVERY)
+    rows = db.query(OrderItem.recipe_id, OrderItem.serving_size, OrderItem.order_date).join(
+        Order, Order.id == OrderItem.order_id).filter(
+        and_(OrderItem.order_date >= earliest_order, OrderItem.order_date < datetime.combine(end, datetime.min.time()),
+             Order.payment_status == PaymentStatusEnum.COMPLETED)).all()
+    items = pd.DataFrame(rows, columns=["recipe_id", "serving_size", "order_date"])
+    if len(items) == 0:
+        return items
+    delivery = estimated_delivery_dates(pd.to_datetime(items["order_date"]))
+    return items[(delivery >= pd.Timestamp(start)) & (delivery < pd.Timestamp(end))]
+
+
+# total ingredient quantities, in purchasing units, for completed orders delivered in [start, end)
+def build_prep_report(start: date, end: date, db: Session) -> pd.DataFrame:
+    items = load_order_items(start, end, db)
+    if len(items) == 0:
+        return pd.DataFrame(columns=REPORT_COLUMNS)
+
+    boxes = items.groupby(["recipe_id", "serving_size"]).size().rename("boxes").reset_index()
+    rows = db.query(RecipeIngredient.recipe_id, RecipeIngredient.serving_size, RecipeIngredient.ingredient_id,
+                    RecipeIngredient.quantity, RecipeIngredient.unit).filter(
+        RecipeIngredient.recipe_id.in_(boxes["recipe_id"].unique().tolist())).all()
+    recipe_ingredients = pd.DataFrame(rows, columns=["recipe_id", "serving_size", "ingredient_id", "quantity", "unit"])
+
+    needed = boxes.merge(recipe_ingredients, on=["recipe_id", "serving_size"], how="inner")
+    missing = boxes.merge(recipe_ingredients, on=["recipe_id", "serving_size"], how="left", indicator=True)
+    for x in missing[missing["_merge"] == "left_only"].itertuples():
+        logger.warning("No ingredients for recipe {} at {} servings".format(x.recipe_id, x.serving_size))
+
+    needed["unit"], factors = normalize_units(needed["unit"])
+    needed["quantity"] = needed["quantity"].fillna(0.0).to_numpy() * factors.to_numpy() * needed["boxes"].to_numpy()
+    report = needed.groupby(["ingredient_id", "unit"], as_index=False).agg(
+        quantity=("quantity", "sum"), recipes=("recipe_id", "nunique"))
+
+    names = pd.DataFrame(db.query(Ingredient.id, Ingredient.name).filter(
+        Ingredient.id.in_(report["ingredient_id"].unique().tolist())).all(), columns=["ingredient_id", "ingredient"])
+    report = report.merge(names, on="ingredient_id", how="left")
+    report["quantity"] = report["quantity"].round(2)
+    return report[REPORT_COLUMNS].sort_values(["ingredient", "unit"]).reset_index(drop=True)
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+from starlette.requests import Request
+from starlette.responses import Response
+
+import api.recipes
+from api.recipes import RecipeMetadata, Quantity
+from dependencies.catalog import CATALOG_TTL_SECONDS, catalog_version, get_catalog
+from dependencies.recipe_steps import assemble_recipe_steps
+from dependencies.responses import dumps
+from models.recipes import Recipe, RecipeIngredient, RecipeInYourKitchen, RecipeStep, Ingredient, InYourKitchen
+
+logger = logging.getLogger("rasoibox")
+
+METADATA = "metadata"
+STEPS = "steps"
+
+
+class RecipeDocument():
+    body: bytes
+    etag: str
+    version: int
+    built_at: float
+
+    def __init__(self, body: bytes, version: int):
+        self.body = body
+        self.etag = "\"{}\"".format(hashlib.sha256(body).hexdigest())
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def is_stale(self, version: int) -> bool:
+        return self.version != version or time.monotonic() - self.built_at > CATALOG_TTL_SECONDS
+
+
+# serialized documents per (kind, recipe id, serving size); tied to the shared catalog version like the catalog itself,
+# so a write that invalidates the catalog rebuilds them in every server process
+_lock = threading.Lock()
+_documents: Dict[Tuple[str, int, int], RecipeDocument] = {}
+
+
+def assemble_recipe_metadata(recipe: Recipe, serving_size: int, db: Session) -> Optional[RecipeMetadata]:
+    recipe_ingredients: List[RecipeIngredient] = db.query(RecipeIngredient).filter(
+        and_(RecipeIngredient.recipe_id == recipe.id, RecipeIngredient.serving_size == serving_size)).order_by(
+        RecipeIngredient.id).all()
+    if len(recipe_ingredients) == 0:
+        return None
+    recipe_in_your_kitchens: List[RecipeInYourKitchen] = db.query(RecipeInYourKitchen).filter(
+        RecipeInYourKitchen.recipe_id == recipe.id).all()
+
+    ingredients_to_units: Dict[int, str] = {x.ingredient_id: x.unit for x in recipe_ingredients}
+    ingredients_to_quantities: Dict[int, List[Quantity]] = {}
+    for x in recipe_ingredients:
+        ingredients_to_quantities.setdefault(x.ingredient_id, []).append(
+            Quantity(amount=x.quantity, serving_size=x.serving_size))
+    in_your_kitchen_to_ors_ids: Dict[int, List[int]] = {x.in_your_kitchen_id: x.or_ids if x.or_ids is not None else []
+                                                        for x in recipe_in_your_kitchens}
+
+    ingredients: List[Ingredient] = db.query(Ingredient).filter(
+        Ingredient.id.in_(list(ingredients_to_units.keys()))).order_by(Ingredient.id).all()
+    # the items and their alternatives resolve in one query
+    all_in_your_kitchen_ids: Set[int] = set(in_your_kitchen_to_ors_ids.keys()).union(
+        *in_your_kitchen_to_ors_ids.values())
+    in_your_kitchen_names: Dict[int, str] = {x.id: x.name for x in db.query(InYourKitchen).filter(
+        InYourKitchen.id.in_(all_in_your_kitchen_ids)).all()} if len(all_in_your_kitchen_ids) > 0 else {}
+
+    return RecipeMetadata(
+        recipe_id=recipe.id,
+        recipe_name=recipe.name,
+        ingredients=[api.recipes.Ingredient(name=x.name, quantities=ingredients_to_quantities[x.id],
+                                            unit=ingredients_to_units[x.id]) for x in ingredients],
+        in_your_kitchens=[api.recipes.InYourKitchen(
+            name=in_your_kitchen_names[x],
+            or_=[in_your_kitchen_names[y] for y in in_your_kitchen_to_ors_ids[x] if y in in_your_kitchen_names]
+        ) for x in sorted(in_your_kitchen_to_ors_ids.keys()) if x in in_your_kitchen_names],
+        prep_time=recipe.prep_time_minutes,
+        cook_time=recipe.cook_time_minutes,
+        image_url=recipe.image_url,
+        long_description=recipe.long_description,
+        tags=recipe.tags if recipe.tags is not None else []
+    )
+
+
+def _build_document(kind: str, recipe: Recipe, serving_size: int, version: int, db: Session) \
+        -> Optional[RecipeDocument]:
+    if kind == METADATA:
+        content = assemble_recipe_metadata(recipe, serving_size, db)
+    else:
+        content = assemble_recipe_steps(recipe.id, serving_size, db)
+    if content is None or (kind == STEPS and len(content) == 0):
+        return None
+    return RecipeDocument(dumps(content), version)
+
+
+def get_recipe_document(kind: str, recipe: Recipe, serving_size: int, db: Session) -> Optional[RecipeDocument]:
+    key = (kind, recipe.id, serving_size)
+    version = catalog_version()
+    document: Optional[RecipeDocument] = _documents.get(key)
+    if document is not None and not document.is_stale(version):
+        return document
+
+    document = _build_document(kind, recipe, serving_size, version, db)
+    with _lock:
+        if document is not None:
+            _documents[key] = document
+        else:
+            _documents.pop(key, None)
+    return document
+
+
+def warm_recipe_documents(recipe_id: int, db: Session):
+    # build the documents as part of the write so the first reader after it does not pay for them; callers invalidate
+    # the catalog first, which is what makes the other server processes drop their copies
+    recipe: Optional[Recipe] = get_catalog().get_recipe(recipe_id)
+    if recipe is None:
+        return
+    with _lock:
+        for key in [x for x in _documents.keys() if x[1] == recipe_id]:
+            del _documents[key]
+    metadata_serving_sizes = [x.serving_size for x in db.query(RecipeIngredient.serving_size).filter(
+        RecipeIngredient.recipe_id == recipe_id).distinct().all()]
+    steps_serving_sizes = [x.serving_size for x in db.query(RecipeStep.serving_size).filter(
+        RecipeStep.recipe_id == recipe_id).distinct().all()]
+    for serving_size in metadata_serving_sizes:
+        get_recipe_document(METADATA, recipe, serving_size, db)
+    for serving_size in steps_serving_sizes:
+        get_recipe_document(STEPS, recipe, serving_size, db)
+    logger.info("Warmed documents for recipe {}: metadata {}, steps {}".format(recipe_id, metadata_serving_sizes,
+                                                                              steps_serving_sizes))
+
+
+def document_response(document: RecipeDocument, request: Request) -> Response:
+    headers = {"ETag": document.etag, "Cache-Control": "no-cache"}
+    if_none_match: Optional[str] = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [x.strip() for x in if_none_match.split(",")]
+        if "*" in tags or document.etag in tags or "W/" + document.etag in tags:
+            return Response(status_code=304, headers=headers)
+    return Response(content=document.body, media_type="application/json", headers=headers)
@@ -0,0 +1,39 @@
+from typing import Dict, List, Set
+
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+import api.recipes
+from models.recipes import RecipeStep, Ingredient, InYourKitchen
+
+
+def assemble_recipe_steps(recipe_id: int, serving_size: int, db: Session) -> List[api.recipes.RecipeStep]:
+    recipe_steps: List[RecipeStep] = db.query(RecipeStep).filter(
+        and_(RecipeStep.recipe_id == recipe_id, RecipeStep.serving_size == serving_size)).all()
+    if len(recipe_steps) == 0:
+        return []
+
+    step_ingredient_ids: Dict[int, List[int]] = {x.id: x.ingredients for x in recipe_steps}
+    step_in_your_kitchen_ids: Dict[int, List[int]] = {x.id: x.in_your_kitchens for x in recipe_steps}
+    all_ingredient_ids: Set[int] = {y for x in step_ingredient_ids.values() for y in x}
+    all_in_your_kitchen_ids: Set[int] = {y for x in step_in_your_kitchen_ids.values() for y in x}
+    ingredient_names: Dict[int, str] = {x.id: x.name for x in db.query(Ingredient.id, Ingredient.name).filter(
+        Ingredient.id.in_(all_ingredient_ids)).all()} if len(all_ingredient_ids) > 0 else {}
+    in_your_kitchen_names: Dict[int, str] = {x.id: x.name for x in db.query(
+        InYourKitchen.id, InYourKitchen.name).filter(InYourKitchen.id.in_(all_in_your_kitchen_ids)).all()} \
+        if len(all_in_your_kitchen_ids) > 0 else {}
+
+    steps: List[api.recipes.RecipeStep] = [api.recipes.RecipeStep(
+        step_number=x.step_number,
+        title=x.title,
+        instructions=x.instructions,
+        tips=x.tips,
+        chefs_hats=x.chefs_hats,
+        ingredients=[ingredient_names[y] for y in step_ingredient_ids[x.id] if y in ingredient_names],
+        in_your_kitchen=[in_your_kitchen_names[y] for y in step_in_your_kitchen_ids[x.id] if
+                         y in in_your_kitchen_names],
+        gif_url=x.gif_url
+    ) for x in recipe_steps]
+    steps.sort(key=lambda r: r.step_number)
+    return steps
+
@@ -4,8 +4,9 @@ from random import random
 
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
+from stripe.error import InvalidRequestError
 
-from dependencies.stripe_utils import create_promo_code_from_coupon, find_promo_code_id
+from dependencies.stripe_utils import create_promo_code_from_coupon
 from models.orders import PromoCode
 
 logger = logging.getLogger("rasoibox")
@@ -31,10 +32,8 @@ def to_promo_amount_string(promo_code: PromoCode) -> str:
 def create_stripe_promo_code(stripe_coupon_id: str, customer_facing_code: str, redeemable_by: str,
                              db: Session) -> PromoCode:
     try:
-        create_promo_code_from_coupon(stripe_coupon_id, customer_facing_code)
-        promo_code = find_promo_code_id(customer_facing_code)
-        if promo_code is None:
-            raise HTTPException(status_code=400, detail="Unable to find promo code.")
+        # the created promotion code already carries its coupon, no need to look it up again
+        promo_code = create_promo_code_from_coupon(stripe_coupon_id, customer_facing_code)
 
         if not promo_code.active:
             raise HTTPException(status_code=400, detail="Created promo code is not active.")
@@ -54,6 +53,13 @@ def create_stripe_promo_code(stripe_coupon_id: str, customer_facing_code: str, r
         db.commit()
 
         return promo_code_db
-    except Exception as e:
+    except HTTPException:
+        raise
+    except InvalidRequestError as e:
         logger.exception(e)
         raise HTTPException(status_code=400, detail="Invalid stripe coupon id {}".format(stripe_coupon_id))
+    except Exception as e:
+        # network errors, rate limits and stripe outages can succeed when tried again, so they are not the caller's
+        # fault
+        logger.exception(e)
+        raise HTTPException(status_code=502, detail="Could not create promo code in stripe")
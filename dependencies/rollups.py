@@ -0,0 +1,158 @@
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import Table, and_, case, exists, func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.orm import Session
+
+from config import Settings
+from dependencies.database import SessionLocal, insert_ignore
+from models.event import Event, RecipeEvent
+from models.rollups import EventHourlyCount, RecipeEventHourlyCount, RollupWatermark
+from models.signups import VerifiedSignUp
+
+logger = logging.getLogger("rasoibox")
+
+settings: Settings = Settings()
+
+HOUR_FORMAT = "%Y-%m-%d %H:00:00"
+
+
+def count_events(after_id: int, up_to_id: int, db: Session) -> List[Dict[str, Any]]:
+    hour = func.date_format(Event.event_timestamp, HOUR_FORMAT).label("hour")
+    verified = exists().where(VerifiedSignUp.verification_code == Event.code)
+    rows = db.query(Event.event_type, hour, func.count(Event.id), func.sum(case((verified, 0), else_=1))).filter(
+        and_(Event.id > after_id, Event.id <= up_to_id, Event.event_timestamp.isnot(None))).group_by(
+        Event.event_type, "hour").all()
+    return [{"event_type": x[0], "hour": x[1], "count": x[2], "unverified_count": int(x[3])} for x in rows]
+
+
+def count_recipe_events(after_id: int, up_to_id: int, db: Session) -> List[Dict[str, Any]]:
+    hour = func.date_format(RecipeEvent.event_timestamp, HOUR_FORMAT).label("hour")
+    rows = db.query(RecipeEvent.recipe_id, RecipeEvent.step_number, RecipeEvent.event_type, hour,
+                    func.count(RecipeEvent.id)).filter(
+        and_(RecipeEvent.id > after_id, RecipeEvent.id <= up_to_id, RecipeEvent.event_timestamp.isnot(None))) \
+        .group_by(RecipeEvent.recipe_id, RecipeEvent.step_number, RecipeEvent.event_type, "hour").all()
+    return [{"recipe_id": x[0], "step_number": x[1], "event_type": x[2], "hour": x[3], "count": x[4]} for x in rows]
+
+
+class Rollup():
+    source_id: Any
+    count: Callable[[int, int, Session], List[Dict[str, Any]]]
+    target: Table
+    count_columns: List[str]
+
+    def __init__(self, source_id: Any, count: Callable[[int, int, Session], List[Dict[str, Any]]], target: Table,
+                 count_columns: List[str]):
+        self.source_id = source_id
+        self.count = count
+        self.target = target
+        self.count_columns = count_columns
+
+
+# source table -> how its rows are counted into the rollup
+ROLLUPS: Dict[str, Rollup] = {
+    "events": Rollup(Event.id, count_events, EventHourlyCount.__table__, ["count", "unverified_count"]),
+    "recipe_events": Rollup(RecipeEvent.id, count_recipe_events, RecipeEventHourlyCount.__table__, ["count"]),
+}
+
+
+def _lock_watermark(name: str, db: Session) -> RollupWatermark:
+    # the row lock keeps rollups in other server processes from counting the same batch
+    watermark: Optional[RollupWatermark] = db.query(RollupWatermark).filter(
+        RollupWatermark.name == name).with_for_update().first()
+    if watermark is None:
+        db.execute(insert_ignore(RollupWatermark).values(name=name, last_id=0, settled_id=0,
+                                                            updated_on=datetime.now()))
+        db.commit()
+        watermark = db.query(RollupWatermark).filter(RollupWatermark.name == name).with_for_update().one()
+    return watermark
+
+
+def _add_counts(rollup: Rollup, rows: List[Dict[str, Any]], db: Session):
+    statement = mysql_insert(rollup.target).values(rows)
+    db.execute(statement.on_duplicate_key_update(
+        {x: rollup.target.c[x] + statement.inserted[x] for x in rollup.count_columns}))
+
+
+def rollup_source(name: str, db: Session, batch_size: int, settle: bool = True) -> int:
+    # Adds source rows past the watermark to the rollup, one batch of ids per transaction, and returns how many ids it
+    # moved past. Ids are handed out before the inserts that use them commit, so with settle only rows up to the max id
+    # seen on the previous run are counted; the backfill, with nothing else writing, counts up to the current max.
+    rollup: Rollup = ROLLUPS[name]
+    advanced: int = 0
+    while True:
+        watermark = _lock_watermark(name, db)
+        current_max: int = db.query(func.max(rollup.source_id)).scalar() or 0
+        up_to: int = min(watermark.settled_id, current_max) if settle else current_max
+        if watermark.last_id >= up_to:
+            watermark.settled_id = max(watermark.settled_id, current_max)
+            watermark.updated_on = datetime.now()
+            db.commit()
+            return advanced
+
+        batch_end: int = min(watermark.last_id + batch_size, up_to)
+        rows = rollup.count(watermark.last_id, batch_end, db)
+        if len(rows) > 0:
+            _add_counts(rollup, rows, db)
+        advanced = advanced + batch_end - watermark.last_id
+        watermark.last_id = batch_end
+        watermark.updated_on = datetime.now()
+        db.commit()
+
+
+def reset_rollup(name: str, db: Session):
+    rollup: Rollup = ROLLUPS[name]
+    _lock_watermark(name, db)
+    db.execute(rollup.target.delete())
+    db.query(RollupWatermark).filter(RollupWatermark.name == name).update(
+        {RollupWatermark.last_id: 0, RollupWatermark.settled_id: 0, RollupWatermark.updated_on: datetime.now()})
+    db.commit()
+
+
+# Keeps the rollups current from a background thread, every interval_seconds.
+class RollupWorker():
+    interval_seconds: float
+    batch_size: int
+
+    def __init__(self, interval_seconds: float = 60.0, batch_size: int = 50000):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="event-rollups", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.interval_seconds):
+            self.run_once()
+
+    def run_once(self):
+        db = SessionLocal()
+        try:
+            for name in ROLLUPS.keys():
+                advanced = rollup_source(name, db, self.batch_size)
+                if advanced > 0:
+                    logger.debug("Rolled up {} ids of {}".format(advanced, name))
+        except Exception:
+            logger.exception("Failed to roll up events.")
+            db.rollback()
+        finally:
+            db.close()
+
+
+rollup_worker: RollupWorker = RollupWorker(interval_seconds=settings.rollup_interval_seconds)
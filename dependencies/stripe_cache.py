@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import stripe
+from sqlalchemy.orm import Session
+
+from config import Settings
+from dependencies.cache_versions import load_cache_version, bump_cache_version
+
+logger = logging.getLogger("rasoibox")
+
+settings: Settings = Settings()
+
+PRODUCT = "product"
+PRODUCT_BY_NAME = "product_name"
+PROMOTION_CODE = "promotion_code"  # keyed by customer facing code, holds the newest active promotion code for it
+COUPON = "coupon"
+
+CACHE_VERSION_NAME = "stripe"
+
+# object events the cache listens to on the stripe webhook endpoint
+STRIPE_CACHE_EVENTS: List[str] = [
+    "product.created", "product.updated", "product.deleted",
+    "promotion_code.created", "promotion_code.updated",
+    "coupon.created", "coupon.updated", "coupon.deleted",
+]
+
+
+class CachedStripeObject():
+    value: Any
+    # unix time the value describes stripe as of: when it was fetched, or when the event carrying it was created
+    as_of: int
+    loaded_at: float
+
+    def __init__(self, value: Any, as_of: int):
+        self.value = value
+        self.as_of = as_of
+        self.loaded_at = time.monotonic()
+
+
+# Read-through cache of the stripe objects we look up on the request path. Webhook events are applied in the server
+# process that handles them, which also bumps a shared version; every process checks that version at most every
+# version_check_seconds and starts over when it moved, so a deactivated promotion code is not served for long anywhere.
+# Entries also expire after ttl_seconds, in case an event is missed. Events older than what is cached are ignored since
+# stripe does not deliver them in order.
+class StripeObjectCache():
+    ttl_seconds: float
+    version_check_seconds: float
+    load_version: Optional[Callable[[], int]]
+
+    def __init__(self, ttl_seconds: float, load_version: Optional[Callable[[], int]] = None,
+                 version_check_seconds: float = 5.0):
+        self.ttl_seconds = ttl_seconds
+        self.load_version = load_version
+        self.version_check_seconds = version_check_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], CachedStripeObject] = {}
+        self._version: Optional[int] = None
+        self._version_checked_at: float = 0.0
+
+    def _check_version(self):
+        if self.load_version is None or time.monotonic() - self._version_checked_at < self.version_check_seconds:
+            return
+        self._version_checked_at = time.monotonic()
+        try:
+            version: int = self.load_version()
+        except Exception:
+            logger.exception("Failed to read the stripe cache version.")
+            return
+        with self._lock:
+            if self._version is not None and self._version != version:
+                self._entries.clear()
+            self._version = version
+
+    def get(self, kind: str, key: str) -> Optional[Any]:
+        self._check_version()
+        entry: Optional[CachedStripeObject] = self._entries.get((kind, key))
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl_seconds:
+            return None
+        return entry.value
+
+    def put(self, kind: str, key: str, value: Any, as_of: Optional[int] = None):
+        as_of = as_of if as_of is not None else int(time.time())
+        with self._lock:
+            entry: Optional[CachedStripeObject] = self._entries.get((kind, key))
+            if entry is not None and entry.as_of > as_of:
+                return
+            self._entries[(kind, key)] = CachedStripeObject(value, as_of)
+
+    def remove(self, kind: str, key: str, as_of: Optional[int] = None):
+        with self._lock:
+            entry: Optional[CachedStripeObject] = self._entries.get((kind, key))
+            if entry is not None and (as_of is None or entry.as_of <= as_of):
+                del self._entries[(kind, key)]
+
+    def values(self, kind: str) -> List[Tuple[str, Any]]:
+        with self._lock:
+            return [(x[1], y.value) for x, y in self._entries.items() if x[0] == kind]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_stripe_cache_version() -> int:
+    return load_cache_version(CACHE_VERSION_NAME)
+
+
+def bump_stripe_cache_version(db: Session):
+    bump_cache_version(CACHE_VERSION_NAME, db)
+
+
+stripe_cache: StripeObjectCache = StripeObjectCache(settings.stripe_cache_ttl_seconds,
+                                                    load_version=load_stripe_cache_version,
+                                                    version_check_seconds=settings.stripe_cache_version_check_seconds)
+
+
+def cache_product(product: Any, as_of: Optional[int] = None):
+    stripe_cache.put(PRODUCT, product["id"], product, as_of)
+    stripe_cache.put(PRODUCT_BY_NAME, product["name"], product, as_of)
+
+
+def cache_promotion_code(promotion_code: Any, as_of: Optional[int] = None):
+    code: str = promotion_code["code"]
+    current = stripe_cache.get(PROMOTION_CODE, code)
+    if promotion_code["active"]:
+        if current is None or current["id"] == promotion_code["id"] or current["created"] <= promotion_code["created"]:
+            stripe_cache.put(PROMOTION_CODE, code, promotion_code, as_of)
+    elif current is not None and current["id"] == promotion_code["id"]:
+        # an older promotion code with the same code may still be active; the next lookup asks stripe
+        stripe_cache.remove(PROMOTION_CODE, code, as_of)
+
+
+def _cache_coupon_event(coupon: Any, deleted: bool, as_of: int):
+    if deleted:
+        stripe_cache.remove(COUPON, coupon["id"], as_of)
+    else:
+        stripe_cache.put(COUPON, coupon["id"], coupon, as_of)
+    # promotion codes embed their coupon, refresh or drop the ones built on this one
+    for code, promotion_code in stripe_cache.values(PROMOTION_CODE):
+        if promotion_code["coupon"]["id"] != coupon["id"]:
+            continue
+        if deleted:
+            stripe_cache.remove(PROMOTION_CODE, code, as_of)
+        else:
+            promotion_code["coupon"] = coupon
+
+
+def handle_stripe_object_event(event: Dict[str, Any], db: Session):
+    obj = stripe.util.convert_to_stripe_object(event["data"]["object"])
+    as_of: int = event["created"]
+    kind, action = event["type"].rsplit(".", 1)
+    if kind == "product":
+        if action == "deleted":
+            stripe_cache.remove(PRODUCT, obj["id"], as_of)
+            stripe_cache.remove(PRODUCT_BY_NAME, obj["name"], as_of)
+        else:
+            cache_product(obj, as_of)
+    elif kind == "promotion_code":
+        cache_promotion_code(obj, as_of)
+    elif kind == "coupon":
+        _cache_coupon_event(obj, action == "deleted", as_of)
+    # the other server processes drop their copies on their next version check
+    bump_stripe_cache_version(db)
+    logger.debug("Applied {} to the stripe cache".format(event["type"]))
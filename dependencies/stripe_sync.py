@@ -0,0 +1,225 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from stripe.error import APIConnectionError, APIError, RateLimitError
+
+from config import Settings
+from dependencies.catalog import invalidate_catalog
+from dependencies.database import SessionLocal
+from dependencies.stripe_utils import to_product_name, to_cents, list_stripe_products, create_stripe_product, \
+    update_stripe_product, create_stripe_price
+from models.recipes import Recipe, RecipePrice
+
+logger = logging.getLogger("rasoibox")
+
+settings: Settings = Settings()
+
+RUNNING = "RUNNING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+
+class StripeSyncJob():
+    job_id: str
+    status: str
+    total: int
+    created: int
+    updated: int
+    unchanged: int
+    failed: int
+    errors: List[str]
+    started_on: datetime
+    completed_on: Optional[datetime]
+
+    def __init__(self, total: int):
+        self.job_id = uuid.uuid4().hex
+        self.status = RUNNING
+        self.total = total
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.errors = []
+        self.started_on = datetime.now()
+        self.completed_on = None
+
+
+# Jobs live in the memory of the process that started them; they are short and safe to run again, so there is nothing
+# to resume after a restart.
+_jobs_lock = threading.Lock()
+_jobs: Dict[str, StripeSyncJob] = {}
+
+
+def with_retries(call: Callable[[], Any]) -> Any:
+    # every write carries an idempotency key, so a request that reached stripe before the failure is not repeated
+    attempt: int = 1
+    while True:
+        try:
+            return call()
+        except (RateLimitError, APIConnectionError, APIError) as e:
+            # rate limits, network errors and stripe side failures; a rejected request fails the same way every time
+            if attempt >= settings.stripe_sync_max_attempts:
+                raise
+            delay: float = settings.stripe_sync_backoff_seconds * (2 ** (attempt - 1)) * (1 + random.random())
+            logger.warning("Stripe call failed on attempt {}, retrying in {:.1f}s: {}".format(attempt, delay, e))
+            time.sleep(delay)
+            attempt = attempt + 1
+
+
+# what a stripe product should look like for one recipe price, copied off the rows so the pool threads never touch the
+# session
+class ProductSpec():
+    recipe_id: int
+    recipe_name: str
+    description: str
+    image_url: str
+    serving_size: int
+    price: float
+
+    def __init__(self, recipe: Recipe, recipe_price: RecipePrice):
+        self.recipe_id = recipe.id
+        self.recipe_name = recipe.name
+        self.description = recipe.description
+        self.image_url = recipe.image_url
+        self.serving_size = recipe_price.serving_size
+        self.price = recipe_price.pending_price if recipe_price.pending_price is not None else recipe_price.price
+
+
+def _idempotency_key(*parts: Any) -> str:
+    return "catalog-sync-" + "-".join([str(x) for x in parts])
+
+
+def sync_price(spec: ProductSpec, product: Optional[Any]) -> Dict[str, Any]:
+    # brings the stripe product for one recipe price in line with it; returns the ids to store and what was done
+    cents: int = to_cents(spec.price)
+    if product is None:
+        # stripe rejects a reused key with different parameters, so the key covers everything the product is made of
+        contents: str = hashlib.sha256("{}|{}".format(spec.description, spec.image_url).encode("utf-8")).hexdigest()
+        product = with_retries(lambda: create_stripe_product(
+            spec.recipe_name, spec.description, spec.image_url, spec.serving_size, spec.price,
+            idempotency_key=_idempotency_key("product", spec.recipe_id, spec.serving_size, cents, contents[0:16])))
+        return {"product_id": product["id"], "price_id": product["default_price"], "action": "created"}
+
+    default_price = product["default_price"]
+    price_id: Optional[str] = default_price["id"] if default_price is not None else None
+    new_price_id: Optional[str] = None
+    if default_price is None or default_price["unit_amount"] != cents:
+        # stripe prices are immutable, a new amount is a new price that becomes the product's default
+        new_price = with_retries(lambda: create_stripe_price(
+            product["id"], spec.price, idempotency_key=_idempotency_key("price", product["id"], cents)))
+        new_price_id = new_price["id"]
+        price_id = new_price_id
+
+    if new_price_id is None and product["description"] == spec.description and product["images"] == [spec.image_url]:
+        return {"product_id": product["id"], "price_id": price_id, "action": "unchanged"}
+
+    with_retries(lambda: update_stripe_product(product["id"], spec.description, spec.image_url,
+                                               default_price_id=new_price_id))
+    return {"product_id": product["id"], "price_id": price_id, "action": "updated"}
+
+
+def start_stripe_sync(recipe_price_ids: Optional[List[int]] = None) -> StripeSyncJob:
+    db = SessionLocal()
+    try:
+        query = db.query(RecipePrice.id)
+        if recipe_price_ids is not None:
+            query = query.filter(RecipePrice.id.in_(recipe_price_ids))
+        ids: List[int] = [x.id for x in query.all()]
+    finally:
+        db.close()
+
+    job = StripeSyncJob(len(ids))
+    with _jobs_lock:
+        _jobs[job.job_id] = job
+    threading.Thread(target=run_stripe_sync, args=(job, ids), name="stripe-sync-{}".format(job.job_id),
+                     daemon=True).start()
+    return job
+
+
+def run_stripe_sync(job: StripeSyncJob, recipe_price_ids: List[int]):
+    db = SessionLocal()
+    try:
+        recipe_prices: List[RecipePrice] = db.query(RecipePrice).filter(RecipePrice.id.in_(recipe_price_ids)).all()
+        recipes: Dict[int, Recipe] = {x.id: x for x in db.query(Recipe).filter(
+            Recipe.id.in_(list(set([x.recipe_id for x in recipe_prices])))).all()}
+        # one paged listing instead of a search per price
+        products: List[Any] = with_retries(list_stripe_products)
+        products_by_id: Dict[str, Any] = {x["id"]: x for x in products}
+        products_by_name: Dict[str, Any] = {x["name"]: x for x in products}
+        logger.info("Syncing {} prices against {} stripe products".format(len(recipe_prices), len(products)))
+
+        # the stripe calls run in the pool; the session stays on this thread
+        with ThreadPoolExecutor(max_workers=settings.stripe_sync_concurrency,
+                                thread_name_prefix="stripe-sync") as executor:
+            futures = {}
+            for recipe_price in recipe_prices:
+                recipe: Recipe = recipes[recipe_price.recipe_id]
+                product = products_by_id.get(recipe_price.stripe_product_id) or products_by_name.get(
+                    to_product_name(recipe.name, recipe_price.serving_size))
+                spec = ProductSpec(recipe, recipe_price)
+                futures[executor.submit(sync_price, spec, product)] = (recipe_price, spec)
+
+            for future in as_completed(futures):
+                recipe_price, spec = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.exception("Failed to sync recipe price {}".format(recipe_price.id))
+                    job.failed = job.failed + 1
+                    job.errors.append("{}: {}".format(recipe_price.id, str(e)[0:200]))
+                    continue
+                # the price goes on sale together with the stripe price that charges it; a pending price set again
+                # while this ran is left for the sync that set it
+                db.refresh(recipe_price)
+                recipe_price.stripe_product_id = result["product_id"]
+                recipe_price.stripe_price_id = result["price_id"]
+                recipe_price.price = spec.price
+                if recipe_price.pending_price == spec.price:
+                    recipe_price.pending_price = None
+                db.commit()
+                if result["action"] == "created":
+                    job.created = job.created + 1
+                elif result["action"] == "updated":
+                    job.updated = job.updated + 1
+                else:
+                    job.unchanged = job.unchanged + 1
+
+        job.status = COMPLETED if job.failed == 0 else FAILED
+        logger.info("Stripe sync {} finished: {} created, {} updated, {} unchanged, {} failed".format(
+            job.job_id, job.created, job.updated, job.unchanged, job.failed))
+    except Exception as e:
+        logger.exception("Stripe sync {} failed.".format(job.job_id))
+        db.rollback()
+        job.status = FAILED
+        job.errors.append(str(e)[0:200])
+    finally:
+        job.completed_on = datetime.now()
+        db.close()
+        invalidate_catalog()
+
+
+def get_stripe_sync_job(job_id: str) -> Optional[StripeSyncJob]:
+    return _jobs.get(job_id)
+
+
+def to_stripe_sync_dict(job: StripeSyncJob) -> Dict:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "total": job.total,
+        "done": job.created + job.updated + job.unchanged + job.failed,
+        "created": job.created,
+        "updated": job.updated,
+        "unchanged": job.unchanged,
+        "failed": job.failed,
+        "errors": job.errors,
+        "started_on": job.started_on,
+        "completed_on": job.completed_on
+    }
@@ -1,16 +1,22 @@
 import json
 import logging
-from typing import List, Any, Dict
+from typing import List, Any, Dict, Optional
 
 import stripe
 
 from config import Settings
+from dependencies.stripe_cache import stripe_cache, cache_product, cache_promotion_code, PRODUCT, PRODUCT_BY_NAME, \
+    PROMOTION_CODE
+from middleware.timing import timed
 
 logger = logging.getLogger(__name__)
 
 settings = Settings()
 
 stripe.api_key = settings.stripe_secret_key
+# e.g. http://localhost:12111 to run against stripe-mock
+if settings.stripe_api_base is not None:
+    stripe.api_base = settings.stripe_api_base
 
 
 def to_product_name(name: str, serving_size: int) -> str:
@@ -33,22 +39,26 @@ def create_stripe_product_idempotent(recipe_name: str, description: str, image_u
         return product
 
 
-def update_stripe_product(product_id: str, description: str, image_url: str):
-    return stripe.Product.modify(
-        product_id,
-        description=description,
-        images=[image_url]
-    )
+@timed("stripe")
+def update_stripe_product(product_id: str, description: str, image_url: str, default_price_id: Optional[str] = None):
+    changes: Dict[str, Any] = {"description": description, "images": [image_url]}
+    if default_price_id is not None:
+        changes["default_price"] = default_price_id
+    product = stripe.Product.modify(product_id, **changes)
+    cache_product(product)
+    return product
 
 
-def create_stripe_product(recipe_name: str, description: str, image_url: str, serving_size: int, price: float):
+@timed("stripe")
+def create_stripe_product(recipe_name: str, description: str, image_url: str, serving_size: int, price: float,
+                          idempotency_key: Optional[str] = None):
     price_cents: int = to_cents(price)
     price_data = {
         "currency": "usd",
         "unit_amount": price_cents
     }
     product_name: str = to_product_name(recipe_name, serving_size)
-    return stripe.Product.create(
+    product = stripe.Product.create(
         name=product_name,
         active=True,
         description=description,
@@ -58,16 +68,34 @@ def create_stripe_product(recipe_name: str, description: str, image_url: str, se
         shippable=True,
         images=[image_url],
         default_price_data=price_data,
-        unit_label="item"
+        unit_label="item",
+        idempotency_key=idempotency_key
     )
+    cache_product(product)
+    return product
 
 
 def get_stripe_product_from_id(product_id: str):
-    return stripe.Product.retrieve(product_id)
+    product = stripe_cache.get(PRODUCT, product_id)
+    if product is None:
+        with timed("stripe"):
+            product = stripe.Product.retrieve(product_id)
+        cache_product(product)
+    return product
 
 
 def get_stripe_product(recipe_name: str, serving_size: int):
     product_name: str = to_product_name(recipe_name, serving_size)
+    product = stripe_cache.get(PRODUCT_BY_NAME, product_name)
+    if product is None:
+        product = search_stripe_product(product_name)
+        if product is not None:
+            cache_product(product)
+    return product
+
+
+@timed("stripe")
+def search_stripe_product(product_name: str):
     query = "name:\"{}\"".format(product_name)
     logger.debug("Sending search query: {}".format(query))
     search_results = stripe.Product.search(query=query)
@@ -79,46 +107,74 @@ def get_stripe_product(recipe_name: str, serving_size: int):
     return None
 
 
+@timed("stripe")
+def create_stripe_price(product_id: str, price: float, idempotency_key: Optional[str] = None):
+    return stripe.Price.create(
+        product=product_id,
+        currency="usd",
+        unit_amount=to_cents(price),
+        idempotency_key=idempotency_key
+    )
+
+
+@timed("stripe")
+def list_stripe_products() -> List[Any]:
+    # one page per 100 products, with the default price of each expanded so prices can be compared without more calls
+    return list(stripe.Product.list(active=True, limit=100, expand=["data.default_price"]).auto_paging_iter())
+
+
 def create_checkout_session(price_ids: List[str], success_url: str, cancel_url: str, user_facing_order_id: str,
                             email: str, discounts: List[str] = None):
     line_items = [{"price": price_id, "quantity": 1} for price_id in price_ids]
     promo_codes = [find_promo_code_id(x)["id"] for x in discounts] if discounts is not None else []
     discount_arr = [{"promotion_code": x} for x in promo_codes if x is not None]
-    return stripe.checkout.Session.create(
-        line_items=line_items,
-        mode="payment",
-        success_url=success_url,
-        cancel_url=cancel_url,
-        discounts=discount_arr,
-        automatic_tax={
-            'enabled': True
-        },
-        client_reference_id=user_facing_order_id,
-        customer_email=email,
-        # shipping_address_collection={
-        #     'allowed_countries': ['US']
-        # }
-    )
+    with timed("stripe"):
+        return stripe.checkout.Session.create(
+            line_items=line_items,
+            mode="payment",
+            success_url=success_url,
+            cancel_url=cancel_url,
+            discounts=discount_arr,
+            automatic_tax={
+                'enabled': True
+            },
+            client_reference_id=user_facing_order_id,
+            customer_email=email,
+            # shipping_address_collection={
+            #     'allowed_countries': ['US']
+            # }
+        )
 
 
 def find_promo_code_id(promo_code: str):
-    promo_codes = stripe.PromotionCode.list(code=promo_code)
+    cached = stripe_cache.get(PROMOTION_CODE, promo_code)
+    if cached is not None:
+        return cached
+    with timed("stripe"):
+        promo_codes = stripe.PromotionCode.list(code=promo_code)
     if "data" in promo_codes:
         valid_promo_codes = [x for x in promo_codes["data"] if x["active"]]
         valid_promo_codes.sort(reverse=True, key=lambda x: x["created"])
+        if len(valid_promo_codes) == 0:
+            return None
+        cache_promotion_code(valid_promo_codes[0])
         return valid_promo_codes[0]
     else:
         return None
 
 
+@timed("stripe")
 def create_promo_code_from_coupon(stripe_coupon_id: str, customer_facing_code: str):
-    return stripe.PromotionCode.create(
+    promotion_code = stripe.PromotionCode.create(
         coupon=stripe_coupon_id,
         code=customer_facing_code,
         max_redemptions=1
     )
+    cache_promotion_code(promotion_code)
+    return promotion_code
 
 
+@timed("stripe")
 def create_payment_intent(amount: int, order_id: str):
     return stripe.PaymentIntent.create(
         amount=amount,
@@ -130,10 +186,12 @@ def create_payment_intent(amount: int, order_id: str):
     )
 
 
+@timed("stripe")
 def get_payment_intent(intent_id: str):
     return stripe.PaymentIntent.retrieve(intent_id)
 
 
+@timed("stripe")
 def modify_payment_intent(intent_id: str, amount: int, order_id: str, order_breakdown: Dict[str, Any]):
     order_metadata: Dict[str, str] = {
         'user_facing_order_id': order_id,
@@ -0,0 +1,175 @@
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from dependencies.database import SessionLocal, insert_ignore
+from models.webhooks import StripeWebhookEvent, WebhookEventStatusEnum
+
+logger = logging.getLogger("rasoibox")
+
+# (event payload, db) -> None; raising retries the event later
+WebhookHandler = Callable[[Dict[str, Any], Session], None]
+
+
+def record_webhook_event(event: Dict[str, Any], db: Session) -> bool:
+    # stripe retries deliveries it did not see acknowledged, so the same event id can arrive more than once; the unique
+    # event id lets the database drop the duplicate in the same statement. Returns whether the event is new.
+    now = datetime.now()
+    result = db.execute(insert_ignore(StripeWebhookEvent).values(
+        event_id=event["id"],
+        event_type=event["type"],
+        payload=event,
+        status=WebhookEventStatusEnum.RECEIVED,
+        attempts=0,
+        next_attempt_on=now,
+        received_on=now
+    ))
+    db.commit()
+    return result.rowcount == 1
+
+
+# Processes stripe webhook events out of the stripe_webhook_events inbox on a background thread, so the webhook can be
+# acknowledged as soon as the event is stored. Events are claimed with a conditional update, which keeps several
+# server processes from handling the same one. A failed event is retried with exponential backoff until max_attempts;
+# an event whose handler rejects it with a 4xx HTTPException is not going to succeed later and fails right away.
+class StripeWebhookWorker():
+    handlers: Dict[str, WebhookHandler]
+    max_attempts: int
+    backoff_seconds: float
+    poll_seconds: float
+    claim_seconds: float
+    batch_size: int
+
+    def __init__(self, max_attempts: int = 5, backoff_seconds: float = 5.0, poll_seconds: float = 5.0,
+                 claim_seconds: float = 300.0, batch_size: int = 20):
+        self.handlers = {}
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.claim_seconds = claim_seconds
+        self.batch_size = batch_size
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, event_type: str, handler: WebhookHandler):
+        self.handlers[event_type] = handler
+
+    def handles(self, event_type: str) -> bool:
+        return event_type in self.handlers
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="stripe-webhooks", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                while not self._stopping.is_set() and self.process_pending() > 0:
+                    pass
+            except Exception:
+                logger.exception("Failed to poll stripe webhook events.")
+            self._wakeup.wait(self.poll_seconds)
+            self._wakeup.clear()
+
+    def process_pending(self) -> int:
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            # a PROCESSING event whose claim ran out belongs to a worker that died halfway through it
+            event_ids: List[int] = [x.id for x in db.query(StripeWebhookEvent.id).filter(and_(
+                StripeWebhookEvent.status.in_([WebhookEventStatusEnum.RECEIVED, WebhookEventStatusEnum.PROCESSING]),
+                StripeWebhookEvent.next_attempt_on <= now)).order_by(StripeWebhookEvent.id).limit(
+                self.batch_size).all()]
+            db.rollback()
+            for event_id in event_ids:
+                if self._stopping.is_set():
+                    break
+                self.process(event_id, db)
+            return len(event_ids)
+        finally:
+            db.close()
+
+    def _claim(self, event_id: int, db: Session) -> bool:
+        now = datetime.now()
+        claimed = db.query(StripeWebhookEvent).filter(and_(
+            StripeWebhookEvent.id == event_id,
+            StripeWebhookEvent.status.in_([WebhookEventStatusEnum.RECEIVED, WebhookEventStatusEnum.PROCESSING]),
+            StripeWebhookEvent.next_attempt_on <= now)).update({
+                StripeWebhookEvent.status: WebhookEventStatusEnum.PROCESSING,
+                StripeWebhookEvent.attempts: StripeWebhookEvent.attempts + 1,
+                StripeWebhookEvent.next_attempt_on: now + timedelta(seconds=self.claim_seconds)
+            }, synchronize_session=False)
+        db.commit()
+        return claimed == 1
+
+    def process(self, event_id: int, db: Session):
+        if not self._claim(event_id, db):
+            return
+        event: StripeWebhookEvent = db.query(StripeWebhookEvent).filter(StripeWebhookEvent.id == event_id).one()
+        try:
+            handler: Optional[WebhookHandler] = self.handlers.get(event.event_type)
+            if handler is None:
+                raise HTTPException(status_code=400, detail="Unrecognized event")
+            handler(event.payload, db)
+            db.commit()
+            event.status = WebhookEventStatusEnum.PROCESSED
+            event.processed_on = datetime.now()
+            event.last_error = None
+            db.commit()
+            logger.info("Processed stripe event {} ({})".format(event.event_id, event.event_type))
+        except Exception as e:
+            db.rollback()
+            permanent = isinstance(e, HTTPException) and 400 <= e.status_code < 500
+            error = e.detail if isinstance(e, HTTPException) else repr(e)
+            if permanent or event.attempts >= self.max_attempts:
+                logger.error("Giving up on stripe event {} after {} attempts: {}".format(event.event_id,
+                                                                                      event.attempts, error))
+                event.status = WebhookEventStatusEnum.FAILED
+            else:
+                logger.warning("Stripe event {} failed on attempt {}, will retry: {}".format(event.event_id,
+                                                                                          event.attempts, error))
+                event.status = WebhookEventStatusEnum.RECEIVED
+                event.next_attempt_on = datetime.now() + timedelta(
+                    seconds=self.backoff_seconds * (2 ** (event.attempts - 1)))
+            event.last_error = str(error)[0:1000]
+            db.commit()
+
+    def retry(self, event: StripeWebhookEvent, db: Session):
+        event.status = WebhookEventStatusEnum.RECEIVED
+        event.attempts = 0
+        event.next_attempt_on = datetime.now()
+        db.commit()
+        self.notify()
+
+
+def to_webhook_event_dict(event: StripeWebhookEvent) -> Dict:
+    return {
+        "event_id": event.event_id,
+        "event_type": event.event_type,
+        "status": event.status,
+        "attempts": event.attempts,
+        "next_attempt_on": event.next_attempt_on,
+        "last_error": event.last_error,
+        "received_on": event.received_on,
+        "processed_on": event.processed_on
+    }
@@ -1,10 +1,12 @@
 from email.mime.image import MIMEImage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from smtplib import SMTP
-from typing import Dict
+from typing import Dict, Optional
 
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+
+from emails.delivery import EmailDeliveryService
+from middleware.timing import timed
 
 
 class RasoiBoxEmail():
@@ -29,17 +31,36 @@ class RasoiBoxEmail():
         self.from_email = from_email
 
 
-def send_email(jinjaEnv: Environment, email: RasoiBoxEmail, email_server: SMTP, email_address: str,
-               email_password: str):
+def create_template_env(template_dir: str, auto_reload: bool = False,
+                        bytecode_cache_dir: Optional[str] = None) -> Environment:
+    # with auto_reload off a compiled template is served from memory without stat-ing its file on every render; the
+    # bytecode cache lets new workers skip compiling altogether
+    return Environment(
+        loader=FileSystemLoader(template_dir),
+        autoescape=select_autoescape(),
+        auto_reload=auto_reload,
+        cache_size=-1,
+        bytecode_cache=FileSystemBytecodeCache(bytecode_cache_dir) if bytecode_cache_dir is not None else None
+    )
+
+
+def precompile_templates(jinjaEnv: Environment) -> int:
+    template_names = [x for x in jinjaEnv.list_templates() if x.endswith(".html")]
+    for template_name in template_names:
+        jinjaEnv.get_template(template_name)
+    return len(template_names)
+
+
+def build_message(jinjaEnv: Environment, email: RasoiBoxEmail) -> MIMEMultipart:
     message: MIMEMultipart = MIMEMultipart("related")
     message['From'] = email.from_email
     message['To'] = email.to_email
     message['Subject'] = email.subject
     msg_html = MIMEText(jinjaEnv.get_template(email.template).render(**email.template_args), "html")
     message.attach(msg_html)
+    return message
+
 
-    email_server.connect('smtp.gmail.com', 587)
-    email_server.starttls()
-    email_server.login(email_address, email_password)
-    email_server.send_message(message)
-    email_server.quit()
+def send_email(jinjaEnv: Environment, email: RasoiBoxEmail, email_service: EmailDeliveryService):
+    with timed("email"):
+        email_service.enqueue(build_message(jinjaEnv, email))
@@ -0,0 +1,148 @@
+import logging
+import queue
+import threading
+import time
+from email.message import Message
+from smtplib import SMTP, SMTPException, SMTPResponseException, SMTPRecipientsRefused, SMTPServerDisconnected
+from typing import List, Optional
+
+logger = logging.getLogger("rasoibox")
+
+
+class SmtpConnection():
+    host: str
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+    starttls: bool
+    timeout: float
+
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str], starttls: bool = True,
+                 timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[SMTP] = None
+
+    def connect(self):
+        smtp = SMTP(self.host, self.port, timeout=self.timeout)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self._smtp = smtp
+
+    def send(self, message: Message):
+        if self._smtp is None:
+            self.connect()
+        try:
+            self._smtp.send_message(message)
+        except SMTPServerDisconnected:
+            # the server drops idle connections; reconnect once before treating it as a failure
+            self.close()
+            self.connect()
+            self._smtp.send_message(message)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+def is_permanent_failure(e: Exception) -> bool:
+    if isinstance(e, SMTPRecipientsRefused):
+        # a 4xx for a recipient, e.g. greylisting or a full mailbox, is worth trying again
+        return all([x[0] >= 500 for x in e.recipients.values()])
+    return isinstance(e, SMTPResponseException) and e.smtp_code >= 500
+
+
+# Delivers emails from a bounded queue over a small pool of long-lived SMTP connections, one per worker thread.
+# Request handlers enqueue and return; a full queue raises queue.Full so callers can drop the email best effort.
+# To run against a local stand-in, start `python -m aiosmtpd -n -l localhost:8025` and set SMTP_HOST=localhost,
+# SMTP_PORT=8025, SMTP_STARTTLS=false and SMTP_LOGIN=false; scripts/check_email_delivery does that for retries too.
+class EmailDeliveryService():
+    host: str
+    port: int
+    username: Optional[str]
+    password: Optional[str]
+    starttls: bool
+    pool_size: int
+    max_attempts: int
+    backoff_seconds: float
+
+    def __init__(self, host: str, port: int, username: Optional[str], password: Optional[str], starttls: bool = True,
+                 pool_size: int = 2, queue_size: int = 1000, max_attempts: int = 4, backoff_seconds: float = 1.0):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.pool_size = pool_size
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def new_connection(self) -> SmtpConnection:
+        return SmtpConnection(self.host, self.port, self.username, self.password, self.starttls)
+
+    def start(self):
+        with self._lock:
+            if len(self._workers) > 0:
+                return
+            for i in range(self.pool_size):
+                worker = threading.Thread(target=self._run, name="email-delivery-{}".format(i), daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def enqueue(self, message: Message):
+        self.start()
+        self._queue.put_nowait(message)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self, timeout_seconds: float = 10.0):
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+        # workers drain what is already queued before they see the sentinel
+        for _ in workers:
+            self._queue.put(None, timeout=timeout_seconds)
+        for worker in workers:
+            worker.join(timeout_seconds)
+
+    def _run(self):
+        connection = self.new_connection()
+        try:
+            while True:
+                message: Optional[Message] = self._queue.get()
+                try:
+                    if message is None:
+                        return
+                    self.deliver(connection, message)
+                finally:
+                    self._queue.task_done()
+        finally:
+            connection.close()
+
+    def deliver(self, connection: SmtpConnection, message: Message) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                connection.send(message)
+                return True
+            except (SMTPException, OSError) as e:
+                connection.close()
+                if is_permanent_failure(e) or attempt == self.max_attempts:
+                    logger.exception("Failed to send email to {} after {} attempts.".format(message["To"], attempt))
+                    return False
+                delay = self.backoff_seconds * (2 ** (attempt - 1))
+                logger.warning("Failed to send email to {}, retrying in {}s: {}".format(message["To"], delay, e))
+                time.sleep(delay)
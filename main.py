@@ -11,10 +11,16 @@ from starlette.middleware.wsgi import WSGIMiddleware
 from admin_auth.basic.base import AdminAuth
 from config import Settings
 from dashapp.dashapp import create_dash_app
-from dependencies.database import get_engine, get_db
-from middleware.request_logger import RequestContextLogMiddleware
+from dependencies.campaigns import campaign_supervisor
+from dependencies.database import get_engine, SessionLocal, dispose_async_engine
+from dependencies.events import event_buffer
+from dependencies.migrations import migration_lock, upgrade_database
+from dependencies.responses import FastJSONResponse
+from dependencies.rollups import rollup_worker
+from emails.base import precompile_templates
+from middleware.request_logger import RequestContextLogMiddleware, configure_request_logging
 from models.base import Base
-from routers import recipe, signup, customers, order, price, orderV2, popfest, cart, rewards, cooking
+from routers import recipe, signup, customers, order, price, orderV2, popfest, cart, rewards, cooking, admin as admin_router
 from views.cooking import CookingHistoryAdmin
 from views.customers import CustomerAdmin
 from views.event import EventAdmin, RecipeEventAdmin
@@ -30,6 +36,9 @@ logger = logging.getLogger("rasoibox")
 
 settings: Settings = Settings()
 
+request_logger = logging.getLogger("rasoibox.requests")
+request_log_listener = configure_request_logging(request_logger)
+
 origins = [
     "http://localhost",
     "http://localhost:8081",
@@ -40,9 +49,12 @@ origins = [
 ]
 
 # app = FastAPI(docs_url=None, redoc_url=None)
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 app.add_middleware(SessionMiddleware, secret_key="test")
-app.add_middleware(RequestContextLogMiddleware, request_logger=logger)
+app.add_middleware(RequestContextLogMiddleware, request_logger=request_logger,
+                   body_log_paths=settings.request_log_body_paths,
+                   sampled_paths={"/healthz": settings.healthz_log_sample_rate},
+                   debug_headers=settings.debug)
 
 app.add_middleware(
     CORSMiddleware,
@@ -80,11 +92,13 @@ admin.add_view(PromoCodeAdmin)
 admin.add_view(InvitationAdmin)
 admin.add_view(CookingHistoryAdmin)
 
-# Create tables
-Base.metadata.create_all(engine)
+# Create tables, then bring existing ones up to date, one worker at a time
+with migration_lock():
+    Base.metadata.create_all(engine)
+    upgrade_database()
 
 # Dashboard
-dash_app = create_dash_app(next(get_db()), requests_pathname_prefix="/dash/")
+dash_app = create_dash_app(SessionLocal, requests_pathname_prefix="/dash/")
 app.mount("/dash", WSGIMiddleware(dash_app.server))
 
 # Static files
@@ -101,18 +115,32 @@ app.include_router(popfest.router)
 app.include_router(cart.router)
 app.include_router(rewards.router)
 app.include_router(cooking.router)
+app.include_router(admin_router.router)
 
 
 @app.on_event("startup")
 async def startup_event():
+    from routers.signup import email_service, jinjaEnv
+    logger.info("Precompiled {} email templates".format(precompile_templates(jinjaEnv)))
+    email_service.start()
+    orderV2.webhook_worker.start()
+    event_buffer.start()
+    rollup_worker.start()
+    campaign_supervisor.start(jinjaEnv, email_service)
     logger.info("Server started successfully!")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    from routers.signup import smtp_server
-    smtp_server.close()
+    from routers.signup import email_service
+    orderV2.webhook_worker.stop()
+    event_buffer.stop()
+    rollup_worker.stop()
+    campaign_supervisor.stop()
+    email_service.stop()
+    await dispose_async_engine()
     logger.info("Shutting down gracefully!")
+    request_log_listener.stop()
     return
 
 
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from middleware.timing import record
+
+logger = logging.getLogger("rasoibox")
+
+# statements longer than this are cut down before they are kept or logged
+MAX_STATEMENT_LENGTH = 500
+
+
+class QueryProfile():
+    trace_id: str
+    query_count: int
+    total_seconds: float
+    slowest_seconds: float
+    slowest_statement: Optional[str]
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.query_count = 0
+        self.total_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement: str, seconds: float):
+        self.query_count += 1
+        self.total_seconds += seconds
+        if seconds > self.slowest_seconds:
+            self.slowest_seconds = seconds
+            self.slowest_statement = statement[0:MAX_STATEMENT_LENGTH]
+
+
+class RouteStats():
+    requests: int
+    query_count: int
+    max_query_count: int
+    total_seconds: float
+    slowest_seconds: float
+    slowest_statement: Optional[str]
+    slowest_trace_id: Optional[str]
+
+    def __init__(self):
+        self.requests = 0
+        self.query_count = 0
+        self.max_query_count = 0
+        self.total_seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest_statement = None
+        self.slowest_trace_id = None
+
+    def add(self, profile: QueryProfile):
+        self.requests += 1
+        self.query_count += profile.query_count
+        self.max_query_count = max(self.max_query_count, profile.query_count)
+        self.total_seconds += profile.total_seconds
+        if profile.slowest_seconds > self.slowest_seconds:
+            self.slowest_seconds = profile.slowest_seconds
+            self.slowest_statement = profile.slowest_statement
+            self.slowest_trace_id = profile.trace_id
+
+    def to_dict(self, route: str) -> Dict:
+        return {
+            "route": route,
+            "requests": self.requests,
+            "avg_query_count": self.query_count / self.requests,
+            "max_query_count": self.max_query_count,
+            "avg_db_seconds": self.total_seconds / self.requests,
+            "slowest_seconds": self.slowest_seconds,
+            "slowest_statement": self.slowest_statement,
+            "slowest_trace_id": self.slowest_trace_id
+        }
+
+
+_profile: ContextVar[Optional[QueryProfile]] = ContextVar("query_profile", default=None)
+_route_stats_lock = threading.Lock()
+_route_stats: Dict[str, RouteStats] = {}
+
+
+def start_profile(trace_id: str):
+    return _profile.set(QueryProfile(trace_id))
+
+
+def stop_profile(token) -> Optional[QueryProfile]:
+    profile = _profile.get()
+    _profile.reset(token)
+    return profile
+
+
+def current_profile() -> Optional[QueryProfile]:
+    return _profile.get()
+
+
+def record_route(route: str, profile: QueryProfile):
+    with _route_stats_lock:
+        _route_stats.setdefault(route, RouteStats()).add(profile)
+
+
+def route_stats() -> List[Dict]:
+    with _route_stats_lock:
+        stats = [x.to_dict(route) for route, x in _route_stats.items()]
+    stats.sort(reverse=True, key=lambda x: x["avg_query_count"])
+    return stats
+
+
+def reset_route_stats():
+    with _route_stats_lock:
+        _route_stats.clear()
+
+
+def profile_engine(engine: Engine, slow_query_seconds: float):
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        record("db", seconds)
+        profile = _profile.get()
+        if profile is not None:
+            profile.add(statement, seconds)
+        if seconds >= slow_query_seconds:
+            logger.warning("Slow query ({:.3f}s, trace {}): {}".format(
+                seconds, profile.trace_id if profile is not None else None, statement[0:MAX_STATEMENT_LENGTH]))
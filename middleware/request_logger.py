@@ -1,13 +1,20 @@
+import json
 import logging
+import queue
 import random
 import string
 import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional
 
-from fastapi import Request, Response
-from starlette.middleware.base import RequestResponseEndpoint
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import Message
+from middleware.query_profiler import start_profile, stop_profile, current_profile, record_route
+from middleware.timing import start_timings, stop_timings, current_timings, server_timing_header
+
+# request headers worth keeping in the log; everything else (cookies, auth) stays out of it
+LOGGED_HEADERS: List[str] = ["user-agent", "content-type", "content-length", "referer", "x-forwarded-for"]
 
 
 def generate_trace_id() -> str:
@@ -16,72 +23,123 @@ def generate_trace_id() -> str:
     return res.lower()
 
 
-class RequestContextLogMiddleware(BaseHTTPMiddleware):
-    request_logger: logging.Logger
-    log_debug_paths = ["/healthz"]
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = getattr(record, "payload", None)
+        if payload is None:
+            payload = {"message": record.getMessage()}
+        return json.dumps({"time": self.formatTime(record), "level": record.levelname, **payload}, default=str)
 
-    def __init__(self, app, request_logger: logging.Logger):
-        super().__init__(app)
-        self.request_logger = request_logger
 
-    async def set_body(self, request: Request):
-        receive_ = await request._receive()
+def configure_request_logging(request_logger: logging.Logger, handler: Optional[logging.Handler] = None) \
+        -> QueueListener:
+    # request handlers only put the record on a queue; the listener thread formats and writes it
+    if handler is None:
+        handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    log_queue: queue.Queue = queue.Queue(-1)
+    request_logger.addHandler(QueueHandler(log_queue))
+    request_logger.setLevel(logging.INFO)
+    request_logger.propagate = False
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return listener
 
-        async def receive() -> Message:
-            return receive_
 
-        request._receive = receive
+class RequestContextLogMiddleware():
+    app: ASGIApp
+    request_logger: logging.Logger
+    body_log_paths: List[str]
+    sampled_paths: Dict[str, float]
+    max_body_bytes: int
+    debug_headers: bool
+
+    def __init__(self, app: ASGIApp, request_logger: logging.Logger, body_log_paths: Optional[List[str]] = None,
+                 sampled_paths: Optional[Dict[str, float]] = None, max_body_bytes: int = 2048,
+                 debug_headers: bool = False):
+        self.app = app
+        self.request_logger = request_logger
+        self.body_log_paths = body_log_paths if body_log_paths is not None else []
+        self.sampled_paths = sampled_paths if sampled_paths is not None else {}
+        self.max_body_bytes = max_body_bytes
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
         trace_id = generate_trace_id()
-        start_time = time.time()
-        request.scope["trace_id"] = trace_id
-        request_payload = {
-            "method": request.method,
-            "url": str(request.url),
-            "headers": request.headers,
-            "params": {
-                "path-params": request.path_params,
-                "query-params": request.query_params
-            }
-        }
-
-        await self.set_body(request)
-        try:
-            json_body = await request.json()
-            request_payload["body"] = json_body
-        except Exception as e:
-            if str(request.url.path) in self.log_debug_paths:
-                self.request_logger.debug("Failed to get json body for request.")
-            else:
-                self.request_logger.error("Failed to get json body for request.")
-
-        log_payload = {
-            "trace_id": trace_id,
-            "request": request_payload,
-        }
-
-        response = None
-        err = None
+        start_time = time.perf_counter()
+        scope["trace_id"] = trace_id
+        path: str = scope["path"]
+        status_code: Optional[int] = None
+        body_chunks: List[bytes] = []
+        body_size: int = 0
+
+        async def receive_with_snippet() -> Message:
+            # keep the first few bytes as they stream past instead of buffering the whole body
+            nonlocal body_size
+            message = await receive()
+            if message["type"] == "http.request" and body_size < self.max_body_bytes:
+                chunk = message.get("body", b"")[0:self.max_body_bytes - body_size]
+                body_chunks.append(chunk)
+                body_size += len(chunk)
+            return message
+
+        async def send_with_timings(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = time.perf_counter() - start_time
+                headers = list(message.get("headers", []))
+                headers.append((b"x-process-time", str(process_time).encode()))
+                headers.append((b"server-timing", server_timing_header(timings, process_time).encode()))
+                if self.debug_headers:
+                    headers.append((b"x-trace-id", trace_id.encode()))
+                    headers.append((b"x-query-count", str(profile.query_count).encode()))
+                    headers.append((b"x-query-seconds", "{:.4f}".format(profile.total_seconds).encode()))
+                    headers.append((b"x-slowest-query-seconds", "{:.4f}".format(profile.slowest_seconds).encode()))
+                message["headers"] = headers
+            await send(message)
+
+        capture_body: bool = path in self.body_log_paths
+        token = start_timings()
+        timings = current_timings()
+        profile_token = start_profile(trace_id)
+        profile = current_profile()
         try:
-            response = await call_next(request)
-            process_time = time.time() - start_time
-            response.headers["X-Process-Time"] = str(process_time)
-            log_payload["process_time_seconds"] = process_time
-            log_payload["response"] = {
-                "status_code": response.status_code
-            }
-        except Exception as e:
-            err = e
-            process_time = time.time() - start_time
-            log_payload["process_time_seconds"] = process_time
-
-        if str(request.url.path) in self.log_debug_paths:
-            self.request_logger.debug("%s", log_payload)
-        else:
-            self.request_logger.info("%s", log_payload)
-
-        if err is not None:
-            raise err
-
-        return response
+            await self.app(scope, receive_with_snippet if capture_body else receive, send_with_timings)
+        finally:
+            stop_timings(token)
+            stop_profile(profile_token)
+            # key by endpoint rather than raw path so path params and 404 probes do not each get a row
+            endpoint = scope.get("endpoint")
+            route: str = "{} {}.{}".format(scope["method"], endpoint.__module__, endpoint.__name__) \
+                if endpoint is not None else "unmatched"
+            record_route(route, profile)
+            sample_rate: float = self.sampled_paths.get(path, 1.0)
+            if sample_rate >= 1.0 or random.random() < sample_rate:
+                headers = Headers(scope=scope)
+                log_payload = {
+                    "trace_id": trace_id,
+                    "request": {
+                        "method": scope["method"],
+                        "path": path,
+                        "query": scope.get("query_string", b"").decode("latin-1"),
+                        "headers": {x: headers[x] for x in LOGGED_HEADERS if x in headers},
+                    },
+                    "response": {
+                        "status_code": status_code if status_code is not None else 500
+                    },
+                    "process_time_seconds": time.perf_counter() - start_time,
+                    "timings": timings,
+                    "queries": {
+                        "count": profile.query_count,
+                        "seconds": profile.total_seconds,
+                        "slowest_seconds": profile.slowest_seconds
+                    },
+                }
+                if capture_body:
+                    log_payload["request"]["body"] = b"".join(body_chunks).decode("utf-8", errors="replace")
+                self.request_logger.info("%s %s", scope["method"], path, extra={"payload": log_payload})
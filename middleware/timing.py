@@ -0,0 +1,45 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+# Per-request time spent in the database, stripe and email, keyed by name. The middleware puts a fresh dict in the
+# context for each request; sync endpoints run in a thread with a copy of that context, so they add to the same dict.
+# Outside a request (campaign threads, scripts) there is no dict and nothing is recorded.
+_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def start_timings():
+    return _timings.set({})
+
+
+def stop_timings(token) -> Dict[str, float]:
+    timings = _timings.get() or {}
+    _timings.reset(token)
+    return timings
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    return _timings.get()
+
+
+def record(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def server_timing_header(timings: Dict[str, float], total_seconds: float) -> str:
+    metrics = ["{};dur={:.1f}".format(name, seconds * 1000) for name, seconds in sorted(timings.items())]
+    metrics.append("total;dur={:.1f}".format(total_seconds * 1000))
+    return ", ".join(metrics)
+
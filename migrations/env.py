@@ -0,0 +1,48 @@
+from logging.config import fileConfig
+
+from alembic import context
+
+import models.campaigns
+import models.cooking
+import models.customers
+import models.event
+import models.invitations
+import models.orders
+import models.recipes
+import models.reset_passwords
+import models.signups
+from dependencies.database import get_engine
+from models.base import Base
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline():
+    context.configure(
+        url=get_engine().url,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    with get_engine().connect() as connection:
+        context.configure(connection=connection, target_metadata=target_metadata)
+
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
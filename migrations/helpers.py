@@ -0,0 +1,70 @@
+from typing import List
+
+import sqlalchemy as sa
+from alembic import op
+
+# Fresh databases are still built by Base.metadata.create_all at startup, which already creates everything declared on
+# the models. These helpers let each revision bring an existing database up to the same shape without failing on
+# objects that create_all made for it.
+
+
+def has_table(table: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def has_column(table: str, column: str) -> bool:
+    return column in [x["name"] for x in sa.inspect(op.get_bind()).get_columns(table)]
+
+
+def has_index(table: str, name: str) -> bool:
+    inspector = sa.inspect(op.get_bind())
+    names = [x["name"] for x in inspector.get_indexes(table)] + \
+            [x["name"] for x in inspector.get_unique_constraints(table)]
+    return name in names
+
+
+def has_foreign_key(table: str, name: str) -> bool:
+    return name in [x["name"] for x in sa.inspect(op.get_bind()).get_foreign_keys(table)]
+
+
+def create_index_if_missing(name: str, table: str, columns: List[str]):
+    if not has_index(table, name):
+        op.create_index(name, table, columns)
+
+
+def create_unique_constraint_if_missing(name: str, table: str, columns: List[str]):
+    if has_index(table, name):
+        return
+    column_list = ", ".join(columns)
+    duplicates = op.get_bind().execute(sa.text(
+        "select {columns}, count(1) from {table} group by {columns} having count(1) > 1 limit 5".format(
+            table=table, columns=column_list))).all()
+    if len(duplicates) > 0:
+        examples = "; ".join([", ".join([str(y) for y in x[0:-1]]) + " ({} rows)".format(x[-1]) for x in duplicates])
+        raise RuntimeError("Cannot add {}: {}.({}) has duplicate values, e.g. {}. Merge or remove them first.".format(
+            name, table, column_list, examples))
+    op.create_unique_constraint(name, table, columns)
+
+
+def create_foreign_key_if_missing(name: str, table: str, column: str, referred_table: str):
+    if has_foreign_key(table, name):
+        return
+    orphans = op.get_bind().execute(sa.text(
+        "select count(1) from {table} left join {referred} on {table}.{column} = {referred}.id "
+        "where {table}.{column} is not null and {referred}.id is null".format(
+            table=table, referred=referred_table, column=column))).scalar()
+    if orphans > 0:
+        raise RuntimeError("Cannot add {}: {} rows in {}.{} do not match any {}.id. Fix or remove them first.".format(
+            name, orphans, table, column, referred_table))
+    op.create_foreign_key(name, table, referred_table, [column], ["id"])
+
+
+def drop_index_if_exists(name: str, table: str):
+    if has_index(table, name):
+        op.drop_index(name, table_name=table)
+
+
+def drop_constraint_if_exists(name: str, table: str, type_: str):
+    exists = has_foreign_key(table, name) if type_ == "foreignkey" else has_index(table, name)
+    if exists:
+        op.drop_constraint(name, table, type_=type_)
@@ -0,0 +1,106 @@
+"""Index hot lookup columns and add foreign keys between the catalog tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2023-06-01 00:00:00
+
+"""
+import logging
+
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import create_index_if_missing, create_unique_constraint_if_missing, \
+    create_foreign_key_if_missing, drop_index_if_exists, drop_constraint_if_exists
+
+logger = logging.getLogger("rasoibox")
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_unverified_sign_ups_email", "unverified_sign_ups", ["email"]),
+    ("ix_unverified_sign_ups_verification_code", "unverified_sign_ups", ["verification_code"]),
+    ("ix_verified_sign_ups_email", "verified_sign_ups", ["email"]),
+    ("ix_verified_sign_ups_verification_code", "verified_sign_ups", ["verification_code"]),
+    ("ix_deliverable_zipcodes_zipcode", "deliverable_zipcodes", ["zipcode"]),
+    ("ix_reset_passwords_reset_code", "reset_passwords", ["reset_code"]),
+    ("ix_invitations_email", "invitations", ["email"]),
+    ("ix_invitations_referrer_verification_code", "invitations", ["referrer_verification_code"]),
+    ("ix_invitations_referred_verification_code", "invitations", ["referred_verification_code"]),
+    ("ix_cooking_history_order_id", "cooking_history", ["order_id"]),
+    ("ix_orders_payment_intent", "orders", ["payment_intent"]),
+    ("ix_orders_customer_payment_status", "orders", ["customer", "payment_status"]),
+    ("ix_orders_verification_code_payment_status", "orders", ["verification_code", "payment_status"]),
+    ("ix_carts_verification_code", "carts", ["verification_code"]),
+    ("ix_promo_codes_promo_code_name", "promo_codes", ["promo_code_name"]),
+    ("ix_promo_codes_redeemable_by_verification_code", "promo_codes", ["redeemable_by_verification_code"]),
+    ("ix_starred_recipes_verified_sign_up_id", "starred_recipes", ["verified_sign_up_id"]),
+    ("ix_recipe_ingredients_recipe_id_serving_size", "recipe_ingredients", ["recipe_id", "serving_size"]),
+    ("ix_recipe_steps_recipe_id_serving_size", "recipe_steps", ["recipe_id", "serving_size"]),
+]
+
+UNIQUE_CONSTRAINTS = [
+    ("uq_customers_email", "customers", ["email"]),
+    ("uq_orders_user_facing_order_id", "orders", ["user_facing_order_id"]),
+    ("uq_recipes_name", "recipes", ["name"]),
+    ("uq_recipe_prices_recipe_id_serving_size", "recipe_prices", ["recipe_id", "serving_size"]),
+]
+
+FOREIGN_KEYS = [
+    ("fk_cooking_history_customer_id_customers", "cooking_history", "customer_id", "customers"),
+    ("fk_cooking_history_recipe_id_recipes", "cooking_history", "recipe_id", "recipes"),
+    ("fk_carts_recipe_id_recipes", "carts", "recipe_id", "recipes"),
+    ("fk_recipes_recipe_contributor_id_recipe_contributors", "recipes", "recipe_contributor_id",
+     "recipe_contributors"),
+    ("fk_recipe_prices_recipe_id_recipes", "recipe_prices", "recipe_id", "recipes"),
+    ("fk_starred_recipes_recipe_id_recipes", "starred_recipes", "recipe_id", "recipes"),
+    ("fk_recipe_schedules_recipe_id_recipes", "recipe_schedules", "recipe_id", "recipes"),
+    ("fk_recipe_ingredients_recipe_id_recipes", "recipe_ingredients", "recipe_id", "recipes"),
+    ("fk_recipe_ingredients_ingredient_id_ingredients", "recipe_ingredients", "ingredient_id", "ingredients"),
+    ("fk_recipe_in_your_kitchen_recipe_id_recipes", "recipe_in_your_kitchen", "recipe_id", "recipes"),
+    ("fk_recipe_in_your_kitchen_in_your_kitchen_id_in_your_kitchen", "recipe_in_your_kitchen", "in_your_kitchen_id",
+     "in_your_kitchen"),
+    ("fk_recipe_steps_recipe_id_recipes", "recipe_steps", "recipe_id", "recipes"),
+]
+
+
+def merge_duplicate_customers():
+    # guest checkouts used to create a new customer for every order, so an email can belong to several rows. Keep the
+    # one with a password, else the oldest, and move the others' orders and cooking history onto it.
+    bind = op.get_bind()
+    emails = [x[0] for x in bind.execute(sa.text(
+        "select email from customers where email is not null group by email having count(1) > 1")).all()]
+    for email in emails:
+        ids = [x[0] for x in bind.execute(sa.text(
+            "select id from customers where email = :email order by hashed_password is null, id"),
+            {"email": email}).all()]
+        keep, duplicates = ids[0], ids[1:]
+        for statement in ["update orders set customer = :keep where customer in :duplicates",
+                          "update cooking_history set customer_id = :keep where customer_id in :duplicates",
+                          "delete from customers where id in :duplicates"]:
+            bind.execute(sa.text(statement).bindparams(sa.bindparam("duplicates", expanding=True)),
+                         {"keep": keep, "duplicates": duplicates})
+        logger.warning("Merged customers {} into {} for a shared email".format(duplicates, keep))
+
+
+def upgrade():
+    merge_duplicate_customers()
+    for name, table, columns in INDEXES:
+        create_index_if_missing(name, table, columns)
+    for name, table, columns in UNIQUE_CONSTRAINTS:
+        create_unique_constraint_if_missing(name, table, columns)
+    for name, table, column, referred_table in FOREIGN_KEYS:
+        create_foreign_key_if_missing(name, table, column, referred_table)
+
+
+def downgrade():
+    # foreign keys first; mysql will not drop an index a foreign key depends on
+    for name, table, _, _ in FOREIGN_KEYS:
+        drop_constraint_if_exists(name, table, "foreignkey")
+    for name, table, _ in UNIQUE_CONSTRAINTS:
+        drop_constraint_if_exists(name, table, "unique")
+    for name, table, _ in INDEXES:
+        drop_index_if_exists(name, table)
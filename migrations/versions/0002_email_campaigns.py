@@ -0,0 +1,38 @@
+"""Track bulk email campaign progress
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2023-06-05 00:00:00
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if has_table("email_campaigns"):
+        return
+    op.create_table(
+        "email_campaigns",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("campaign_type", sa.String(100)),
+        sa.Column("status", sa.Enum("RUNNING", "COMPLETED", "FAILED", name="campaignstatusenum")),
+        sa.Column("last_recipient_id", sa.Integer),
+        sa.Column("sent_count", sa.Integer),
+        sa.Column("failed_count", sa.Integer),
+        sa.Column("started_on", sa.DateTime),
+        sa.Column("updated_on", sa.DateTime),
+        sa.Column("completed_on", sa.DateTime),
+        sa.Column("last_error", sa.String(1000)),
+    )
+
+
+def downgrade():
+    op.drop_table("email_campaigns")
@@ -0,0 +1,74 @@
+"""Store json columns as documents instead of json-encoded strings
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2023-06-12 00:00:00
+
+"""
+import json
+from typing import Dict, List
+
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+# columns the app used to json.dumps before handing to a JSON column, which stored a json string of the document
+JSON_COLUMNS: Dict[str, List[str]] = {
+    "orders": ["recipes", "order_breakdown_dollars", "delivery_address", "promo_codes"],
+    "recipes": ["tags"],
+    "recipe_in_your_kitchen": ["or_ids"],
+    "recipe_steps": ["instructions", "tips", "chefs_hats", "ingredients", "in_your_kitchens", "gif_url"],
+}
+
+BATCH_SIZE = 500
+
+
+def unwrap(raw):
+    if raw is None:
+        return None
+    if isinstance(raw, (bytes, bytearray)):
+        raw = raw.decode("utf-8")
+    value = json.loads(raw) if isinstance(raw, str) else raw
+    if not isinstance(value, str):
+        return None
+    try:
+        return json.loads(value)
+    except ValueError:
+        return None
+
+
+def upgrade():
+    connection = op.get_bind()
+    for table, columns in JSON_COLUMNS.items():
+        if not has_table(table):
+            continue
+        after_id = 0
+        while True:
+            rows = connection.execute(sa.text(
+                "select id, {} from {} where id > :after_id order by id limit :limit".format(", ".join(columns),
+                                                                                            table)),
+                {"after_id": after_id, "limit": BATCH_SIZE}).mappings().all()
+            if len(rows) == 0:
+                break
+            for row in rows:
+                updates = {}
+                for column in columns:
+                    document = unwrap(row[column])
+                    if document is not None:
+                        updates[column] = json.dumps(document)
+                if len(updates) > 0:
+                    assignments = ", ".join(["{0} = :{0}".format(x) for x in updates.keys()])
+                    connection.execute(sa.text("update {} set {} where id = :id".format(table, assignments)),
+                                       {**updates, "id": row["id"]})
+            after_id = rows[-1]["id"]
+
+
+def downgrade():
+    # the app reads both shapes, so there is nothing to undo
+    pass
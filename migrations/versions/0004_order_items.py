@@ -0,0 +1,38 @@
+"""Add order_items, one row per recipe in an order
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2023-06-19 00:00:00
+
+Existing orders are filled in by python -m scripts.backfill_order_items.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if has_table("order_items"):
+        return
+    op.create_table(
+        "order_items",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("order_id", sa.Integer, sa.ForeignKey("orders.id", name="fk_order_items_order_id_orders")),
+        sa.Column("recipe_id", sa.Integer, sa.ForeignKey("recipes.id", name="fk_order_items_recipe_id_recipes")),
+        sa.Column("serving_size", sa.Integer),
+        sa.Column("price", sa.Float),
+        sa.Column("order_date", sa.DateTime),
+    )
+    op.create_index("ix_order_items_order_id", "order_items", ["order_id"])
+    op.create_index("ix_order_items_order_date", "order_items", ["order_date"])
+    op.create_index("ix_order_items_recipe_id_order_date", "order_items", ["recipe_id", "order_date"])
+
+
+def downgrade():
+    op.drop_table("order_items")
@@ -0,0 +1,42 @@
+"""Add an inbox for stripe webhook events
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2023-06-26 00:00:00
+
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if has_table("stripe_webhook_events"):
+        return
+    op.create_table(
+        "stripe_webhook_events",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("event_id", sa.String(100)),
+        sa.Column("event_type", sa.String(100)),
+        sa.Column("payload", sa.JSON),
+        sa.Column("status", sa.Enum("RECEIVED", "PROCESSING", "PROCESSED", "FAILED",
+                                    name="webhookeventstatusenum")),
+        sa.Column("attempts", sa.Integer),
+        sa.Column("next_attempt_on", sa.DateTime),
+        sa.Column("last_error", sa.String(1000)),
+        sa.Column("received_on", sa.DateTime),
+        sa.Column("processed_on", sa.DateTime),
+        sa.UniqueConstraint("event_id", name="uq_stripe_webhook_events_event_id"),
+    )
+    op.create_index("ix_stripe_webhook_events_status_next_attempt_on", "stripe_webhook_events",
+                    ["status", "next_attempt_on"])
+
+
+def downgrade():
+    op.drop_table("stripe_webhook_events")
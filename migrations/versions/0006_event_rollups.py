@@ -0,0 +1,56 @@
+"""Add hourly rollups of site and recipe events
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2023-07-03 00:00:00
+
+Existing events are counted by python -m scripts.backfill_event_rollups.
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_table("event_hourly_counts"):
+        op.create_table(
+            "event_hourly_counts",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("event_type", sa.String(100)),
+            sa.Column("hour", sa.DateTime),
+            sa.Column("count", sa.Integer),
+            sa.Column("unverified_count", sa.Integer),
+            sa.UniqueConstraint("event_type", "hour", name="uq_event_hourly_counts_event_type_hour"),
+        )
+    if not has_table("recipe_event_hourly_counts"):
+        op.create_table(
+            "recipe_event_hourly_counts",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("recipe_id", sa.Integer),
+            sa.Column("step_number", sa.Integer),
+            sa.Column("event_type", sa.String(100)),
+            sa.Column("hour", sa.DateTime),
+            sa.Column("count", sa.Integer),
+            sa.UniqueConstraint("recipe_id", "step_number", "event_type", "hour",
+                                name="uq_recipe_event_hourly_counts_recipe_step_type_hour"),
+        )
+    if not has_table("rollup_watermarks"):
+        op.create_table(
+            "rollup_watermarks",
+            sa.Column("name", sa.String(100), primary_key=True),
+            sa.Column("last_id", sa.Integer),
+            sa.Column("settled_id", sa.Integer),
+            sa.Column("updated_on", sa.DateTime),
+        )
+
+
+def downgrade():
+    op.drop_table("rollup_watermarks")
+    op.drop_table("recipe_event_hourly_counts")
+    op.drop_table("event_hourly_counts")
@@ -0,0 +1,24 @@
+"""Add recipe_prices.pending_price, a new price held back until stripe has it
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2023-07-10 00:00:00
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_column
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_column("recipe_prices", "pending_price"):
+        op.add_column("recipe_prices", sa.Column("pending_price", sa.Float))
+
+
+def downgrade():
+    op.drop_column("recipe_prices", "pending_price")
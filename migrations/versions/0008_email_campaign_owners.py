@@ -0,0 +1,27 @@
+"""Add an owner and heartbeat to email campaigns so one process at a time sends each
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2023-07-10 00:00:00
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_column
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not has_column("email_campaigns", "owner"):
+        op.add_column("email_campaigns", sa.Column("owner", sa.String(100)))
+    if not has_column("email_campaigns", "heartbeat_on"):
+        op.add_column("email_campaigns", sa.Column("heartbeat_on", sa.DateTime))
+
+
+def downgrade():
+    op.drop_column("email_campaigns", "heartbeat_on")
+    op.drop_column("email_campaigns", "owner")
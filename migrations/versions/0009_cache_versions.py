@@ -0,0 +1,30 @@
+"""Add cache_versions, shared versions of the caches each server process keeps
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2023-07-10 00:00:00
+"""
+import sqlalchemy as sa
+from alembic import op
+
+from migrations.helpers import has_table
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if has_table("cache_versions"):
+        return
+    op.create_table(
+        "cache_versions",
+        sa.Column("name", sa.String(100), primary_key=True),
+        sa.Column("version", sa.Integer),
+        sa.Column("updated_on", sa.DateTime),
+    )
+
+
+def downgrade():
+    op.drop_table("cache_versions")
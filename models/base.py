@@ -1,3 +1,12 @@
+from sqlalchemy import MetaData
 from sqlalchemy.ext.declarative import declarative_base
 
-Base = declarative_base()
+# deterministic constraint names so migrations can find and drop them
+NAMING_CONVENTION = {
+    "ix": "ix_%(column_0_label)s",
+    "uq": "uq_%(table_name)s_%(column_0_name)s",
+    "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
+    "pk": "pk_%(table_name)s",
+}
+
+Base = declarative_base(metadata=MetaData(naming_convention=NAMING_CONVENTION))
@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String, DateTime
+
+from models.base import Base
+
+
+# Bumped by whichever server process learns that cached data changed; the others compare it with the version their
+# cache was filled at and drop what they hold when it moved.
+class CacheVersion(Base):
+    __tablename__ = "cache_versions"
+    name = Column(String(100), primary_key=True)
+    version = Column(Integer)
+    updated_on = Column(DateTime)
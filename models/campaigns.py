@@ -0,0 +1,28 @@
+import enum
+
+from sqlalchemy import Column, Integer, String, DateTime, Enum
+
+from models.base import Base
+
+
+class CampaignStatusEnum(str, enum.Enum):
+    RUNNING = "RUNNING"
+    COMPLETED = "COMPLETED"
+    FAILED = "FAILED"
+
+
+class EmailCampaign(Base):
+    __tablename__ = "email_campaigns"
+    id = Column(Integer, primary_key=True)
+    campaign_type = Column(String(100))
+    status = Column(Enum(CampaignStatusEnum))
+    last_recipient_id = Column(Integer)  # keyset cursor; every recipient up to this id has been processed
+    sent_count = Column(Integer)
+    failed_count = Column(Integer)
+    started_on = Column(DateTime)
+    updated_on = Column(DateTime)
+    completed_on = Column(DateTime)
+    last_error = Column(String(1000))
+    # the process sending the campaign, and when it last saved progress; a stale heartbeat means the sender is gone
+    owner = Column(String(100))
+    heartbeat_on = Column(DateTime)
@@ -9,7 +9,7 @@ class Customer(Base):
     id = Column(Integer, primary_key=True)
     first_name = Column(String(100))
     last_name = Column(String(100))
-    email = Column(String(100))
+    email = Column(String(100), unique=True)
     hashed_password = Column(String(1000))
     verified = Column(Boolean)
     join_date = Column(DateTime)
@@ -13,8 +13,8 @@ class InvitationStatusEnum(str, enum.Enum):
 class Invitation(Base):
     __tablename__ = "invitations"
     id = Column(Integer, primary_key=True)
-    email = Column(String(100))
-    referrer_verification_code = Column(String(100))
-    referred_verification_code = Column(String(100))
+    email = Column(String(100), index=True)
+    referrer_verification_code = Column(String(100), index=True)
+    referred_verification_code = Column(String(100), index=True)
     invitation_status = Column(Enum(InvitationStatusEnum))
     invited_on = Column(DateTime)
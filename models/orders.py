@@ -1,8 +1,9 @@
 import enum
 
-from sqlalchemy import Column, Integer, DateTime, String, JSON, Boolean, Float, Enum
+from sqlalchemy import Column, Integer, DateTime, String, Boolean, Float, Enum, ForeignKey, Index
 
 from models.base import Base
+from models.types import NativeJSON
 
 
 class PaymentStatusEnum(str, enum.Enum):
@@ -16,10 +17,10 @@ class PaymentStatusEnum(str, enum.Enum):
 class Order(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True)
-    user_facing_order_id = Column(String(100))
+    user_facing_order_id = Column(String(100), unique=True)
     order_date = Column(DateTime)
-    recipes = Column(JSON)  # map<ForeignKey("recipes.id"): serving_size> of recipes ordered
-    customer = Column(Integer)  # ForeignKey("customers.id")
+    recipes = Column(NativeJSON)  # map<ForeignKey("recipes.id"): serving_size> of recipes ordered
+    customer = Column(Integer)  # customers.id, or 0 while a guest order is only an intent
     verification_code = Column(String(100))
     recipient_first_name = Column(String(100))
     recipient_last_name = Column(String(100))
@@ -28,29 +29,49 @@ class Order(Base):
     delivered = Column(Boolean)
     delivery_date = Column(DateTime)
     order_total_dollars = Column(Float)
-    order_breakdown_dollars = Column(JSON)  # map<string, float> of all line items e.g. tax, delivery, promo codes
-    delivery_address = Column(JSON)  # api.orders.Address
+    # map<string, float> of all line items e.g. tax, delivery, promo codes
+    order_breakdown_dollars = Column(NativeJSON)
+    delivery_address = Column(NativeJSON)  # api.orders.Address
     phone_number = Column(String(10))
-    promo_codes = Column(JSON)  # list<ForeignKey("promo_codes.id")> of applied promo codes
-    payment_intent = Column(String(100))  # stripe payment intent id
+    promo_codes = Column(NativeJSON)  # list<ForeignKey("promo_codes.id")> of applied promo codes
+    payment_intent = Column(String(100), index=True)  # stripe payment intent id
+
+    __table_args__ = (
+        Index("ix_orders_customer_payment_status", "customer", "payment_status"),
+        Index("ix_orders_verification_code_payment_status", "verification_code", "payment_status"),
+    )
+
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+    id = Column(Integer, primary_key=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), index=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
+    serving_size = Column(Integer)
+    price = Column(Float)  # dollars charged for this recipe and serving size when the order was placed
+    order_date = Column(DateTime, index=True)  # copied from the order so reports can range scan without a join
+
+    __table_args__ = (
+        Index("ix_order_items_recipe_id_order_date", "recipe_id", "order_date"),
+    )
 
 
 class Cart(Base):
     __tablename__ = "carts"
     id = Column(Integer, primary_key=True)
-    verification_code = Column(String(100))
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
+    verification_code = Column(String(100), index=True)
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
     serving_size = Column(Integer)
 
 
 class PromoCode(Base):
     __tablename__ = "promo_codes"
     id = Column(Integer, primary_key=True)
-    promo_code_name = Column(String(100))
+    promo_code_name = Column(String(100), index=True)
     created_on = Column(DateTime)
     expires_on = Column(DateTime)
     number_times_redeemed = Column(Integer)
     stripe_promo_code_id = Column(String(100))
     amount_off = Column(Float)
     percent_off = Column(Float)
-    redeemable_by_verification_code = Column(String(100))
+    redeemable_by_verification_code = Column(String(100), index=True)
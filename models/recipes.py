@@ -1,6 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, Date, JSON, Float
+from sqlalchemy import Column, Integer, String, DateTime, Date, Float, ForeignKey, Index, UniqueConstraint
 
 from models.base import Base
+from models.types import NativeJSON
 
 
 class RecipeContributor(Base):
@@ -13,39 +14,45 @@ class RecipeContributor(Base):
 class Recipe(Base):
     __tablename__ = "recipes"
     id = Column(Integer, primary_key=True)
-    name = Column(String(200))
+    name = Column(String(200), unique=True)
     created_date = Column(DateTime)
     description = Column(String(1000))
     long_description = Column(String(1000))
     image_url = Column(String(10_000))
-    recipe_contributor_id = Column(Integer)  # ForeignKey("recipe_contributors.id")
+    recipe_contributor_id = Column(Integer, ForeignKey("recipe_contributors.id"))
     prep_time_minutes = Column(Integer)
     cook_time_minutes = Column(Integer)
-    tags = Column(JSON)
+    tags = Column(NativeJSON)
 
 
 class RecipePrice(Base):
     __tablename__ = "recipe_prices"
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
     serving_size = Column(Integer)
     price = Column(Float)
     stripe_product_id = Column(String(100))
     stripe_price_id = Column(String(100))
+    # a new price waiting for its stripe price; it replaces price once the sync has created that
+    pending_price = Column(Float)
+
+    __table_args__ = (
+        UniqueConstraint("recipe_id", "serving_size", name="uq_recipe_prices_recipe_id_serving_size"),
+    )
 
 
 class StarredRecipe(Base):
     __tablename__ = "starred_recipes"
     id = Column(Integer, primary_key=True)
     starred_date = Column(DateTime)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
-    verified_sign_up_id = Column(Integer)  # ForeignKey("verified_sign_ups.id")
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
+    verified_sign_up_id = Column(Integer, index=True)  # verified_sign_ups.id, rows are deleted on email change
 
 
 class RecipeSchedule(Base):
     __tablename__ = "recipe_schedules"
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
     schedule_start_date = Column(Date)
 
 
@@ -66,32 +73,40 @@ class Ingredient(Base):
 class RecipeIngredient(Base):
     __tablename__ = "recipe_ingredients"
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
-    ingredient_id = Column(Integer)  # ForeignKey("ingredients.id")
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
+    ingredient_id = Column(Integer, ForeignKey("ingredients.id"))
     quantity = Column(Float)
     unit = Column(String(100))
     serving_size = Column(Integer)
 
+    __table_args__ = (
+        Index("ix_recipe_ingredients_recipe_id_serving_size", "recipe_id", "serving_size"),
+    )
+
 
 class RecipeInYourKitchen(Base):
     __tablename__ = "recipe_in_your_kitchen"
     id = Column(Integer, primary_key=True)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
-    in_your_kitchen_id = Column(Integer)  # ForeignKey("in_your_kitchen.id")
-    or_ids = Column(JSON)  # list<ForeignKey("in_your_kitchen.id")> of other similar items
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
+    in_your_kitchen_id = Column(Integer, ForeignKey("in_your_kitchen.id"))
+    or_ids = Column(NativeJSON)  # list<ForeignKey("in_your_kitchen.id")> of other similar items
 
 
 class RecipeStep(Base):
     __tablename__ = "recipe_steps"
     id = Column(Integer, primary_key=True)
     step_number = Column(Integer)
-    recipe_id = Column(Integer)  # ForeignKey("recipes.id")
+    recipe_id = Column(Integer, ForeignKey("recipes.id"))
     serving_size = Column(Integer)
     title = Column(String(1000))
-    instructions = Column(JSON)  # list<string> of instructions
-    tips = Column(JSON)  # list<string> of tips
-    chefs_hats = Column(JSON)  # list<string> of chefs hat
-    ingredients = Column(JSON)  # list<ForeignKey("ingredients.id")> of ingredients needed in this step
-    in_your_kitchens = Column(
-        JSON)  # list<ForeignKey("in_your_kitchen.id")> of items needed in this step that are not provided in the box
-    gif_url = Column(JSON)  # list of gif urls for this step
+    instructions = Column(NativeJSON)  # list<string> of instructions
+    tips = Column(NativeJSON)  # list<string> of tips
+    chefs_hats = Column(NativeJSON)  # list<string> of chefs hat
+    ingredients = Column(NativeJSON)  # list<ForeignKey("ingredients.id")> of ingredients needed in this step
+    # list<ForeignKey("in_your_kitchen.id")> of items needed in this step that are not provided in the box
+    in_your_kitchens = Column(NativeJSON)
+    gif_url = Column(NativeJSON)  # list of gif urls for this step
+
+    __table_args__ = (
+        Index("ix_recipe_steps_recipe_id_serving_size", "recipe_id", "serving_size"),
+    )
@@ -8,6 +8,6 @@ class ResetPassword(Base):
 
     id = Column(Integer, primary_key=True)
     email = Column(String(100))
-    reset_code = Column(String(100))
+    reset_code = Column(String(100), index=True)
     reset_date = Column(DateTime)
     reset_complete = Column(Boolean)
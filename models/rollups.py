@@ -0,0 +1,41 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+
+from models.base import Base
+
+
+class EventHourlyCount(Base):
+    __tablename__ = "event_hourly_counts"
+    id = Column(Integer, primary_key=True)
+    event_type = Column(String(100))
+    hour = Column(DateTime)  # event_timestamp truncated to the hour
+    count = Column(Integer)
+    # events whose code did not belong to a verified sign up when they were rolled up
+    unverified_count = Column(Integer)
+
+    __table_args__ = (
+        UniqueConstraint("event_type", "hour", name="uq_event_hourly_counts_event_type_hour"),
+    )
+
+
+class RecipeEventHourlyCount(Base):
+    __tablename__ = "recipe_event_hourly_counts"
+    id = Column(Integer, primary_key=True)
+    recipe_id = Column(Integer)
+    step_number = Column(Integer)
+    event_type = Column(String(100))
+    hour = Column(DateTime)
+    count = Column(Integer)
+
+    __table_args__ = (
+        UniqueConstraint("recipe_id", "step_number", "event_type", "hour",
+                         name="uq_recipe_event_hourly_counts_recipe_step_type_hour"),
+    )
+
+
+class RollupWatermark(Base):
+    __tablename__ = "rollup_watermarks"
+    name = Column(String(100), primary_key=True)  # the source table
+    last_id = Column(Integer)  # every source row up to this id is counted
+    # the source's max id at the previous run; rows up to it have had a full interval for their transactions to commit
+    settled_id = Column(Integer)
+    updated_on = Column(DateTime)
@@ -6,27 +6,27 @@ from models.base import Base
 class UnverifiedSignUp(Base):
     __tablename__ = "unverified_sign_ups"
     id = Column(Integer, primary_key=True)
-    email = Column(String(100))
+    email = Column(String(100), index=True)
     signup_date = Column(DateTime)
     signup_from = Column(String(100))
     zipcode = Column(String(20))
-    verification_code = Column(String(100))
+    verification_code = Column(String(100), index=True)
 
 
 class VerifiedSignUp(Base):
     __tablename__ = "verified_sign_ups"
 
     id = Column(Integer, primary_key=True)
-    email = Column(String(100))
+    email = Column(String(100), index=True)
     signup_date = Column(DateTime)
     signup_from = Column(String(100))
     verify_date = Column(DateTime)
     zipcode = Column(String(20))
-    verification_code = Column(String(100))
+    verification_code = Column(String(100), index=True)
 
 
 class DeliverableZipcode(Base):
     __tablename__ = "deliverable_zipcodes"
     id = Column(Integer, primary_key=True)
-    zipcode = Column(String(20))
+    zipcode = Column(String(20), index=True)
     delivery_start_date = Column(DateTime)
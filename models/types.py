@@ -0,0 +1,20 @@
+import json
+from typing import Any
+
+from sqlalchemy import JSON
+from sqlalchemy.types import TypeDecorator
+
+
+class NativeJSON(TypeDecorator):
+    # Stores the python value as a json document once. Rows written before migration 0003 hold the document
+    # json-encoded a second time, i.e. a json string; those are unwrapped on read so callers always get the structure.
+    impl = JSON
+    cache_ok = True
+
+    def process_result_value(self, value: Any, dialect) -> Any:
+        if isinstance(value, str):
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
+        return value
@@ -0,0 +1,31 @@
+import enum
+
+from sqlalchemy import Column, Integer, String, DateTime, Enum, Index
+
+from models.base import Base
+from models.types import NativeJSON
+
+
+class WebhookEventStatusEnum(str, enum.Enum):
+    RECEIVED = "RECEIVED"
+    PROCESSING = "PROCESSING"
+    PROCESSED = "PROCESSED"
+    FAILED = "FAILED"
+
+
+class StripeWebhookEvent(Base):
+    __tablename__ = "stripe_webhook_events"
+    id = Column(Integer, primary_key=True)
+    event_id = Column(String(100), unique=True)  # stripe event id; retries of the same event share it
+    event_type = Column(String(100))
+    payload = Column(NativeJSON)  # the verified event as stripe sent it
+    status = Column(Enum(WebhookEventStatusEnum))
+    attempts = Column(Integer)
+    next_attempt_on = Column(DateTime)  # when the event may be picked up (again); also bounds a worker's claim on it
+    last_error = Column(String(1000))
+    received_on = Column(DateTime)
+    processed_on = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_stripe_webhook_events_status_next_attempt_on", "status", "next_attempt_on"),
+    )
@@ -0,0 +1,91 @@
+import logging
+from datetime import date
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from dependencies.campaigns import to_campaign_dict, start_campaign
+from dependencies.database import get_db
+from dependencies.events import event_buffer
+from dependencies.prep_report import build_prep_report
+from dependencies.responses import FastJSONResponse
+from dependencies.webhooks import to_webhook_event_dict
+from middleware.query_profiler import route_stats, reset_route_stats
+from models.campaigns import EmailCampaign, CampaignStatusEnum
+from models.webhooks import StripeWebhookEvent, WebhookEventStatusEnum
+from routers.orderV2 import webhook_worker
+from routers.signup import jinjaEnv, email_service
+
+logger = logging.getLogger("rasoibox")
+
+router = APIRouter(
+    prefix="/api/admin",
+    tags=["admin"]
+)
+
+
+@router.get("/campaign_status")
+async def campaign_status(campaign_id: int, db: Session = Depends(get_db)):
+    campaign: EmailCampaign = db.query(EmailCampaign).filter(EmailCampaign.id == campaign_id).first()
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Unknown campaign")
+    return FastJSONResponse(content=to_campaign_dict(campaign))
+
+
+@router.post("/resume_campaign")
+async def resume_campaign(campaign_id: int, db: Session = Depends(get_db)):
+    campaign: EmailCampaign = db.query(EmailCampaign).filter(EmailCampaign.id == campaign_id).first()
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Unknown campaign")
+    if campaign.status == CampaignStatusEnum.COMPLETED:
+        raise HTTPException(status_code=400, detail="Campaign already completed")
+
+    # does nothing while another process is sending it
+    if start_campaign(campaign.id, jinjaEnv, email_service):
+        logger.info("Resumed campaign {} after recipient {}".format(campaign.id, campaign.last_recipient_id))
+    db.refresh(campaign)
+    return FastJSONResponse(content=to_campaign_dict(campaign))
+
+
+@router.get("/query_stats")
+async def query_stats():
+    return FastJSONResponse(content=route_stats())
+
+
+@router.post("/reset_query_stats")
+async def reset_query_stats():
+    reset_route_stats()
+    return
+
+
+@router.get("/event_stats")
+async def event_stats():
+    return FastJSONResponse(content=event_buffer.stats())
+
+
+@router.get("/prep_report")
+async def prep_report(start_date: date, end_date: date, db: Session = Depends(get_db)):
+    if end_date <= start_date:
+        raise HTTPException(status_code=400, detail="end_date must be after start_date")
+    return FastJSONResponse(content=build_prep_report(start_date, end_date, db).to_dict(orient="records"))
+
+
+@router.get("/webhook_events")
+async def webhook_events(status: WebhookEventStatusEnum = WebhookEventStatusEnum.FAILED, limit: int = 100,
+                         db: Session = Depends(get_db)):
+    events: List[StripeWebhookEvent] = db.query(StripeWebhookEvent).filter(
+        StripeWebhookEvent.status == status).order_by(StripeWebhookEvent.id.desc()).limit(limit).all()
+    return FastJSONResponse(content=[to_webhook_event_dict(x) for x in events])
+
+
+@router.post("/retry_webhook_event")
+async def retry_webhook_event(event_id: str, db: Session = Depends(get_db)):
+    event: StripeWebhookEvent = db.query(StripeWebhookEvent).filter(StripeWebhookEvent.event_id == event_id).first()
+    if event is None:
+        raise HTTPException(status_code=404, detail="Unknown event")
+    if event.status != WebhookEventStatusEnum.FAILED:
+        raise HTTPException(status_code=400, detail="Event has not failed")
+    webhook_worker.retry(event, db)
+    logger.info("Retrying stripe event {}".format(event.event_id))
+    return FastJSONResponse(content=to_webhook_event_dict(event))
@@ -2,12 +2,11 @@ import logging
 from typing import List, Dict, Optional
 
 from fastapi import APIRouter, Depends
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 from config import Settings
 from dependencies.database import get_db
+from dependencies.responses import FastJSONResponse
 from models.orders import Cart
 from models.signups import VerifiedSignUp, UnverifiedSignUp
 
@@ -51,4 +50,4 @@ async def get_active_carts(db: Session = Depends(get_db)):
             items.append(cart_item.recipe_id)
             result[email] = items
 
-    return JSONResponse(jsonable_encoder(result))
+    return FastJSONResponse(content=result)
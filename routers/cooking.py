@@ -1,25 +1,23 @@
-import json
 import logging
 from datetime import datetime
 from functools import reduce
 from typing import List, Dict, Set
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 import api.recipes
 import models.recipes
 from api.cooking import FinishCookingPayload
 from api.event import SiteEvent
 from api.recipes import CandidateRecipe, StarRecipe, RecipeStep, RecipeMetadata, Quantity
-from dependencies.customers import get_current_customer
+from dependencies.customers import get_current_customer, Principal
 from dependencies.database import get_db
 from dependencies.events import emit_event
+from dependencies.order_items import order_has_recipe
+from dependencies.responses import FastJSONResponse
 from models.cooking import CookingHistory
-from models.customers import Customer
 from models.event import RecipeEvent
 from models.orders import Order
 from models.recipes import Recipe, RecipeContributor, StarredRecipe, RecipeSchedule, RecipeStep, \
@@ -36,14 +34,14 @@ router = APIRouter(
 
 @router.post("/finish_cooking")
 async def finish_cooking(cooking_payload: FinishCookingPayload,
-                         current_customer: Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+                         current_customer: Principal = Depends(get_current_customer), db: Session = Depends(get_db)):
     order: Order = db.query(Order).filter(
         and_(Order.user_facing_order_id == cooking_payload.order_id, Order.customer == current_customer.id)).first()
 
     if order is None:
         raise HTTPException(status_code=404, detail="Order not found.")
 
-    if str(cooking_payload.recipe_id) not in json.loads(order.recipes):
+    if not order_has_recipe(order, cooking_payload.recipe_id, db):
         raise HTTPException(status_code=404, detail="Recipe not found in order.")
 
     cooking_history: CookingHistory = db.query(CookingHistory).filter(
@@ -65,15 +63,13 @@ async def finish_cooking(cooking_payload: FinishCookingPayload,
 
 @router.get("/can_finish_cooking")
 async def can_finish_cooking(recipe_id: int, order_number: str,
-                             current_customer: Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
+                             current_customer: Principal = Depends(get_current_customer),
+                             db: Session = Depends(get_db)):
     order: Order = db.query(Order).filter(
         and_(Order.user_facing_order_id == order_number, Order.customer == current_customer.id)).first()
 
-    if order is None:
-        return JSONResponse(content=jsonable_encoder({"can_finish_cooking": False}))
-
-    if str(recipe_id) not in json.loads(order.recipes):
-        return JSONResponse(content=jsonable_encoder({"can_finish_cooking": False}))
+    if order is None or not order_has_recipe(order, recipe_id, db):
+        return FastJSONResponse(content={"can_finish_cooking": False})
 
     cooking_history = None
 
@@ -81,4 +77,4 @@ async def can_finish_cooking(recipe_id: int, order_number: str,
     #     and_(CookingHistory.recipe_id == recipe_id, CookingHistory.order_id == order_number,
     #          CookingHistory.customer_id == current_customer.id)).first()
 
-    return JSONResponse(content=jsonable_encoder({"can_finish_cooking": cooking_history is None}))
+    return FastJSONResponse(content={"can_finish_cooking": cooking_history is None})
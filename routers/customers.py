@@ -5,20 +5,19 @@ from datetime import datetime
 from typing import Optional
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
 from pydantic import BaseModel
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
 from starlette import status
-from starlette.responses import JSONResponse
 
 from api.customers import CustomerPayload, ChangePasswordPayload, ResetPasswordPayload, UpdateCustomerPayload, \
     CreateAccountFromIntentPayload
 from config import Settings
 from dependencies.customers import authenticate_customer, get_current_customer, get_password_hash, verify_password, \
-    create_access_token
+    create_customer_access_token, invalidate_principal, Principal
 from dependencies.database import get_db
+from dependencies.responses import FastJSONResponse
 from emails.base import send_email
 from emails.resetpassword import ResetPasswordEmail
 from emails.resetpasswordcomplete import ResetPasswordCompleteEmail
@@ -28,7 +27,7 @@ from models.invitations import Invitation
 from models.orders import PromoCode, Order
 from models.reset_passwords import ResetPassword
 from models.signups import VerifiedSignUp, UnverifiedSignUp
-from routers.signup import jinjaEnv, smtp_server
+from routers.signup import jinjaEnv, email_service
 
 logger = logging.getLogger("rasoibox")
 
@@ -61,7 +60,7 @@ def send_verify_email_best_effort(email: str, verification_code: str):
 
     # send email best effort
     try:
-        send_email(jinjaEnv, verification_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, verification_email, email_service)
     except Exception as e:
         logger.error("Failed to send email.")
         logger.error(e)
@@ -78,7 +77,7 @@ def send_reset_password_email_best_effort(email: str, reset_code: str):
 
     # send email best effort
     try:
-        send_email(jinjaEnv, reset_password_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, reset_password_email, email_service)
     except Exception as e:
         logger.error("Failed to send email.")
         logger.error(e)
@@ -91,7 +90,7 @@ def send_reset_password_complete_email_best_effort(email: str, first_name: str):
 
     # send email best effort
     try:
-        send_email(jinjaEnv, reset_password_complete_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, reset_password_complete_email, email_service)
     except Exception as e:
         logger.error("Failed to send email.")
         logger.error(e)
@@ -103,46 +102,43 @@ async def login_for_access_token(
 ):
     clean_email: str = form_data.username.strip()
     clean_email = clean_email.lower()
-    customer = authenticate_customer(clean_email, form_data.password, db)
+    customer = await authenticate_customer(clean_email, form_data.password, db)
     if not customer:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": customer.email})
     verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(VerifiedSignUp.email == customer.email).first()
-    customer: Customer = db.query(Customer).filter(Customer.email == customer.email).first()
+    access_token = create_customer_access_token(customer, verified_sign_up.verification_code)
     return Token(access_token=access_token, token_type="bearer", status=0, first_name=customer.first_name,
                  last_name=customer.last_name, email=customer.email,
                  verification_code=verified_sign_up.verification_code)
 
 
 @router.post("/check")
-async def is_authenticated(current_customer: Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
-    return JSONResponse(content=jsonable_encoder({
+async def is_authenticated(current_customer: Principal = Depends(get_current_customer)):
+    return FastJSONResponse(content={
         "authenticated": True,
         "first_name": current_customer.first_name,
         "last_name": current_customer.last_name,
         "email": current_customer.email,
-        "verification_code": verified_sign_up.verification_code
-    }))
+        "verification_code": current_customer.verification_code
+    })
 
 
 @router.post("/create")
-async def create_user_account(new_customer: CustomerPayload, db: Session = Depends(get_db)) -> JSONResponse:
+async def create_user_account(new_customer: CustomerPayload, db: Session = Depends(get_db)) -> FastJSONResponse:
     existing_customer = db.query(Customer).filter(Customer.email == new_customer.email).first()
 
     if existing_customer is not None:
-        return JSONResponse(content=jsonable_encoder({
+        return FastJSONResponse(content={
             "status": -1,
             "message": "A user with this email already exists."
-        }))
+        })
     else:
         verified_user = db.query(VerifiedSignUp).filter(VerifiedSignUp.email == new_customer.email).first()
-        hashed_password = get_password_hash(new_customer.password)
+        hashed_password = await get_password_hash(new_customer.password)
         verified: bool = verified_user is not None
 
         # if email and code match an invitation, consider this as a verified sign up
@@ -218,7 +214,7 @@ async def create_user_account(new_customer: CustomerPayload, db: Session = Depen
         create_welcome_promo_if_applicable(verification_code, db)
 
         db.commit()
-        return JSONResponse(content=jsonable_encoder(result))
+        return FastJSONResponse(content=result)
 
 
 @router.post("/create_account_from_intent")
@@ -235,7 +231,7 @@ async def create_user_account_from_intent(new_customer: CreateAccountFromIntentP
         logger.error("Could not find customer: {}".format(new_customer.create_id))
         raise HTTPException(404)
 
-    hashed_password = get_password_hash(new_customer.password)
+    hashed_password = await get_password_hash(new_customer.password)
 
     db.query(Customer).filter(Customer.id == new_customer.create_id).update({
         Customer.hashed_password: hashed_password,
@@ -243,13 +239,14 @@ async def create_user_account_from_intent(new_customer: CreateAccountFromIntentP
     })
 
     db.commit()
+    invalidate_principal(customer.id)
 
     return
 
 
 @router.post("/update")
 async def update_user_account(update_customer: UpdateCustomerPayload,
-                              current_customer: Customer = Depends(get_current_customer),
+                              current_customer: Principal = Depends(get_current_customer),
                               db: Session = Depends(get_db)):
     verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
         VerifiedSignUp.email == current_customer.email).first()
@@ -280,22 +277,25 @@ async def update_user_account(update_customer: UpdateCustomerPayload,
 
     db.query(Customer).filter(Customer.email == current_customer.email).update(changes)
     db.commit()
+    invalidate_principal(current_customer.id)
 
 
 @router.post("/change-password")
 async def change_password(change_password_payload: ChangePasswordPayload,
-                          current_customer: Customer = Depends(get_current_customer),
+                          current_customer: Principal = Depends(get_current_customer),
                           db: Session = Depends(get_db)):
-    if not verify_password(change_password_payload.old_password, current_customer.hashed_password):
+    customer: Customer = db.query(Customer).filter(Customer.id == current_customer.id).first()
+    if not await verify_password(change_password_payload.old_password, customer.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
         )
-    new_password_hash: str = get_password_hash(change_password_payload.new_password)
+    new_password_hash: str = await get_password_hash(change_password_payload.new_password)
     db.query(Customer).filter(Customer.email == current_customer.email).update({'hashed_password': new_password_hash})
     db.commit()
+    invalidate_principal(current_customer.id)
     # return new access token
-    access_token = create_access_token(data={"sub": current_customer.email})
+    access_token = create_customer_access_token(customer, current_customer.verification_code)
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -321,25 +321,25 @@ async def initiate_reset_password(email: str, db: Session = Depends(get_db)):
 
 
 @router.post("/is-reset-password-allowed")
-async def is_reset_password_allowed(reset_code: str, db: Session = Depends(get_db)) -> JSONResponse:
+async def is_reset_password_allowed(reset_code: str, db: Session = Depends(get_db)) -> FastJSONResponse:
     now = datetime.now()
     reset_password: ResetPassword = db.query(ResetPassword).filter(ResetPassword.reset_code == reset_code).first()
     if reset_password is None:
-        return JSONResponse(content=jsonable_encoder({
+        return FastJSONResponse(content={
             "status": -1,
             "message": "Unknown reset request"
-        }))
+        })
     time_since_password_requested = now - reset_password.reset_date
     if time_since_password_requested.total_seconds() > 1 * 60 * 60:
-        return JSONResponse(content=jsonable_encoder({
+        return FastJSONResponse(content={
             "status": -2,
             "message": "Reset request expired"
-        }))
-    return JSONResponse(content=jsonable_encoder({
+        })
+    return FastJSONResponse(content={
         "status": 0,
         "email": reset_password.email,
         "message": "Reset allowed"
-    }))
+    })
 
 
 @router.post("/complete-reset-password")
@@ -354,11 +354,12 @@ async def complete_reset_password(reset_password: ResetPasswordPayload, db: Sess
     if customer is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unrecognized customer.")
 
-    hashed_password: str = get_password_hash(reset_password.new_password)
+    hashed_password: str = await get_password_hash(reset_password.new_password)
     db.query(Customer).filter(Customer.email == reset_password_entry.email).update({'hashed_password': hashed_password})
     db.query(ResetPassword).filter(ResetPassword.reset_code == reset_password.reset_code).update(
         {'reset_complete': True})
     db.commit()
+    invalidate_principal(customer.id)
     send_reset_password_complete_email_best_effort(customer.email, customer.first_name)
 
 
@@ -376,7 +377,7 @@ async def get_customer_from_intent(create_id: int, payment_intent: str, db: Sess
         logger.error("Could not find customer: {}".format(create_id))
         raise HTTPException(404)
 
-    return JSONResponse(content=jsonable_encoder({"email": customer.email}))
+    return FastJSONResponse(content={"email": customer.email})
 
 
 def create_welcome_promo_if_applicable(verification_code: str, db: Session):
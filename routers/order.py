@@ -1,24 +1,25 @@
-import json
 import logging
 import random
 import string
 from datetime import datetime
 from functools import reduce
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 import models
 from api.orders import CartItem, PricedCartItem, Order
 from config import Settings
-from dependencies.customers import get_current_customer
+from dependencies.catalog import get_catalog, Catalog
+from dependencies.customers import get_current_customer, Principal
 from dependencies.database import get_db
+from dependencies.order_items import to_order_items
 from dependencies.order_utils import get_pretty_estimated_delivery_date
 from dependencies.referral_utils import generate_promo_code, create_stripe_promo_code, to_promo_amount_string
+from dependencies.responses import FastJSONResponse
 from dependencies.stripe_utils import create_checkout_session, find_promo_code_id
 from emails.base import send_email
 from emails.invitationcomplete import InvitationCompleteEmail
@@ -32,7 +33,7 @@ from models.invitations import Invitation, InvitationStatusEnum
 from models.orders import Cart, PromoCode, PaymentStatusEnum
 from models.recipes import Recipe, RecipePrice, RecipeContributor
 from models.signups import VerifiedSignUp, UnverifiedSignUp
-from routers.signup import smtp_server, jinjaEnv
+from routers.signup import email_service, jinjaEnv
 
 logger = logging.getLogger("rasoibox")
 
@@ -65,7 +66,7 @@ def send_invitation_complete_email_best_effort(verification_code: str, referred_
 
     # send email best effort
     try:
-        send_email(jinjaEnv, invitation_complete_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, invitation_complete_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -99,7 +100,7 @@ def send_receipt_email_best_effort(email: str, first_name: str, order_dict: Dict
 
     # send email best effort
     try:
-        send_email(jinjaEnv, receipt_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, receipt_email, email_service)
     except Exception as e:
         logger.exception("Failed to send email.{}".format(e))
 
@@ -126,7 +127,7 @@ def send_order_coming_today_email_best_effort(email: str, first_name: str, estim
 
     # send email best effort
     try:
-        send_email(jinjaEnv, order_coming_today_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, order_coming_today_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -153,7 +154,7 @@ def send_order_enroute_email_best_effort(email: str, first_name: str, estimated_
 
     # send email best effort
     try:
-        send_email(jinjaEnv, order_enroute_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, order_enroute_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -178,7 +179,7 @@ def send_order_delivered_email_best_effort(email: str, first_name: str, order_di
 
     # send email best effort
     try:
-        send_email(jinjaEnv, order_delivered_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, order_delivered_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -207,23 +208,22 @@ def send_order_picked_up_email_best_effort(email: str, create_id: int, payment_i
 
     # send email best effort
     try:
-        send_email(jinjaEnv, order_picked_up_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, order_picked_up_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
 
 @router.post("/initiate_place_order")
-async def initiate_place_order(order: Order, current_customer: Customer = Depends(get_current_customer),
+async def initiate_place_order(order: Order, current_customer: Principal = Depends(get_current_customer),
                                db: Session = Depends(get_db)):
     shipping_charge_dollars: int = 5
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
-    if verified_sign_up is None:
+    verification_code: Optional[str] = current_customer.verification_code
+    if verification_code is None:
         raise HTTPException(status_code=400, detail="User is not verified.")
 
     cart_items_by_recipe_id: Dict[int, Cart] = reduce(lambda d1, d2: {**d1, **d2},
                                                       [{x.recipe_id: x} for x in db.query(Cart).filter(
-                                                          Cart.verification_code == verified_sign_up.verification_code)
+                                                          Cart.verification_code == verification_code)
                                                       .all()], {})
 
     if len(cart_items_by_recipe_id.keys()) > 2:
@@ -231,20 +231,21 @@ async def initiate_place_order(order: Order, current_customer: Customer = Depend
 
     promo_codes: List[PromoCode] = db.query(PromoCode).filter(
         and_(PromoCode.promo_code_name.in_(order.promo_codes),
-             PromoCode.redeemable_by_verification_code == verified_sign_up.verification_code)).all()
+             PromoCode.redeemable_by_verification_code == verification_code)).all()
     if len(promo_codes) is not len(order.promo_codes):
         raise HTTPException(status_code=400, detail="Invalid promo codes.")
 
+    catalog: Catalog = get_catalog()
     recipes_serving_size_map: Dict[int, int] = {}
     recipe_prices_ordered: List[RecipePrice] = []
 
     for recipe_id in cart_items_by_recipe_id.keys():
         serving_size = cart_items_by_recipe_id[recipe_id].serving_size
         recipes_serving_size_map[recipe_id] = serving_size
-        recipe_price: RecipePrice = db.query(RecipePrice).filter(
-            and_(RecipePrice.recipe_id == recipe_id, RecipePrice.serving_size == serving_size)).first()
+        recipe_price: RecipePrice = catalog.get_price(recipe_id, serving_size)
         if recipe_price is None:
-            raise HTTPException(status_code=404, detail="Invalid recipe serving size combo")
+            # the catalog leaves out prices stripe has no price for yet, those are not on sale either
+            raise HTTPException(status_code=404, detail="Recipe is not on sale in this serving size")
         recipe_prices_ordered.append(recipe_price)
 
     order_total_dollars = reduce(lambda p1, p2: p1 + p2, [x.price for x in recipe_prices_ordered],
@@ -265,25 +266,28 @@ async def initiate_place_order(order: Order, current_customer: Customer = Depend
     user_facing_order_id = generate_order_id()
     order_date = datetime.now()
 
-    db.add(models.orders.Order(
+    new_order = models.orders.Order(
         user_facing_order_id=user_facing_order_id,
         order_date=order_date,
-        recipes=json.dumps(recipes_serving_size_map),
+        recipes=recipes_serving_size_map,
         recipient_first_name=order.recipient_first_name,
         recipient_last_name=order.recipient_last_name,
         payment_status=PaymentStatusEnum.INITIATED,
         customer=current_customer.id,
         delivered=False,
         order_total_dollars=round(order_total_dollars, 2),
-        order_breakdown_dollars=json.dumps(order_breakdown),
+        order_breakdown_dollars=order_breakdown,
         delivery_address=jsonable_encoder(order.delivery_address),
         phone_number=order.phone_number,
-        promo_codes=json.dumps([x.id for x in promo_codes])
-    ))
+        promo_codes=[x.id for x in promo_codes]
+    )
+    db.add(new_order)
+    db.flush()
+    db.add_all(to_order_items(new_order, recipe_prices_ordered))
 
     promo_code_names = [x.promo_code_name for x in promo_codes]
     db.query(PromoCode).filter(and_(PromoCode.promo_code_name.in_(promo_code_names),
-                                    PromoCode.redeemable_by_verification_code == verified_sign_up.verification_code)) \
+                                    PromoCode.redeemable_by_verification_code == verification_code)) \
         .update({PromoCode.number_times_redeemed: PromoCode.number_times_redeemed + 1})
 
     db.commit()
@@ -295,7 +299,7 @@ async def initiate_place_order(order: Order, current_customer: Customer = Depend
                                                    user_facing_order_id, current_customer.email,
                                                    [x.promo_code_name for x in promo_codes])
         logger.info("Successfully created checkout session {}".format(checkout_session))
-        return JSONResponse(content=jsonable_encoder({"session_url": checkout_session.url}))
+        return FastJSONResponse(content={"session_url": checkout_session.url})
     except Exception:
         logger.exception("Failed to create checkout session.")
         db.query(models.orders.Order).filter(models.orders.Order.user_facing_order_id == user_facing_order_id) \
@@ -336,11 +340,11 @@ async def admin_complete_place_order(order_id: str, db: Session = Depends(get_db
     # complete invite friend
     complete_invitation(customer, db)
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/complete_place_order")
-async def complete_place_order(order_id: str, current_customer: Customer = Depends(get_current_customer),
+async def complete_place_order(order_id: str, current_customer: Principal = Depends(get_current_customer),
                                db: Session = Depends(get_db)):
     order: models.orders.Order = db.query(models.orders.Order).filter(and_(
         models.orders.Order.user_facing_order_id == order_id,
@@ -348,14 +352,13 @@ async def complete_place_order(order_id: str, current_customer: Customer = Depen
         models.orders.Order.payment_status == PaymentStatusEnum.INITIATED)).first()
     if order is None or order.customer != current_customer.id:
         raise HTTPException(status_code=404, detail="Unknown order")
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
-    if verified_sign_up is None:
+    verification_code: Optional[str] = current_customer.verification_code
+    if verification_code is None:
         raise HTTPException(status_code=400, detail="User is not verified.")
 
     db.query(models.orders.Order).filter(models.orders.Order.user_facing_order_id == order_id).update(
         {"payment_status": PaymentStatusEnum.COMPLETED})
-    db.query(Cart).filter(Cart.verification_code == verified_sign_up.verification_code).delete()
+    db.query(Cart).filter(Cart.verification_code == verification_code).delete()
     db.commit()
 
     order: models.orders.Order = db.query(models.orders.Order).filter(
@@ -368,18 +371,18 @@ async def complete_place_order(order_id: str, current_customer: Customer = Depen
     # complete invite friend
     complete_invitation(current_customer, db)
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/cancel_place_order")
-async def cancel_place_order(order_id: str, current_customer: Customer = Depends(get_current_customer),
+async def cancel_place_order(order_id: str, current_customer: Principal = Depends(get_current_customer),
                              db: Session = Depends(get_db)):
     order = db.query(models.orders.Order).filter(models.orders.Order.user_facing_order_id == order_id).first()
     if order is None or order.customer != current_customer.id:
         raise HTTPException(status_code=404, detail="Unknown order")
     db.query(models.orders.Order).filter(models.orders.Order.user_facing_order_id == order_id).update(
         {models.orders.Order.payment_status: PaymentStatusEnum.CANCELED})
-    promo_code_ids: List[int] = json.loads(order.promo_codes)
+    promo_code_ids: List[int] = order.promo_codes
     db.query(PromoCode).filter(and_(PromoCode.id.in_(promo_code_ids), PromoCode.number_times_redeemed > 0)).update(
         {PromoCode.number_times_redeemed: PromoCode.number_times_redeemed - 1})
     db.commit()
@@ -387,18 +390,14 @@ async def cancel_place_order(order_id: str, current_customer: Customer = Depends
 
 @router.get("/get_cart")
 async def get_cart(verification_code: str, db: Session = Depends(get_db)):
+    catalog: Catalog = get_catalog()
     cart_items: List[Cart] = db.query(Cart).filter(Cart.verification_code == verification_code).all()
-    cart_recipe_ids: List[str] = [x.recipe_id for x in cart_items]
-    recipe_info: Dict[int, Dict[str, str]] = reduce(lambda d1, d2: {**d1, **d2},
-                                                    [{x.id: {"name": x.name, "image_url": x.image_url}} for x in
-                                                     db.query(Recipe).filter(
-                                                         Recipe.id.in_(cart_recipe_ids))], {})
     result: List[PricedCartItem] = []
     for cart_item in cart_items:
-        recipe_name = recipe_info[cart_item.recipe_id]["name"]
-        recipe_image_url = recipe_info[cart_item.recipe_id]["image_url"]
-        recipe_price: RecipePrice = db.query(RecipePrice).filter(and_(RecipePrice.recipe_id == cart_item.recipe_id,
-                                                                      RecipePrice.serving_size == cart_item.serving_size)).first()
+        recipe: Recipe = catalog.recipes_by_id[cart_item.recipe_id]
+        recipe_name = recipe.name
+        recipe_image_url = recipe.image_url
+        recipe_price: RecipePrice = catalog.get_price(cart_item.recipe_id, cart_item.serving_size)
         if recipe_price is None:
             raise HTTPException(status_code=400,
                                 detail="Could not find price {}".format(recipe_name))
@@ -406,7 +405,7 @@ async def get_cart(verification_code: str, db: Session = Depends(get_db)):
             PricedCartItem(recipe_name=recipe_name, image_url=recipe_image_url, serving_size=recipe_price.serving_size,
                            price=recipe_price.price))
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/update_cart")
@@ -415,7 +414,7 @@ async def update_cart(cart_item: CartItem, verification_code: str,
     # if not is_known_verification_code(verification_code, db):
     #     raise HTTPException(status_code=404, detail="Unknown user")
 
-    recipe: Recipe = db.query(Recipe).filter(Recipe.name == cart_item.recipe_name).first()
+    recipe: Recipe = get_catalog().get_recipe_by_name(cart_item.recipe_name)
     if recipe is None:
         raise HTTPException(status_code=404, detail="Unknown recipe {}".format(cart_item.recipe_name))
     existing_cart_item: Cart = db.query(Cart).filter(
@@ -438,11 +437,9 @@ async def update_cart(cart_item: CartItem, verification_code: str,
 
 @router.get("/get_available_items")
 async def get_available_items(db: Session = Depends(get_db)):
-    recipe_prices: List[RecipePrice] = db.query(RecipePrice).all()
-    recipe_ids: List[int] = list(set([x.recipe_id for x in recipe_prices]))
-    recipes: Dict[int, Recipe] = reduce(lambda d1, d2: {**d1, **d2},
-                                        [{x.id: x} for x in db.query(Recipe).filter(Recipe.id.in_(recipe_ids))], {})
-    creators: Dict[int, str] = {}
+    catalog: Catalog = get_catalog()
+    recipe_prices: List[RecipePrice] = catalog.prices
+    recipes: Dict[int, Recipe] = catalog.recipes_by_id
     result = {}
     for recipe_price in recipe_prices:
         if recipe_price.recipe_id not in recipes:
@@ -452,16 +449,10 @@ async def get_available_items(db: Session = Depends(get_db)):
             result[recipe_price.recipe_id]["prices"].append(recipe_price.price)
         else:
             recipe: Recipe = recipes[recipe_price.recipe_id]
-            tags = recipe.tags if recipe.tags is not None else json.dumps([])
-            created_by: str
-            if recipe.recipe_contributor_id in creators.keys():
-                created_by = creators[recipe.recipe_contributor_id]
-            else:
-                recipe_contributor: RecipeContributor = db.query(RecipeContributor).filter(
-                    RecipeContributor.id == recipe.recipe_contributor_id).first()
-                if recipe_contributor is None:
-                    raise HTTPException(status_code=400, detail="Unknown recipe contributor.")
-                created_by = recipe_contributor.name
+            recipe_contributor: RecipeContributor = catalog.get_contributor(recipe.recipe_contributor_id)
+            if recipe_contributor is None:
+                raise HTTPException(status_code=400, detail="Unknown recipe contributor.")
+            created_by: str = recipe_contributor.name
             result[recipe_price.recipe_id] = {
                 "recipe_name": recipe.name,
                 "description": recipe.description,
@@ -471,54 +462,53 @@ async def get_available_items(db: Session = Depends(get_db)):
                 "prices": [recipe_price.price],
                 "cook_time": recipe.cook_time_minutes,
                 "prep_time": recipe.prep_time_minutes,
-                "tags": json.loads(tags),
+                "tags": recipe.tags if recipe.tags is not None else [],
                 "created_by": created_by
             }
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.get("/get_order")
-async def get_order_from_order_id(order_id: str, current_customer: Customer = Depends(get_current_customer),
+async def get_order_from_order_id(order_id: str, current_customer: Principal = Depends(get_current_customer),
                                   db: Session = Depends(get_db)):
     order = db.query(models.orders.Order).filter(and_(models.orders.Order.user_facing_order_id == order_id,
                                                       models.orders.Order.customer == current_customer.id)).first()
     if order is None:
         raise HTTPException(status_code=404, detail="Unknown order")
 
-    return JSONResponse(content=jsonable_encoder(to_order_dict(order, db, customer_email=current_customer.email)))
+    return FastJSONResponse(content=to_order_dict(order, db, customer_email=current_customer.email))
 
 
 @router.get("/get_order_history")
-async def get_order_history(current_customer: Customer = Depends(get_current_customer),
+async def get_order_history(current_customer: Principal = Depends(get_current_customer),
                             db: Session = Depends(get_db)):
     orders: List[models.orders.Order] = db.query(models.orders.Order).filter(
         and_(models.orders.Order.customer == current_customer.id,
              models.orders.Order.payment_status == PaymentStatusEnum.COMPLETED)).all()
-    return JSONResponse(content=jsonable_encoder([to_order_dict(x, db) for x in orders]))
+    return FastJSONResponse(content=to_order_dicts(orders, db))
 
 
 @router.get("/get_active_recipes")
-async def get_active_recipes(current_customer: Customer = Depends(get_current_customer),
+async def get_active_recipes(current_customer: Principal = Depends(get_current_customer),
                              db: Session = Depends(get_db)):
     orders: List[models.orders.Order] = db.query(models.orders.Order).filter(and_(
         models.orders.Order.customer == current_customer.id,
         models.orders.Order.payment_status == PaymentStatusEnum.COMPLETED)).all()
 
-    active_orders: List[Dict[str, Any]] = [to_order_dict(x, db) for x in orders if is_active_order(x)]
-    return JSONResponse(content=jsonable_encoder(active_orders))
+    active_orders: List[Dict[str, Any]] = to_order_dicts([x for x in orders if is_active_order(x)], db)
+    return FastJSONResponse(content=active_orders)
 
 
 @router.get("/is_valid_promo_code")
-async def is_valid_promo_code(promo_code: str, current_customer: Customer = Depends(get_current_customer),
+async def is_valid_promo_code(promo_code: str, current_customer: Principal = Depends(get_current_customer),
                               db: Session = Depends(get_db)):
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
-    if verified_sign_up is None:
+    verification_code: Optional[str] = current_customer.verification_code
+    if verification_code is None:
         raise HTTPException(status_code=404, detail="Unknown promo code")
 
     promo_code: PromoCode = db.query(PromoCode).filter(and_(PromoCode.promo_code_name == promo_code,
-                                                            PromoCode.redeemable_by_verification_code == verified_sign_up.verification_code)).first()
+                                                            PromoCode.redeemable_by_verification_code == verification_code)).first()
 
     if promo_code is None:
         raise HTTPException(status_code=404, detail="Unknown promo code")
@@ -541,7 +531,7 @@ async def is_valid_promo_code(promo_code: str, current_customer: Customer = Depe
             "percent_off": promo_code.percent_off if promo_code.percent_off is not None else 0.0
         }
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/order_coming_today")
@@ -654,40 +644,45 @@ def is_active_order(order: models.orders.Order) -> bool:
 
 
 def to_order_dict(order: models.orders.Order, db: Session, customer_email=None) -> Dict[str, Any]:
-    recipes = json.loads(order.recipes)
-    recipe_prices: List[Union[RecipePrice, None]] = [
-        db.query(RecipePrice).filter(
-            and_(RecipePrice.recipe_id == recipe_id, RecipePrice.serving_size == recipes[recipe_id])).first()
-        for recipe_id in recipes.keys()]
-    recipe_prices_mapping: Dict[int, Dict[int, float]] = reduce(lambda d1, d2: {**d1, **d2},
-                                                                [{x.recipe_id: {x.serving_size: x.price}} for x in
-                                                                 recipe_prices if x is not None], {})
-
-    recipe_info: Dict[str, Dict[str, Any]] = reduce(lambda d1, d2: {**d1, **d2}, [
-        {x.name: {"id": x.id, "image_url": x.image_url, "serving_size": recipes[str(x.id)],
-                  "price": recipe_prices_mapping[x.id][recipes[str(x.id)]]}} for x in
-        db.query(Recipe).filter(Recipe.id.in_(recipes.keys())).all()], {})
-
-    result = {
-        "order_number": order.user_facing_order_id,
-        "order_breakdown": json.loads(order.order_breakdown_dollars),
-        "order_date": order.order_date,
-        "order_recipient_name": order.recipient_first_name + " " + order.recipient_last_name,
-        "order_delivery_address": order.delivery_address,
-        "order_total_dollars": order.order_total_dollars,
-        "order_delivered": order.delivered,
-        "order_create_id": order.customer,
-        "estimated_delivery_date": get_pretty_estimated_delivery_date(order.order_date),
-        "recipes": recipe_info,
-    }
+    return to_order_dicts([order], db, customer_email=customer_email)[0]
+
+
+def to_order_dicts(orders: List[models.orders.Order], db: Session, customer_email=None) -> List[Dict[str, Any]]:
+    # every recipe and price referenced by the orders is resolved from the catalog, so the query count does not grow
+    # with the number of orders
+    catalog: Catalog = get_catalog()
+    results: List[Dict[str, Any]] = []
+    for order in orders:
+        recipes: Dict[str, int] = order.recipes
+        order_recipes: List[Recipe] = [catalog.recipes_by_id[int(x)] for x in recipes.keys() if
+                                       int(x) in catalog.recipes_by_id]
+        recipe_info: Dict[str, Dict[str, Any]] = reduce(lambda d1, d2: {**d1, **d2}, [
+            {x.name: {"id": x.id, "image_url": x.image_url, "serving_size": recipes[str(x.id)],
+                      "price": catalog.prices_by_recipe_serving[(x.id, recipes[str(x.id)])].price}} for x in
+            order_recipes], {})
+
+        result = {
+            "order_number": order.user_facing_order_id,
+            "order_breakdown": order.order_breakdown_dollars,
+            "order_date": order.order_date,
+            "order_recipient_name": order.recipient_first_name + " " + order.recipient_last_name,
+            "order_delivery_address": order.delivery_address,
+            "order_total_dollars": order.order_total_dollars,
+            "order_delivered": order.delivered,
+            "order_create_id": order.customer,
+            "estimated_delivery_date": get_pretty_estimated_delivery_date(order.order_date),
+            "recipes": recipe_info,
+        }
+
+        if customer_email is not None:
+            result["customer_email"] = customer_email
 
-    if customer_email is not None:
-        result["customer_email"] = customer_email
+        if order.delivery_date is not None:
+            result["order_delivery_date"] = order.delivery_date
 
-    if order.delivery_date is not None:
-        result["order_delivery_date"] = order.delivery_date
+        results.append(result)
 
-    return result
+    return results
 
 
 def is_known_verification_code(verification_code: str, db: Session) -> bool:
@@ -1,28 +1,32 @@
-import json
 import logging
 import random
 import string
 from datetime import datetime
 from functools import reduce
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 
 import stripe
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.encoders import jsonable_encoder
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 from stripe.error import SignatureVerificationError
 from stripe.stripe_object import StripeObject
 
 import api
 from config import Settings
+from dependencies.campaigns import create_campaign, start_campaign
+from dependencies.catalog import get_catalog, Catalog
 from dependencies.database import get_db
+from dependencies.order_items import replace_order_items
+from dependencies.responses import FastJSONResponse
+from dependencies.stripe_cache import STRIPE_CACHE_EVENTS, handle_stripe_object_event
 from dependencies.stripe_utils import create_payment_intent, \
     get_payment_intent, modify_payment_intent
+from dependencies.webhooks import StripeWebhookWorker, record_webhook_event
 from emails.base import send_email
-from emails.createpassword import CreatePasswordEmail
 from emails.followup import FollowUpEmail
+from models.campaigns import EmailCampaign
 from models.customers import Customer
 from models.orders import Cart, PromoCode, PaymentStatusEnum
 from models.orders import Order
@@ -30,7 +34,7 @@ from models.recipes import RecipePrice
 from models.signups import VerifiedSignUp
 from routers.order import send_receipt_email_best_effort, to_order_dict, complete_invitation
 from routers.rewards import all_site_wide_promos
-from routers.signup import jinjaEnv, smtp_server
+from routers.signup import jinjaEnv, email_service
 
 logger = logging.getLogger("rasoibox")
 
@@ -87,7 +91,7 @@ async def initiate_intent(verification_code: str, db: Session = Depends(get_db))
         db.add(Order(
             user_facing_order_id=user_facing_order_id,
             order_date=datetime.now(),
-            recipes=json.dumps({}),
+            recipes={},
             recipient_first_name="",
             recipient_last_name="",
             payment_status=PaymentStatusEnum.INITIATED,
@@ -95,17 +99,17 @@ async def initiate_intent(verification_code: str, db: Session = Depends(get_db))
             verification_code=verification_code,
             delivered=False,
             order_total_dollars=1,
-            order_breakdown_dollars=json.dumps({}),
-            delivery_address=json.dumps({}),
+            order_breakdown_dollars={},
+            delivery_address={},
             phone_number="",
-            promo_codes=json.dumps({}),
+            promo_codes=[],
             payment_intent=payment_intent.stripe_id
         ))
 
         db.commit()
 
-    return JSONResponse(
-        content=jsonable_encoder({"client_secret": payment_intent.client_secret, "order_id": user_facing_order_id}))
+    return FastJSONResponse(
+        content={"client_secret": payment_intent.client_secret, "order_id": user_facing_order_id})
 
 
 @router.post("/initiate_place_order")
@@ -135,16 +139,17 @@ async def initiate_place_order(order: api.orders.Order, verification_code: str,
 
     promo_codes = promo_codes + all_site_wide_promos(verification_code, promo_codes, db)
 
+    catalog: Catalog = get_catalog()
     recipes_serving_size_map: Dict[int, int] = {}
     recipe_prices_ordered: List[RecipePrice] = []
 
     for recipe_id in cart_items_by_recipe_id.keys():
         serving_size = cart_items_by_recipe_id[recipe_id].serving_size
         recipes_serving_size_map[recipe_id] = serving_size
-        recipe_price: RecipePrice = db.query(RecipePrice).filter(
-            and_(RecipePrice.recipe_id == recipe_id, RecipePrice.serving_size == serving_size)).first()
+        recipe_price: RecipePrice = catalog.get_price(recipe_id, serving_size)
         if recipe_price is None:
-            raise HTTPException(status_code=404, detail="Invalid recipe serving size combo")
+            # the catalog leaves out prices stripe has no price for yet, those are not on sale either
+            raise HTTPException(status_code=404, detail="Recipe is not on sale in this serving size")
         recipe_prices_ordered.append(recipe_price)
 
     order_total_dollars = reduce(lambda p1, p2: p1 + p2, [x.price for x in recipe_prices_ordered], 0)
@@ -172,19 +177,20 @@ async def initiate_place_order(order: api.orders.Order, verification_code: str,
         raise HTTPException(status_code=400, detail="Failed to modify intent.")
 
     order_updates = {
-        Order.recipes: json.dumps(recipes_serving_size_map),
+        Order.recipes: recipes_serving_size_map,
         Order.recipient_first_name: order.recipient_first_name,
         Order.recipient_last_name: order.recipient_last_name,
         Order.recipient_email: order.email,
         Order.order_total_dollars: round(order_total_dollars, 2),
-        Order.order_breakdown_dollars: json.dumps(order_breakdown),
+        Order.order_breakdown_dollars: order_breakdown,
         Order.delivery_address: jsonable_encoder(order.delivery_address),
         Order.phone_number: order.phone_number,
-        Order.promo_codes: json.dumps([x.id for x in promo_codes])
+        Order.promo_codes: [x.id for x in promo_codes]
     }
 
     db.query(Order).filter(and_(Order.user_facing_order_id == existing_order.user_facing_order_id,
                                 Order.payment_status == PaymentStatusEnum.INITIATED)).update(order_updates)
+    replace_order_items(existing_order, recipe_prices_ordered, db)
 
     promo_code_names = [x.promo_code_name for x in promo_codes]
     db.query(PromoCode).filter(PromoCode.promo_code_name.in_(promo_code_names)).update(
@@ -204,16 +210,6 @@ async def webhook_complete_order(request: Request, db: Session = Depends(get_db)
     try:
         event = stripe.Webhook.construct_event(request_body, stripe_signature,
                                                settings.stripe_payment_success_webhook_secret)
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-
-            complete_order(payment_intent['id'], payment_intent['metadata']['user_facing_order_id'],
-                           payment_intent['amount'], db)
-
-            return JSONResponse(content=jsonable_encoder({"success": True}))
-        else:
-            logger.warning(event)
-            raise HTTPException(status_code=400, detail="Unrecognized event")
     except ValueError as e:
         # Invalid payload
         logger.error(e)
@@ -224,6 +220,17 @@ async def webhook_complete_order(request: Request, db: Session = Depends(get_db)
         logger.error(e)
         raise HTTPException(status_code=403, detail="Invalid signature")
 
+    if not webhook_worker.handles(event['type']):
+        logger.warning(event)
+        raise HTTPException(status_code=400, detail="Unrecognized event")
+
+    # acknowledge as soon as the event is stored; the worker completes the order
+    if record_webhook_event(event.to_dict_recursive(), db):
+        webhook_worker.notify()
+    else:
+        logger.info("Ignoring duplicate stripe event {}".format(event['id']))
+    return FastJSONResponse(content={"success": True})
+
 
 @router.get("/get_order_from_intent")
 async def get_order_from_payment_intent(order_id: str, payment_intent: str, db: Session = Depends(get_db)):
@@ -233,37 +240,14 @@ async def get_order_from_payment_intent(order_id: str, payment_intent: str, db:
     if order is None:
         raise HTTPException(status_code=404, detail="Unknown order")
 
-    return JSONResponse(content=jsonable_encoder(to_order_dict(order, db, customer_email=order.recipient_email)))
+    return FastJSONResponse(content=to_order_dict(order, db, customer_email=order.recipient_email))
 
 
 @router.post("/email_orders_without_accounts")
 async def email_orders_without_accounts(db: Session = Depends(get_db)):
-    customers: List[Customer] = db.query(Customer).filter(Customer.hashed_password.is_(None)).all()
-    emails: List[(int, str)] = []
-    for customer in customers:
-        order: Order = db.query(Order).filter(
-            and_(Order.customer == customer.id, Order.payment_status == PaymentStatusEnum.COMPLETED)).first()
-        if order is None:
-            logger.warning("Could not find order for customer without password: {}".format(customer.id))
-        else:
-            emails.append((order.customer, order.payment_intent))
-            try:
-                url_base: str = settings.frontend_url_base[0:-1] if settings.frontend_url_base.endswith(
-                    "/") else settings.frontend_url_base
-                create_password_email: CreatePasswordEmail = CreatePasswordEmail(
-                    url_base=url_base,
-                    first_name=order.recipient_first_name,
-                    create_id=order.customer,
-                    payment_intent=order.payment_intent,
-                    to_email=order.recipient_email,
-                    from_email=settings.from_email
-                )
-                send_email(jinjaEnv, create_password_email, smtp_server, settings.email, settings.email_app_password)
-            except Exception as e:
-                logger.error("Could not email: {}".format(order.recipient_email))
-                logger.error(e)
-
-    return JSONResponse(jsonable_encoder(emails))
+    campaign: EmailCampaign = create_campaign("create_password", 0, db)
+    start_campaign(campaign.id, jinjaEnv, email_service)
+    return FastJSONResponse(content={"campaign_id": campaign.id})
 
 
 @router.post("/admin_webhook_complete_order")
@@ -280,7 +264,7 @@ async def follow_up_email(order_id: str, db: Session = Depends(get_db)):
             return
         else:
             email: FollowUpEmail = FollowUpEmail(order.recipient_email, settings.from_email)
-            send_email(jinjaEnv, email, smtp_server, settings.email, settings.email_app_password)
+            send_email(jinjaEnv, email, email_service)
     except Exception as e:
         logger.error(e)
         raise HTTPException(status_code=400, detail="Failed to send email.")
@@ -304,10 +288,12 @@ def complete_order(payment_intent_id: str, user_facing_order_id: str, amount_cen
         raise HTTPException(status_code=400, detail="Order total does not match.")
 
     current_customer: Customer = db.query(Customer).filter(Customer.id == order.customer).first()
-    create_account_email: bool = False
+    if current_customer is None:
+        # intents are saved with customer 0, so a returning guest or a customer with an account lands here too; emails
+        # are unique, so only a new email gets a new customer
+        current_customer = db.query(Customer).filter(Customer.email == order.recipient_email).first()
     if current_customer is None:
         logger.info("Order placed by guest.")
-        create_account_email = True
         db.add(
             Customer(
                 first_name=order.recipient_first_name,
@@ -353,3 +339,26 @@ def complete_order(payment_intent_id: str, user_facing_order_id: str, amount_cen
 
     # complete invite friend
     complete_invitation(current_customer, db)
+
+
+def handle_payment_intent_succeeded(event: Dict[str, Any], db: Session):
+    payment_intent = event['data']['object']
+    order: Order = db.query(Order).filter(Order.payment_intent == payment_intent['id']).first()
+    if order is not None and order.payment_status == PaymentStatusEnum.COMPLETED:
+        # a retry after the order was completed, e.g. when creating the referrer's promo code failed; only the steps
+        # after the commit are left, and complete_invitation skips invitations it already completed
+        logger.info("Order already completed for payment intent {}".format(payment_intent['id']))
+        customer: Optional[Customer] = db.query(Customer).filter(Customer.id == order.customer).first()
+        if customer is not None:
+            complete_invitation(customer, db)
+        return
+    complete_order(payment_intent['id'], payment_intent['metadata']['user_facing_order_id'],
+                   payment_intent['amount'], db)
+
+
+webhook_worker: StripeWebhookWorker = StripeWebhookWorker(max_attempts=settings.webhook_max_attempts,
+                                                          backoff_seconds=settings.webhook_backoff_seconds,
+                                                          poll_seconds=settings.webhook_poll_seconds)
+webhook_worker.register("payment_intent.succeeded", handle_payment_intent_succeeded)
+for stripe_cache_event in STRIPE_CACHE_EVENTS:
+    webhook_worker.register(stripe_cache_event, handle_stripe_object_event)
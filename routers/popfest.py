@@ -1,21 +1,18 @@
 import logging
-import time
-from typing import List
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 from config import Settings
+from dependencies.campaigns import create_campaign, start_campaign
 from dependencies.database import get_db
+from dependencies.responses import FastJSONResponse
 from emails.base import send_email
-from emails.popfest.preorder1 import PreOrder1Email
 from emails.popfest.preorder2 import PreOrder2Email
+from models.campaigns import EmailCampaign
 from models.orders import PromoCode
-from models.signups import VerifiedSignUp, UnverifiedSignUp
-from routers.signup import jinjaEnv, smtp_server
+from models.signups import VerifiedSignUp
+from routers.signup import jinjaEnv, email_service
 
 logger = logging.getLogger("rasoibox")
 
@@ -34,7 +31,7 @@ async def preorder_2_test(verification_code: str, db: Session = Depends(get_db))
     if verified is not None:
         try:
             pre_order_email: PreOrder2Email = PreOrder2Email(verified.email, settings.from_email)
-            send_email(jinjaEnv, pre_order_email, smtp_server, settings.email, settings.email_app_password)
+            send_email(jinjaEnv, pre_order_email, email_service)
         except Exception as e:
             logger.error("Failed to send email.")
             logger.error(e)
@@ -43,68 +40,24 @@ async def preorder_2_test(verification_code: str, db: Session = Depends(get_db))
 
 @router.post("/preorder2_verified")
 async def preorder_2_verified(after_id: int, db: Session = Depends(get_db)):
-    all_verified: List[VerifiedSignUp] = db.query(VerifiedSignUp).filter(
-        and_(VerifiedSignUp.id > after_id, VerifiedSignUp.signup_from != "GUEST_ORDER")).all()
-    all_verified_emails: List[str] = [x.email for x in all_verified]
-    logger.info("Verified size: {}".format(len(all_verified)))
-
-    for verified_sign_up in all_verified_emails:
-        try:
-            pre_order_email: PreOrder2Email = PreOrder2Email(verified_sign_up, settings.from_email)
-            send_email(jinjaEnv, pre_order_email, smtp_server, settings.email, settings.email_app_password)
-            time.sleep(1)
-            logger.info("Email sent to: {}".format(verified_sign_up))
-        except Exception as e:
-            logger.error("Failed to send email.")
-            logger.error(e)
+    return launch_campaign("preorder2_verified", after_id, db)
 
 
 @router.post("/preorder2_unverified")
 async def preorder_2_unverified(after_id: int, db: Session = Depends(get_db)):
-    all_unverified: List[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(UnverifiedSignUp.id > after_id).all()
-    all_unverified_emails: List[str] = [x.email for x in all_unverified]
-    logger.info("Unverified size: {}".format(len(all_unverified)))
-
-    for unverified_sign_up in all_unverified_emails:
-        try:
-            pre_order_email: PreOrder2Email = PreOrder2Email(unverified_sign_up, settings.from_email)
-            send_email(jinjaEnv, pre_order_email, smtp_server, settings.email, settings.email_app_password)
-            time.sleep(1)
-            logger.info("Email sent to: {}".format(unverified_sign_up))
-        except Exception as e:
-            logger.error("Failed to send email.")
-            logger.error(e)
+    return launch_campaign("preorder2_unverified", after_id, db)
 
 
 @router.post("/preorder1")
 async def preorder_1(after_id: int, db: Session = Depends(get_db)):
-    # all_verified: List[VerifiedSignUp] = db.query(VerifiedSignUp).filter(VerifiedSignUp.id > after_id).all()
-    # all_verified_emails: List[str] = [x.email for x in all_verified]
-    # logger.info("Verified size: {}".format(len(all_verified)))
-    #
-    # for verified_sign_up in all_verified_emails:
-    #     try:
-    #         pre_order_email: PreOrder1Email = PreOrder1Email(verified_sign_up, settings.from_email)
-    #         send_email(jinjaEnv, pre_order_email, smtp_server, settings.email, settings.email_app_password)
-    #         time.sleep(1)
-    #         logger.info("Email sent to: {}".format(verified_sign_up))
-    #     except Exception as e:
-    #         logger.error("Failed to send email.")
-    #         logger.error(e)
-
-    all_unverified: List[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(UnverifiedSignUp.id > after_id).all()
-    all_unverified_emails: List[str] = [x.email for x in all_unverified]
-    logger.info("Unverified size: {}".format(len(all_unverified)))
-
-    for unverified_sign_up in all_unverified_emails:
-        try:
-            pre_order_email: PreOrder1Email = PreOrder1Email(unverified_sign_up, settings.from_email)
-            send_email(jinjaEnv, pre_order_email, smtp_server, settings.email, settings.email_app_password)
-            time.sleep(1)
-            logger.info("Email sent to: {}".format(unverified_sign_up))
-        except Exception as e:
-            logger.error("Failed to send email.")
-            logger.error(e)
+    return launch_campaign("preorder1", after_id, db)
+
+
+def launch_campaign(campaign_type: str, after_id: int, db: Session):
+    campaign: EmailCampaign = create_campaign(campaign_type, after_id, db)
+    start_campaign(campaign.id, jinjaEnv, email_service)
+    logger.info("Started {} campaign {} after recipient {}".format(campaign_type, campaign.id, after_id))
+    return FastJSONResponse(content={"campaign_id": campaign.id})
 
 
 @router.get("/is_valid_promo_code")
@@ -112,12 +65,12 @@ async def is_valid_promo_code(promo_code: str, db: Session = Depends(get_db)):
     if promo_code == "SCXRB15":
         promo_code: PromoCode = db.query(PromoCode).filter(PromoCode.promo_code_name == promo_code).first()
         if promo_code is not None:
-            return JSONResponse(content=jsonable_encoder({
+            return FastJSONResponse(content={
                 "status": 0,
                 "promo_code_name": promo_code.promo_code_name,
                 "amount_off": promo_code.amount_off if promo_code.amount_off is not None else 0.0,
                 "percent_off": promo_code.percent_off if promo_code.percent_off is not None else 0.0
-            }))
+            })
     raise HTTPException(status_code=404, detail="Unknown promo code")
 
 
@@ -1,22 +1,21 @@
 import logging
 from datetime import datetime
 from functools import reduce
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 import models.invitations
 from api.price import RecipeServingPrice, Invitation, ReferredEmails
 from config import Settings
-from dependencies.customers import get_current_customer
+from dependencies.customers import get_current_customer, Principal
 from dependencies.database import get_db
 from dependencies.referral_utils import create_stripe_promo_code, to_promo_amount_string, generate_promo_code
+from dependencies.responses import FastJSONResponse
 from dependencies.signup import generate_verification_code
-from dependencies.stripe_utils import create_stripe_product
+from dependencies.stripe_sync import start_stripe_sync, get_stripe_sync_job, to_stripe_sync_dict
 from emails.base import send_email
 from emails.invitation import InvitationEmail
 from emails.referral import ReferralEmail
@@ -25,7 +24,7 @@ from models.customers import Customer
 from models.orders import PromoCode
 from models.recipes import Recipe, RecipePrice
 from models.signups import VerifiedSignUp, DeliverableZipcode, UnverifiedSignUp
-from routers.signup import jinjaEnv, smtp_server, send_verify_email
+from routers.signup import jinjaEnv, email_service, send_verify_email
 
 logger = logging.getLogger("rasoibox")
 
@@ -55,7 +54,7 @@ def send_auth_referral_email_best_effort(email: str, referrer_first_name: str, r
 
     # send email best effort
     try:
-        send_email(jinjaEnv, referral_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, referral_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -77,7 +76,7 @@ def send_referral_email_best_effort(referred_email: str, referrer_email: str, re
 
     # send email best effort
     try:
-        send_email(jinjaEnv, referral_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, referral_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -97,7 +96,7 @@ def send_invitation_email_best_effort(email: str, verification_code: str, promo_
 
     # send email best effort
     try:
-        send_email(jinjaEnv, invitation_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, invitation_email, email_service)
     except Exception:
         logger.exception("Failed to send email.")
 
@@ -121,18 +120,41 @@ async def add_prices(prices: List[RecipeServingPrice], db: Session = Depends(get
     unique_recipe_names = list(set([x.recipe_name for x in prices]))
     recipes: Dict[str, Recipe] = reduce(lambda d1, d2: {**d1, **d2}, [{x.name: x} for x in db.query(Recipe).filter(
         Recipe.name.in_(unique_recipe_names)).all()], {})
+    if len(recipes) != len(unique_recipe_names):
+        raise HTTPException(status_code=404, detail="Unknown recipe")
+    existing: Dict[Tuple[int, int], RecipePrice] = {(x.recipe_id, x.serving_size): x for x in db.query(
+        RecipePrice).filter(RecipePrice.recipe_id.in_([x.id for x in recipes.values()])).all()}
+
     recipe_prices: List[RecipePrice] = []
     for price in prices:
         recipe = recipes[price.recipe_name]
+        recipe_price: Optional[RecipePrice] = existing.get((recipe.id, price.serving_size))
+        if recipe_price is None:
+            # off sale until the sync below fills in the stripe ids
+            recipe_price = RecipePrice(recipe_id=recipe.id, serving_size=price.serving_size, price=price.price)
+            db.add(recipe_price)
+        else:
+            # checkout keeps charging the current price until the sync has a stripe price for this one
+            recipe_price.pending_price = price.price
+        recipe_prices.append(recipe_price)
 
-        stripe_product = create_stripe_product(recipe.name, recipe.description, recipe.image_url, price.serving_size,
-                                               price.price)
-        recipe_prices.append(
-            RecipePrice(recipe_id=recipe.id, serving_size=price.serving_size, price=price.price,
-                        stripe_product_id=stripe_product["id"], stripe_price_id=stripe_product["default_price"]))
-
-    db.add_all(recipe_prices)
     db.commit()
+    # creating the stripe products takes a round trip or two per price; report progress on /sync_status instead
+    job = start_stripe_sync([x.id for x in recipe_prices])
+    return FastJSONResponse(content=to_stripe_sync_dict(job))
+
+
+@router.post("/sync_prices")
+async def sync_prices():
+    return FastJSONResponse(content=to_stripe_sync_dict(start_stripe_sync()))
+
+
+@router.get("/sync_status")
+async def sync_status(job_id: str):
+    job = get_stripe_sync_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown sync job")
+    return FastJSONResponse(content=to_stripe_sync_dict(job))
 
 
 @router.post("/create_promo_code")
@@ -172,12 +194,11 @@ async def invite_verified_user(verification_code: str, db: Session = Depends(get
 
 @router.post("/initiate_invitation_auth")
 async def initiate_invitation_auth(referred_emails: ReferredEmails,
-                                   current_customer: Customer = Depends(get_current_customer),
+                                   current_customer: Principal = Depends(get_current_customer),
                                    db: Session = Depends(get_db)):
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
+    verification_code: Optional[str] = current_customer.verification_code
 
-    if verified_sign_up is None:
+    if verification_code is None:
         raise HTTPException(status_code=404, detail="Unverified user.")
 
     successes: List[str] = []
@@ -205,7 +226,7 @@ async def initiate_invitation_auth(referred_emails: ReferredEmails,
                 db.add(
                     models.invitations.Invitation(
                         email=referred_email,
-                        referrer_verification_code=verified_sign_up.verification_code,
+                        referrer_verification_code=verification_code,
                         referred_verification_code=referred_verification_code,
                         invitation_status=models.invitations.InvitationStatusEnum.INVITED,
                         invited_on=datetime.now()
@@ -225,7 +246,7 @@ async def initiate_invitation_auth(referred_emails: ReferredEmails,
 
     db.commit()
 
-    return JSONResponse(content=jsonable_encoder({"status": 1, "successes": successes, "failures": failures}))
+    return FastJSONResponse(content={"status": 1, "successes": successes, "failures": failures})
 
 
 @router.post("/initiate_invitation")
@@ -292,7 +313,7 @@ async def initiate_invitation(invitation: Invitation, db: Session = Depends(get_
 
     db.commit()
 
-    return JSONResponse(content=jsonable_encoder({"status": 1, "successes": successes, "failures": failures}))
+    return FastJSONResponse(content={"status": 1, "successes": successes, "failures": failures})
 
 
 @router.get("/get_eligible_invitees")
@@ -308,19 +329,18 @@ async def get_eligible_invitees(db: Session = Depends(get_db)):
              VerifiedSignUp.email.not_in(all_customers_emails),
              VerifiedSignUp.verification_code.not_in(redeemable_verification_codes))).all()
 
-    return JSONResponse(content=jsonable_encoder([x.verification_code for x in verified_sign_ups]))
+    return FastJSONResponse(content=[x.verification_code for x in verified_sign_ups])
 
 
 @router.get("/get_promo_code")
-async def get_promo_code(current_customer: Customer = Depends(get_current_customer), db: Session = Depends(get_db)):
-    verified_sign_up: VerifiedSignUp = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.email == current_customer.email).first()
+async def get_promo_code(current_customer: Principal = Depends(get_current_customer), db: Session = Depends(get_db)):
+    verification_code: Optional[str] = current_customer.verification_code
 
-    if verified_sign_up is None:
+    if verification_code is None:
         raise HTTPException(status_code=404, detail="Unverified user.")
 
     promo_codes = db.query(PromoCode).filter(and_(
-        PromoCode.redeemable_by_verification_code == verified_sign_up.verification_code,
+        PromoCode.redeemable_by_verification_code == verification_code,
         PromoCode.number_times_redeemed == 0)).all()
 
     if promo_codes is not None and len(promo_codes) > 0:
@@ -337,4 +357,4 @@ async def get_promo_code(current_customer: Customer = Depends(get_current_custom
             "status": 1
         }
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
@@ -1,23 +1,24 @@
-import json
 import logging
 from datetime import datetime
 from functools import reduce
 from typing import List, Dict, Set
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
+from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 import api.recipes
 import models.recipes
 from api.event import SiteEvent
 from api.recipes import CandidateRecipe, StarRecipe, RecipeStep, RecipeMetadata, Quantity
+from dependencies.catalog import invalidate_catalog, get_catalog
 from dependencies.database import get_db
-from dependencies.events import emit_event
-from models.event import RecipeEvent
-from models.recipes import Recipe, RecipeContributor, StarredRecipe, RecipeSchedule, RecipeStep, \
+from dependencies.event_batches import submit_event_batch
+from dependencies.events import emit_event, emit_recipe_event
+from dependencies.recipe_documents import get_recipe_document, warm_recipe_documents, document_response, METADATA, \
+    STEPS
+from dependencies.responses import FastJSONResponse
+from models.recipes import Recipe, RecipeContributor, StarredRecipe, RecipeStep, \
     RecipeIngredient, InYourKitchen, RecipeInYourKitchen, Ingredient
 from models.signups import VerifiedSignUp
 
@@ -28,6 +29,9 @@ router = APIRouter(
     tags=["recipe"]
 )
 
+# the documents are sent as prebuilt bytes, so the response models only describe them in the schema
+NOT_MODIFIED = {304: {"description": "The document matches If-None-Match"}}
+
 
 @router.post("/add")
 async def add_recipes(recipes: List[CandidateRecipe], db: Session = Depends(get_db)):
@@ -59,6 +63,7 @@ async def add_recipes(recipes: List[CandidateRecipe], db: Session = Depends(get_
 
     db.add_all(list(recipes_to_add.values()))
     db.commit()
+    invalidate_catalog()
     return
 
 
@@ -101,6 +106,9 @@ async def add_recipe_metadata(recipes: List[RecipeMetadata], db: Session = Depen
     db.add_all(recipes_ingredients_to_add)
     db.add_all(recipes_in_your_kitchens_to_add)
     db.commit()
+    invalidate_catalog()
+    for recipe in recipes:
+        warm_recipe_documents(get_catalog().get_recipe_by_name(recipe.recipe_name).id, db)
     return
 
 
@@ -123,12 +131,12 @@ async def add_recipe_steps(recipe_id: int, serving_size: int, steps: List[api.re
             recipe_id=recipe.id,
             serving_size=serving_size,
             title=step.title,
-            instructions=json.dumps(step.instructions),
-            tips=json.dumps(step.tips),
-            chefs_hats=json.dumps(step.chefs_hats),
-            ingredients=json.dumps(ingredient_ids),
-            in_your_kitchens=json.dumps(in_your_kitchen_ids),
-            gif_url=json.dumps(step.gif_url)
+            instructions=step.instructions,
+            tips=step.tips,
+            chefs_hats=step.chefs_hats,
+            ingredients=ingredient_ids,
+            in_your_kitchens=in_your_kitchen_ids,
+            gif_url=step.gif_url
         ))
     ingredients_to_update: List[RecipeIngredient] = get_ingredients_to_update(recipe_id, unique_ingredient_ids, db)
     in_your_kitchens_to_update: List[RecipeInYourKitchen] = get_in_your_kitchens_to_update(recipe_id,
@@ -138,6 +146,8 @@ async def add_recipe_steps(recipe_id: int, serving_size: int, steps: List[api.re
     db.add_all(ingredients_to_update)
     db.add_all(in_your_kitchens_to_update)
     db.commit()
+    invalidate_catalog()
+    warm_recipe_documents(recipe.id, db)
 
 
 @router.get("/get")
@@ -162,97 +172,27 @@ async def get_recipe_by_id(id: int, db: Session = Depends(get_db)):
         }
 
 
-@router.get("/get_recipe_metadata")
-async def get_recipe_metadata(name: str, serving_size: int, db: Session = Depends(get_db)) -> RecipeMetadata:
-    recipe: Recipe = db.query(Recipe).filter(Recipe.name == name).first()
+@router.get("/get_recipe_metadata", response_model=RecipeMetadata, responses=NOT_MODIFIED)
+async def get_recipe_metadata(name: str, serving_size: int, request: Request, db: Session = Depends(get_db)):
+    recipe: Recipe = get_catalog().get_recipe_by_name(name)
     if recipe is None:
         raise HTTPException(status_code=404, detail="Unrecognized recipe: {}".format(name))
-    recipe_ingredients: List[RecipeIngredient] = db.query(RecipeIngredient).filter(
-        and_(RecipeIngredient.recipe_id == recipe.id, RecipeIngredient.serving_size == serving_size)).all()
-    if recipe_ingredients is None or len(recipe_ingredients) == 0:
+    document = get_recipe_document(METADATA, recipe, serving_size, db)
+    if document is None:
         raise HTTPException(status_code=400,
                             detail="Recipe does not come in this serving size: {} {}".format(name, serving_size))
-    recipe_in_your_kitchens: List[RecipeInYourKitchen] = db.query(RecipeInYourKitchen).filter(
-        RecipeInYourKitchen.recipe_id == recipe.id).all()
-    recipe_ingredients_ids = [x.ingredient_id for x in recipe_ingredients]
-    recipe_in_your_kitchens_ids = [x.in_your_kitchen_id for x in recipe_in_your_kitchens]
-    ingredients_to_units: Dict[int, str] = reduce(lambda d1, d2: {**d1, **d2},
-                                                  [{x.ingredient_id: x.unit} for x in recipe_ingredients], {})
-    ingredients_to_quantities: Dict[int, List[Quantity]] = \
-        reduce(lambda d1, d2: {**d1, **d2},
-               [{x.ingredient_id: [Quantity(amount=y.quantity,
-                                            serving_size=y.serving_size)
-                                   for y in recipe_ingredients if
-                                   y.ingredient_id == x.ingredient_id]}
-                for x in recipe_ingredients], {})
-    in_your_kitchen_to_ors_ids: Dict[int, List[int]] = \
-        reduce(lambda d1, d2: {**d1, **d2},
-               [{x.in_your_kitchen_id: x.or_ids} for x in
-                recipe_in_your_kitchens],
-               {})
-    ingredients: List[Ingredient] = db.query(Ingredient).filter(Ingredient.id.in_(recipe_ingredients_ids)).all()
-    in_your_kitchens: List[InYourKitchen] = db.query(InYourKitchen).filter(
-        InYourKitchen.id.in_(recipe_in_your_kitchens_ids)).all()
-
-    ingredients_metadata: List[api.recipes.Ingredient] = \
-        [api.recipes.Ingredient(name=ingredient.name, quantities=ingredients_to_quantities[ingredient.id],
-                                unit=ingredients_to_units[ingredient.id]) for ingredient in ingredients]
-
-    in_your_kitchens_metadata: List[api.recipes.InYourKitchen] = []
-    for in_your_kitchen in in_your_kitchens:
-        or_ids = in_your_kitchen_to_ors_ids[in_your_kitchen.id]
-        or_names: List[str] = []
-        if or_ids is not None and len(or_ids) > 0:
-            or_names: List[str] = [x.name for x in db.query(InYourKitchen).filter(
-                InYourKitchen.id.in_(in_your_kitchen_to_ors_ids[in_your_kitchen.id])).all()]
-        in_your_kitchens_metadata.append(
-            api.recipes.InYourKitchen(
-                name=in_your_kitchen.name,
-                or_=or_names
-            )
-        )
-
-    tags = recipe.tags if recipe.tags is not None else json.dumps([])
+    return document_response(document, request)
 
-    return RecipeMetadata(
-        recipe_id=recipe.id,
-        recipe_name=recipe.name,
-        ingredients=ingredients_metadata,
-        in_your_kitchens=in_your_kitchens_metadata,
-        prep_time=recipe.prep_time_minutes,
-        cook_time=recipe.cook_time_minutes,
-        image_url=recipe.image_url,
-        long_description=recipe.long_description,
-        tags=json.loads(tags)
-    )
 
-
-@router.get("/get_recipe_steps")
-async def get_recipe_steps(name: str, serving_size: int, db: Session = Depends(get_db)) -> List[api.recipes.RecipeStep]:
-    recipe: Recipe = db.query(Recipe).filter(Recipe.name == name).first()
+@router.get("/get_recipe_steps", response_model=List[api.recipes.RecipeStep], responses=NOT_MODIFIED)
+async def get_recipe_steps(name: str, serving_size: int, request: Request, db: Session = Depends(get_db)):
+    recipe: Recipe = get_catalog().get_recipe_by_name(name)
     if recipe is None:
         raise HTTPException(status_code=404, detail="Unrecognized recipe: {}".format(name))
-    recipe_steps: List[models.recipes.RecipeStep] = db.query(models.recipes.RecipeStep).filter(and_(
-        models.recipes.RecipeStep.recipe_id == recipe.id, models.recipes.RecipeStep.serving_size == serving_size)).all()
-
-    if recipe_steps is None or len(recipe_steps) == 0:
+    document = get_recipe_document(STEPS, recipe, serving_size, db)
+    if document is None:
         raise HTTPException(status_code=404, detail="No recipe for serving size.")
-
-    recipes: List[api.recipes.RecipeStep] = [api.recipes.RecipeStep(
-        step_number=x.step_number,
-        title=x.title,
-        instructions=json.loads(x.instructions),
-        tips=json.loads(x.tips),
-        chefs_hats=json.loads(x.chefs_hats),
-        ingredients=[x.name for x in db.query(Ingredient).filter(Ingredient.id.in_(json.loads(x.ingredients))).all()],
-        in_your_kitchen=[x.name for x in
-                         db.query(InYourKitchen).filter(InYourKitchen.id.in_(json.loads(x.in_your_kitchens))).all()],
-        gif_url=json.loads(x.gif_url)
-    ) for x in recipe_steps]
-
-    recipes.sort(key=lambda r: r.step_number)
-
-    return recipes
+    return document_response(document, request)
 
 
 @router.post("/star")
@@ -287,13 +227,13 @@ async def toggle_star_recipe(recipe_to_star: StarRecipe, db: Session = Depends(g
 
     db.commit()
 
-    emit_event(db, event_type, star_date, recipe_to_star.verification_code, None)
+    emit_event(event_type, star_date, recipe_to_star.verification_code, None)
 
     return
 
 
 @router.get("/stars")
-async def get_stars_for_user(id: str, db: Session = Depends(get_db)) -> JSONResponse:
+async def get_stars_for_user(id: str, db: Session = Depends(get_db)) -> FastJSONResponse:
     verified_user = db.query(VerifiedSignUp).filter(VerifiedSignUp.verification_code == id).first()
     if verified_user is None:
         raise HTTPException(status_code=401, detail="Unrecognized user.")
@@ -304,59 +244,35 @@ async def get_stars_for_user(id: str, db: Session = Depends(get_db)) -> JSONResp
     for starred_recipe in starred_recipes:
         recipe: Recipe = db.query(Recipe).filter(Recipe.id == starred_recipe.recipe_id).first()
         result.append(recipe.name)
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.get("/schedule")
-async def get_recipe_schedule(id: str, db: Session = Depends(get_db)) -> JSONResponse:
+async def get_recipe_schedule(id: str, db: Session = Depends(get_db)) -> FastJSONResponse:
     verified_user = db.query(VerifiedSignUp).filter(VerifiedSignUp.verification_code == id).first()
     if verified_user is None:
         raise HTTPException(status_code=401, detail="Unrecognized user.")
+    starred_recipe_ids: Set[int] = {x.recipe_id for x in db.query(StarredRecipe.recipe_id).filter(
+        StarredRecipe.verified_sign_up_id == verified_user.id).all()}
     result = {}
-    recipe_schedule: List[RecipeSchedule] = db.query(RecipeSchedule).order_by(
-        RecipeSchedule.schedule_start_date.asc()).all()
-    starred_recipe_ids: List[int] = [x.recipe_id for x in db.query(StarredRecipe).filter(
-        StarredRecipe.verified_sign_up_id == verified_user.id).all()]
-    for item in recipe_schedule:
-        recipe: Recipe = db.query(Recipe).filter(Recipe.id == item.recipe_id).first()
-        if recipe is None:
-            logger.error("Schedule has invalid recipe_id: {} {}".format(item.id, item.recipe_id))
-        else:
-            if item.schedule_start_date not in result:
-                result[item.schedule_start_date] = []
-            result[item.schedule_start_date].append({
-                "id": recipe.id,
-                "name": recipe.name,
-                "description": recipe.description,
-                "image_url": recipe.image_url,
-                "starred": True if recipe.id in starred_recipe_ids else False
-            })
-
-    return JSONResponse(content=jsonable_encoder(result))
+    for schedule_start_date, items in get_catalog().schedule.items():
+        result[schedule_start_date] = [{**x, "starred": x["id"] in starred_recipe_ids} for x in items]
+
+    return FastJSONResponse(content=result)
 
 
 @router.post("/event")
-async def emit_event(recipe_event: api.event.RecipeEvent, db: Session = Depends(get_db)):
-    try:
-        referrer = recipe_event.referrer if recipe_event.referrer is not None else "NONE"
-        code = recipe_event.verification_code if recipe_event.verification_code is not None else "NONE"
-        event = RecipeEvent(
-            event_type=recipe_event.event_type,
-            recipe_id=recipe_event.recipe_id,
-            serving_size=recipe_event.serving_size,
-            step_number=recipe_event.step_number,
-            event_timestamp=recipe_event.event_date,
-            code=code,
-            referrer=referrer
-        )
+async def record_recipe_event(recipe_event: api.event.RecipeEvent):
+    emit_recipe_event(recipe_event.event_type, recipe_event.recipe_id, recipe_event.serving_size,
+                      recipe_event.step_number, recipe_event.event_date, recipe_event.verification_code,
+                      recipe_event.referrer)
+    return
+
 
-        db.add(event)
-        db.commit()
-        return
-    except Exception as e:
-        logger.error("Failed to save event.")
-        logger.error(e)
-        return
+@router.post("/event/batch")
+async def record_recipe_event_batch(request: Request):
+    result = submit_event_batch(await request.body(), request.headers.get("content-encoding"), True)
+    return FastJSONResponse(content=result)
 
 
 def get_ingredients_to_update(recipe_id: int, unique_ingredient_ids: Set[int], db: Session) -> List[RecipeIngredient]:
@@ -1,16 +1,15 @@
-import json
 import logging
 from functools import reduce
 from typing import List, Any, Dict, Optional
 
 from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
 from sqlalchemy import and_
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 from config import Settings
+from dependencies.catalog import get_catalog, Catalog
 from dependencies.database import get_db
+from dependencies.responses import FastJSONResponse
 from models.customers import Customer
 from models.invitations import Invitation, InvitationStatusEnum
 from models.orders import PromoCode, Order, Cart
@@ -39,7 +38,7 @@ async def get_all_rewards(verification_code: str, db: Session = Depends(get_db))
         orders: List[Order] = []
         if customer is not None:
             orders = db.query(Order).filter(Order.customer == customer.id).all()
-        order_breakdown = [(x.user_facing_order_id, json.loads(x.order_breakdown_dollars)) for x in orders]
+        order_breakdown = [(x.user_facing_order_id, x.order_breakdown_dollars) for x in orders]
         order_to_promo: Dict[str, str] = reduce(lambda d1, d2: {**d1, **d2},
                                                 [{x[1]["promo_codes"][0]["name"]: x[0]} for x in order_breakdown if
                                                  len(x[1]["promo_codes"]) == 1], {})
@@ -72,7 +71,7 @@ async def get_all_rewards(verification_code: str, db: Session = Depends(get_db))
         })
 
     result.reverse()
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/site_wide_promos")
@@ -87,16 +86,16 @@ async def get_site_wide_promos(verification_code: str, applied_promo_code_names:
     promo_codes: List[PromoCode] = all_site_wide_promos(verification_code, applied_promo_codes, db)
     result = [{"name": x.promo_code_name, "amount_off": x.amount_off, "percent_off": x.percent_off} for x in
               promo_codes]
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 def all_site_wide_promos(verification_code: str, applied_promo_codes: List[PromoCode], db: Session) -> List[PromoCode]:
+    catalog: Catalog = get_catalog()
     cart: List[Cart] = db.query(Cart).filter(Cart.verification_code == verification_code).all()
 
     subtotal: float = 0
     for item in cart:
-        recipe_price: RecipePrice = db.query(RecipePrice).filter(
-            and_(RecipePrice.recipe_id == item.recipe_id, RecipePrice.serving_size == item.serving_size)).first()
+        recipe_price: RecipePrice = catalog.get_price(item.recipe_id, item.serving_size)
         if recipe_price is None:
             raise HTTPException(status_code=404, detail="Unknown item in cart")
         subtotal = subtotal + recipe_price.price
@@ -1,23 +1,24 @@
 import logging
 import sqlite3
 from datetime import datetime
-from smtplib import SMTP
 from typing import Optional, List
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.encoders import jsonable_encoder
-from jinja2 import Environment, FileSystemLoader, select_autoescape
-from sqlalchemy import and_
+from fastapi import APIRouter, Depends, HTTPException, Request
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from starlette.responses import JSONResponse
 
 from api.event import SiteEvent
 from api.signup import SignUpViaEmail, AddDeliverableZipcodes
 from config import Settings
-from dependencies.database import get_db
+from dependencies.customers import invalidate_principal
+from dependencies.database import get_db, get_async_db
+from dependencies.event_batches import submit_event_batch
 from dependencies.events import emit_event
+from dependencies.responses import FastJSONResponse
 from dependencies.signup import generate_verification_code
-from emails.base import send_email
+from emails.base import send_email, create_template_env
+from emails.delivery import EmailDeliveryService
 from emails.verifysignup import VerifySignUpEmail
 from models.customers import Customer
 from models.invitations import Invitation
@@ -25,8 +26,15 @@ from models.signups import VerifiedSignUp, UnverifiedSignUp, DeliverableZipcode
 
 logger = logging.getLogger("rasoibox")
 settings: Settings = Settings()
-smtp_server: SMTP = SMTP('smtp.gmail.com', 587)
-jinjaEnv = Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape())
+email_service: EmailDeliveryService = EmailDeliveryService(settings.smtp_host, settings.smtp_port,
+                                                          settings.email if settings.smtp_login else None,
+                                                          settings.email_app_password,
+                                                          starttls=settings.smtp_starttls,
+                                                          pool_size=settings.smtp_pool_size,
+                                                          queue_size=settings.smtp_queue_size,
+                                                          max_attempts=settings.smtp_max_attempts)
+jinjaEnv = create_template_env("templates", auto_reload=settings.templates_auto_reload,
+                               bytecode_cache_dir=settings.templates_bytecode_cache_dir)
 
 router = APIRouter(
     prefix="/api",
@@ -45,18 +53,25 @@ def send_verify_email(email: str, verification_code: str):
 
     # send email best effort
     try:
-        send_email(jinjaEnv, verification_email, smtp_server, settings.email, settings.email_app_password)
+        send_email(jinjaEnv, verification_email, email_service)
     except Exception as e:
         logger.error("Failed to send email.")
         logger.error(e)
 
 
 @router.post("/event")
-async def event(site_event: SiteEvent, db: Session = Depends(get_db)):
-    emit_event(db, site_event.event_type, site_event.event_date, site_event.verification_code, site_event.referrer)
+async def event(site_event: SiteEvent):
+    emit_event(site_event.event_type, site_event.event_date, site_event.verification_code, site_event.referrer)
     return
 
 
+@router.post("/event/batch")
+async def event_batch(request: Request):
+    # a list of site and recipe events, optionally gzip compressed; recipe events are the ones with a recipe_id
+    result = submit_event_batch(await request.body(), request.headers.get("content-encoding"), False)
+    return FastJSONResponse(content=result)
+
+
 @router.post("/signup/email")
 async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depends(get_db)):
     try:
@@ -67,11 +82,11 @@ async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depe
         if verified_sign_up is not None:
             logger.info("User already verified.")
 
-            return JSONResponse(content=jsonable_encoder({
+            return FastJSONResponse(content={
                 "status": 0,
                 "message": "User already verified.",
                 "verification_code": verified_sign_up.verification_code
-            }))
+            })
 
         # if email and verification code is same as an existing invitation code and email,
         # this should already be considered verified
@@ -81,7 +96,7 @@ async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depe
         if invitation is not None:
             logger.info("User has been invited. Marking as verified.")
 
-            emit_event(db, "INVITATION_SIGN_UP", sign_up_via_email.signup_date, sign_up_via_email.verification_code,
+            emit_event("INVITATION_SIGN_UP", sign_up_via_email.signup_date, sign_up_via_email.verification_code,
                        sign_up_via_email.referrer)
 
             db.add(
@@ -97,11 +112,11 @@ async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depe
 
             db.commit()
 
-            return JSONResponse(content=jsonable_encoder({
+            return FastJSONResponse(content={
                 "status": 3,
                 "message": "User has been invited. Marking as verified.",
                 "verification_code": sign_up_via_email.verification_code
-            }))
+            })
 
         unverified_sign_up: Optional[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(
             UnverifiedSignUp.email == sign_up_via_email.email).first()
@@ -127,7 +142,7 @@ async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depe
                 verification_code = sign_up_via_email.verification_code
             status_code = 2
             message = "Verification email sent"
-            emit_event(db, "NEW_SIGN_UP", sign_up_via_email.signup_date, sign_up_via_email.verification_code,
+            emit_event("NEW_SIGN_UP", sign_up_via_email.signup_date, sign_up_via_email.verification_code,
                        sign_up_via_email.referrer)
 
             # insert entry in db
@@ -145,14 +160,15 @@ async def signup_via_email(sign_up_via_email: SignUpViaEmail, db: Session = Depe
 
         send_verify_email(sign_up_via_email.email, verification_code)
 
-        return JSONResponse(content={"status": status_code, "message": message, "verification_code": verification_code})
+        return FastJSONResponse(content={"status": status_code, "message": message,
+                                         "verification_code": verification_code})
     except sqlite3.OperationalError as e:
         logger.error(e)
         raise HTTPException(status_code=500, detail="Failed to save data.")
 
 
 @router.get("/verify/email")
-async def verify_email(id: str, db: Session = Depends(get_db)) -> JSONResponse:
+async def verify_email(id: str, db: Session = Depends(get_db)) -> FastJSONResponse:
     unverified_sign_up: Optional[UnverifiedSignUp] = db.query(UnverifiedSignUp).filter(
         UnverifiedSignUp.verification_code == id).first()
 
@@ -172,23 +188,24 @@ async def verify_email(id: str, db: Session = Depends(get_db)) -> JSONResponse:
         customer: Customer = db.query(Customer).filter(Customer.email == unverified_sign_up.email).first()
         if customer is not None:
             db.query(Customer).filter(Customer.email == unverified_sign_up.email).update({'verified': True})
+            invalidate_principal(customer.id)
 
         db.delete(unverified_sign_up)
         db.commit()
-        emit_event(db, "VERIFY", verify_date, unverified_sign_up.verification_code, None)
+        emit_event("VERIFY", verify_date, unverified_sign_up.verification_code, None)
 
     verified_sign_up: Optional[VerifiedSignUp] = db.query(VerifiedSignUp).filter(
         VerifiedSignUp.verification_code == id).first()
     if verified_sign_up is not None:
-        return JSONResponse(content=jsonable_encoder({}))
+        return FastJSONResponse(content={})
     else:
         raise HTTPException(status_code=404, detail="Invalid verification code.")
 
 
 @router.get("/verified")
-async def is_verified_sign_up(id: str, db: Session = Depends(get_db)) -> JSONResponse:
-    verified_sign_up: Optional[VerifiedSignUp] = db.query(VerifiedSignUp).filter(
-        VerifiedSignUp.verification_code == id).first()
+async def is_verified_sign_up(id: str, db: AsyncSession = Depends(get_async_db)) -> FastJSONResponse:
+    verified_sign_up: Optional[VerifiedSignUp] = (await db.execute(select(VerifiedSignUp).where(
+        VerifiedSignUp.verification_code == id))).scalars().first()
 
     verified: bool = True if verified_sign_up is not None else False
     response = {"verified": verified}
@@ -196,28 +213,32 @@ async def is_verified_sign_up(id: str, db: Session = Depends(get_db)) -> JSONRes
         response["email"] = verified_sign_up.email
         response["zipcode"] = verified_sign_up.zipcode
     else:
-        invitation = db.query(Invitation).filter(Invitation.referred_verification_code == id).first()
+        invitation = (await db.execute(select(Invitation).where(
+            Invitation.referred_verification_code == id))).scalars().first()
         if invitation is not None:
             response["email"] = invitation.email
 
-    return JSONResponse(content=jsonable_encoder(response))
+    return FastJSONResponse(content=response)
 
 
 @router.get("/in_deliverable_zipcode")
-async def in_deliverable_zipcode(id: str, db: Session = Depends(get_db)):
-    verified_sign_up = db.query(VerifiedSignUp).filter(VerifiedSignUp.verification_code == id).first()
+async def in_deliverable_zipcode(id: str, db: AsyncSession = Depends(get_async_db)):
+    verified_sign_up = (await db.execute(select(VerifiedSignUp).where(
+        VerifiedSignUp.verification_code == id))).scalars().first()
 
     zipcode = None
     if verified_sign_up is not None:
         zipcode = verified_sign_up.zipcode
     else:
-        unverified_sign_up = db.query(UnverifiedSignUp).filter(UnverifiedSignUp.verification_code == id).first()
+        unverified_sign_up = (await db.execute(select(UnverifiedSignUp).where(
+            UnverifiedSignUp.verification_code == id))).scalars().first()
         if unverified_sign_up is not None:
             zipcode = unverified_sign_up.zipcode
 
     result = {}
     if zipcode is not None:
-        deliverable_zipcode = db.query(DeliverableZipcode).filter(DeliverableZipcode.zipcode == zipcode).first()
+        deliverable_zipcode = (await db.execute(select(DeliverableZipcode).where(
+            DeliverableZipcode.zipcode == zipcode))).scalars().first()
         if deliverable_zipcode is not None:
             result["status"] = 0
             result["delivery_start_date"] = deliverable_zipcode.delivery_start_date
@@ -227,7 +248,7 @@ async def in_deliverable_zipcode(id: str, db: Session = Depends(get_db)):
     else:
         result["status"] = -2
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.get("/is_deliverable_zipcode")
@@ -239,10 +260,10 @@ async def is_deliverable_zipcode(zipcode: str, db: Session = Depends(get_db)):
         result["delivery_start_date"] = deliverable_zipcode.delivery_start_date
         result["zipcode"] = deliverable_zipcode.zipcode
     else:
-        emit_event(db, "OUTSIDE_DELIVERY", datetime.now(), None, zipcode)
+        emit_event("OUTSIDE_DELIVERY", datetime.now(), None, zipcode)
         result["status"] = -1
 
-    return JSONResponse(content=jsonable_encoder(result))
+    return FastJSONResponse(content=result)
 
 
 @router.post("/add_deliverable_zipcodes")
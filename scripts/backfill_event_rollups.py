@@ -0,0 +1,32 @@
+import argparse
+import logging
+
+from dependencies.database import SessionLocal
+from dependencies.rollups import ROLLUPS, reset_rollup, rollup_source
+
+# Counts existing events and recipe events into the hourly rollups and moves the watermarks past them, so the server
+# only has new events left to add. Picks up where the watermark is, so it is safe to run again; --rebuild clears the
+# rollups and counts everything from the start. Run from the repo root after migrating:
+#   python -m scripts.backfill_event_rollups
+# Stop the servers while rebuilding or they keep adding to the rollups being cleared.
+
+
+def main(names, batch_size: int, rebuild: bool):
+    db = SessionLocal()
+    try:
+        for name in names:
+            if rebuild:
+                reset_rollup(name, db)
+            print("{}: counted {} ids.".format(name, rollup_source(name, db, batch_size, settle=False)))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", choices=list(ROLLUPS.keys()), action="append")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    parser.add_argument("--rebuild", action="store_true")
+    args = parser.parse_args()
+    main(args.source if args.source is not None else list(ROLLUPS.keys()), args.batch_size, args.rebuild)
@@ -0,0 +1,24 @@
+import argparse
+import logging
+
+from dependencies.database import SessionLocal
+from dependencies.order_items import backfill_order_items
+
+# Fills order_items for orders placed before the table existed. Orders that already have items are skipped, so it is
+# safe to run again. Run from the repo root after migrating: python -m scripts.backfill_order_items
+
+
+def main(batch_size: int):
+    db = SessionLocal()
+    try:
+        print("Backfilled {} orders.".format(backfill_order_items(db, batch_size)))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    main(args.batch_size)
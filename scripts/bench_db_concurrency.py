@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from dependencies.database import SessionLocal, get_async_engine, get_async_db
+
+# Compares request throughput when queries block the event loop (sync sessions called from async handlers, which
+# is what the routers do today) against the async engine. Run from the repo root against a dev database:
+#   python -m scripts.bench_db_concurrency --requests 200 --concurrency 50 --query-seconds 0.02
+
+QUERY = "select sleep(:seconds)"
+
+
+async def sync_request(seconds: float):
+    db = SessionLocal()
+    try:
+        db.execute(text(QUERY), {"seconds": seconds}).all()
+    finally:
+        db.close()
+
+
+async def async_request(seconds: float):
+    async for db in get_async_db():
+        (await db.execute(text(QUERY), {"seconds": seconds})).all()
+
+
+async def run(request, total: int, concurrency: int, seconds: float) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await request(seconds)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(total)])
+    return time.perf_counter() - start
+
+
+async def main(total: int, concurrency: int, seconds: float):
+    # warm both pools so connection setup is not measured
+    await run(sync_request, concurrency, concurrency, 0)
+    await run(async_request, concurrency, concurrency, 0)
+
+    for name, request in [("sync session on event loop", sync_request), ("async engine", async_request)]:
+        elapsed = await run(request, total, concurrency, seconds)
+        print("{:<28} {:>6} requests in {:>7.2f}s  {:>8.1f} req/s".format(name, total, elapsed, total / elapsed))
+
+    await get_async_engine().dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--query-seconds", type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.query_seconds))
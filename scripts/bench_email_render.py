@@ -0,0 +1,64 @@
+import argparse
+import time
+from typing import List
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from emails.base import RasoiBoxEmail, build_message, create_template_env, precompile_templates
+from emails.order_delivered import OrderDeliveredEmail
+from emails.order_enroute import OrderEnRouteEmail
+from emails.receipt import ReceiptEmail
+
+# Measures how many messages per second build_message produces for the receipt and order status emails, with the
+# environment the app used to build (auto reload on, compiled on first use) against the precompiled one. Run from the
+# repo root: python -m scripts.bench_email_render --messages 5000
+
+LINE_ITEMS = [
+    {"name": "Aloo Gobi", "serving_size": 2, "price": "24.00"},
+    {"name": "Chana Masala", "serving_size": 4, "price": "42.00"},
+]
+ADDRESS = {"street_name": "1 Market St", "apartment_number": "4", "city": "San Francisco", "state": "CA",
+           "zipcode": "94105"}
+
+
+def sample_emails() -> List[RasoiBoxEmail]:
+    return [
+        ReceiptEmail(url_base="https://www.rasoibox.com", first_name="Asha", line_items=LINE_ITEMS,
+                     promo_codes=[{"name": "WELCOME15", "amount_off": None, "percent_off": 15.0}], total=56.10,
+                     sub_total=66.00, shipping_fee="FREE", shipping_address=ADDRESS, order_id="12345678",
+                     estimated_delivery="Friday, June 2", to_email="asha@example.com", from_email="hi@rasoibox.com"),
+        OrderEnRouteEmail(url_base="https://www.rasoibox.com", first_name="Asha", estimated_delivery="Friday, June 2",
+                          line_items=LINE_ITEMS, shipping_address=ADDRESS, order_id="12345678",
+                          to_email="asha@example.com", from_email="hi@rasoibox.com"),
+        OrderDeliveredEmail(url_base="https://www.rasoibox.com", first_name="Asha", line_items=LINE_ITEMS,
+                            shipping_address=ADDRESS, order_id="12345678", to_email="asha@example.com",
+                            from_email="hi@rasoibox.com"),
+    ]
+
+
+def run(jinja_env: Environment, email: RasoiBoxEmail, total: int) -> float:
+    start = time.perf_counter()
+    for _ in range(total):
+        build_message(jinja_env, email).as_string()
+    return time.perf_counter() - start
+
+
+def main(total: int):
+    environments = [
+        ("auto reload", Environment(loader=FileSystemLoader("templates"), autoescape=select_autoescape())),
+        ("precompiled", create_template_env("templates")),
+    ]
+    precompile_templates(environments[1][1])
+
+    for email in sample_emails():
+        for name, jinja_env in environments:
+            elapsed = run(jinja_env, email, total)
+            print("{:<20} {:<12} {:>6} messages in {:>6.2f}s  {:>8.1f} msg/s".format(
+                email.template, name, total, elapsed, total / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    args = parser.parse_args()
+    main(args.messages)
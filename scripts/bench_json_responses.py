@@ -0,0 +1,81 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from dependencies.responses import FastJSONResponse
+
+# Compares rendering the order history and available items payloads with jsonable_encoder + JSONResponse against
+# FastJSONResponse. Run from the repo root: python -m scripts.bench_json_responses --iterations 2000 --orders 50
+
+
+def order_payloads(total: int) -> List[Dict[str, Any]]:
+    now = datetime.now()
+    return [{
+        "order_number": "{:08d}".format(i),
+        "order_breakdown": {
+            "items": {"Aloo Gobi": 24.0, "Chana Masala": 42.0},
+            "promo_codes": [{"name": "WELCOME15", "amount_off": None, "percent_off": 15.0}],
+            "shipping_fee": 0
+        },
+        "order_date": now - timedelta(days=i),
+        "order_recipient_name": "Asha Rao",
+        "order_delivery_address": {"street_name": "1 Market St", "apartment_number": "4", "city": "San Francisco",
+                                   "state": "CA", "zipcode": "94105"},
+        "order_total_dollars": 56.10,
+        "order_delivered": i % 2 == 0,
+        "order_create_id": i,
+        "estimated_delivery_date": "Friday, June 2",
+        "recipes": {
+            "Aloo Gobi": {"id": 1, "image_url": "https://rasoibox.com/aloo.jpg", "serving_size": 2, "price": 24.0},
+            "Chana Masala": {"id": 2, "image_url": "https://rasoibox.com/chana.jpg", "serving_size": 4, "price": 42.0}
+        },
+        "order_delivery_date": now - timedelta(days=i - 3)
+    } for i in range(total)]
+
+
+def available_items_payload(total: int) -> Dict[int, Dict[str, Any]]:
+    return {i: {
+        "recipe_name": "Recipe {}".format(i),
+        "description": "A weeknight curry with warm spices." * 3,
+        "long_description": "Slow cooked with onions, tomatoes and a fresh masala. " * 10,
+        "image_url": "https://rasoibox.com/{}.jpg".format(i),
+        "serving_sizes": [2, 4],
+        "prices": [24.0, 42.0],
+        "cook_time": 30,
+        "prep_time": 15,
+        "tags": ["vegetarian", "gluten free"],
+        "created_by": "Rasoi Box"
+    } for i in range(total)}
+
+
+def run(render, content: Any, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        render(content)
+    return time.perf_counter() - start
+
+
+def main(iterations: int, orders: int, recipes: int):
+    payloads = [("order history", order_payloads(orders)), ("available items", available_items_payload(recipes))]
+    renderers = [
+        ("jsonable_encoder", lambda x: JSONResponse(content=jsonable_encoder(x)).body),
+        ("FastJSONResponse", lambda x: FastJSONResponse(content=x).body),
+    ]
+    for payload_name, content in payloads:
+        for renderer_name, render in renderers:
+            elapsed = run(render, content, iterations)
+            print("{:<16} {:<18} {:>6} renders in {:>6.2f}s  {:>8.1f} renders/s".format(
+                payload_name, renderer_name, iterations, elapsed, iterations / elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=50)
+    parser.add_argument("--recipes", type=int, default=40)
+    args = parser.parse_args()
+    main(args.iterations, args.orders, args.recipes)
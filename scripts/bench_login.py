@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+import time
+from typing import List, Tuple
+
+from fastapi import HTTPException
+
+from dependencies.customers import pwd_context, verify_password, settings
+
+# Measures login password checks under concurrent load the way the server runs them, on one event loop: hashing inline
+# on the loop as the handlers used to, against the bounded hashing pool. Alongside throughput it reports how late a
+# 5ms ticker on the same loop fired, which is how long every other request in the worker was stalled. Logins turned
+# away by a full pool are counted separately. Run from the repo root:
+#   python -m scripts.bench_login --logins 200 --concurrency 50
+# BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS and PASSWORD_HASH_QUEUE_SIZE from .env apply.
+
+PASSWORD = "correct horse battery staple"
+TICK_SECONDS = 0.005
+
+
+async def ticker(lags: List[float], stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - started - TICK_SECONDS)
+
+
+async def login_inline(hashed: str) -> bool:
+    return pwd_context.verify(PASSWORD, hashed)
+
+
+async def login_pool(hashed: str) -> bool:
+    return await verify_password(PASSWORD, hashed)
+
+
+async def run(mode: str, hashed: str, logins: int, concurrency: int) -> Tuple[float, int, List[float]]:
+    login = login_inline if mode == "inline" else login_pool
+    semaphore = asyncio.Semaphore(concurrency)
+    rejected: List[int] = []
+
+    async def one():
+        async with semaphore:
+            try:
+                await login(hashed)
+            except HTTPException:
+                rejected.append(1)
+
+    lags: List[float] = []
+    stop = asyncio.Event()
+    ticks = asyncio.create_task(ticker(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(logins)])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await ticks
+    return elapsed, len(rejected), lags
+
+
+def main(logins: int, concurrency: int):
+    hashed: str = pwd_context.hash(PASSWORD)
+    print("bcrypt rounds {}, {} workers, queue {}".format(settings.bcrypt_rounds, settings.password_hash_workers,
+                                                          settings.password_hash_queue_size))
+    for mode in ["inline", "pool"]:
+        elapsed, rejected, lags = asyncio.run(run(mode, hashed, logins, concurrency))
+        lags.sort()
+        p99 = lags[int(len(lags) * 0.99)] if len(lags) > 0 else 0.0
+        print("{:>6}: {:7.1f} logins/s, {} rejected, loop lag p99 {:6.1f}ms max {:6.1f}ms".format(
+            mode, (logins - rejected) / elapsed, rejected, p99 * 1000, (lags[-1] if len(lags) > 0 else 0.0) * 1000))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    main(args.logins, args.concurrency)
@@ -0,0 +1,31 @@
+import sys
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from dependencies.order_utils import get_pretty_estimated_delivery_date
+from dependencies.prep_report import MAX_DAYS_TO_DELIVERY, estimated_delivery_dates
+
+# Checks that the prep report's vectorized delivery dates agree with the ones customers are emailed, for an order placed
+# on each day of the week, and that its lookback covers the longest of them. Exits non-zero on any mismatch. Run from
+# the repo root: python -m scripts.check_delivery_dates
+
+
+def main() -> int:
+    # mon 2023-06-05 through sun 2023-06-11, late in the day so the time of day has to be dropped
+    order_dates = [datetime(2023, 6, 5, 21, 30) + timedelta(days=x) for x in range(7)]
+    vectorized = estimated_delivery_dates(pd.Series(pd.to_datetime(order_dates)))
+    failures = 0
+    for order_date, delivery in zip(order_dates, vectorized):
+        expected = get_pretty_estimated_delivery_date(order_date)
+        actual = delivery.strftime("%a, %b %d, %Y")
+        days = (delivery.date() - order_date.date()).days
+        ok = actual == expected and days <= MAX_DAYS_TO_DELIVERY
+        failures = failures + (0 if ok else 1)
+        print("{} {}: expected {}, got {} ({} days)".format(
+            "ok  " if ok else "FAIL", order_date.strftime("%a %Y-%m-%d"), expected, actual, days))
+    return 1 if failures > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
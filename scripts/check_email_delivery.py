@@ -0,0 +1,102 @@
+import sys
+import time
+from collections import defaultdict
+from email.message import EmailMessage
+from typing import Dict, List
+
+from aiosmtpd.controller import Controller
+
+from emails.delivery import EmailDeliveryService
+
+# Runs EmailDeliveryService against a local aiosmtpd server that answers each recipient the way a real one might:
+# accept, defer once with a 4xx, or reject with a 5xx, at RCPT or at DATA. Checks that deferred emails are retried and
+# delivered, rejected ones are not retried, and a connection the server dropped is reopened. Exits non-zero if any check
+# fails. Needs aiosmtpd (pip install aiosmtpd); from the repo root: python -m scripts.check_email_delivery
+
+HOST = "localhost"
+PORT = 8025
+
+
+class ScriptedHandler():
+    def __init__(self):
+        self.rcpt_attempts: Dict[str, int] = defaultdict(int)
+        self.data_attempts: Dict[str, int] = defaultdict(int)
+        self.delivered: List[str] = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        self.rcpt_attempts[address] = self.rcpt_attempts[address] + 1
+        if address.startswith("rcpt-deferred") and self.rcpt_attempts[address] == 1:
+            return "451 4.2.1 Mailbox busy, try again later"
+        if address.startswith("rcpt-rejected"):
+            return "550 5.1.1 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        address = envelope.rcpt_tos[0]
+        self.data_attempts[address] = self.data_attempts[address] + 1
+        if address.startswith("data-deferred") and self.data_attempts[address] == 1:
+            return "451 4.3.0 Try again later"
+        if address.startswith("data-rejected"):
+            return "554 5.7.1 Message rejected"
+        self.delivered.append(address)
+        return "250 Message accepted"
+
+
+def message(to: str) -> EmailMessage:
+    email = EmailMessage()
+    email["From"] = "check@rasoibox.local"
+    email["To"] = to
+    email["Subject"] = "Delivery check"
+    email.set_content("Delivery check")
+    return email
+
+
+def main() -> int:
+    handler = ScriptedHandler()
+    controller = Controller(handler, hostname=HOST, port=PORT)
+    controller.start()
+    service = EmailDeliveryService(HOST, PORT, None, None, starttls=False, max_attempts=3, backoff_seconds=0.01)
+    connection = service.new_connection()
+    results: List[bool] = []
+
+    def check(name: str, ok: bool, detail: str):
+        print("{} {}: {}".format("ok  " if ok else "FAIL", name, detail))
+        results.append(ok)
+
+    try:
+        for address, expect_delivered, expect_attempts in [
+            ("accepted@rasoibox.local", True, 1),
+            ("rcpt-deferred@rasoibox.local", True, 2),
+            ("data-deferred@rasoibox.local", True, 2),
+            ("rcpt-rejected@rasoibox.local", False, 1),
+            ("data-rejected@rasoibox.local", False, 1),
+        ]:
+            delivered = service.deliver(connection, message(address))
+            attempts = handler.rcpt_attempts[address]
+            check(address, delivered == expect_delivered and attempts == expect_attempts,
+                  "delivered {}, {} attempts".format(delivered, attempts))
+
+        # the server goes away between emails, as idle connections get dropped
+        controller.stop()
+        time.sleep(0.1)
+        controller = Controller(handler, hostname=HOST, port=PORT)
+        controller.start()
+        address = "after-restart@rasoibox.local"
+        delivered = service.deliver(connection, message(address))
+        check("reconnect", delivered and address in handler.delivered, "delivered {}".format(delivered))
+
+        # and the queued path, through the worker pool
+        service.start()
+        address = "queued@rasoibox.local"
+        service.enqueue(message(address))
+        service.stop()
+        check("queued", address in handler.delivered, "delivered {}".format(address in handler.delivered))
+    finally:
+        connection.close()
+        controller.stop()
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
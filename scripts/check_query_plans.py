@@ -0,0 +1,73 @@
+import sys
+from typing import List, Tuple
+
+from sqlalchemy import select, and_, text
+from sqlalchemy.sql import Select
+
+from dependencies.database import get_engine
+from models.cooking import CookingHistory
+from models.customers import Customer
+from models.invitations import Invitation
+from models.orders import Order, OrderItem, Cart, PromoCode, PaymentStatusEnum
+from models.recipes import Recipe, RecipePrice, RecipeIngredient, RecipeStep, RecipeInYourKitchen, StarredRecipe
+from models.reset_passwords import ResetPassword
+from models.signups import VerifiedSignUp, UnverifiedSignUp, DeliverableZipcode
+
+# Runs EXPLAIN on the lookups the routers make on every request and exits non-zero if mysql has no index it could use
+# for any of them. Run from the repo root after migrating: python -m scripts.check_query_plans
+
+QUERIES: List[Tuple[str, Select]] = [
+    ("verified sign up by email", select(VerifiedSignUp).where(VerifiedSignUp.email == "a@b.com")),
+    ("verified sign up by code", select(VerifiedSignUp).where(VerifiedSignUp.verification_code == "abc")),
+    ("unverified sign up by email", select(UnverifiedSignUp).where(UnverifiedSignUp.email == "a@b.com")),
+    ("unverified sign up by code", select(UnverifiedSignUp).where(UnverifiedSignUp.verification_code == "abc")),
+    ("deliverable zipcode", select(DeliverableZipcode).where(DeliverableZipcode.zipcode == "94110")),
+    ("customer by email", select(Customer).where(Customer.email == "a@b.com")),
+    ("reset password by code", select(ResetPassword).where(ResetPassword.reset_code == "abc")),
+    ("invitation by email", select(Invitation).where(Invitation.email == "a@b.com")),
+    ("invitation by referred code", select(Invitation).where(Invitation.referred_verification_code == "abc")),
+    ("invitation by referrer code", select(Invitation).where(Invitation.referrer_verification_code == "abc")),
+    ("order by user facing id", select(Order).where(Order.user_facing_order_id == "12345678")),
+    ("order by payment intent", select(Order).where(Order.payment_intent == "pi_123")),
+    ("order history", select(Order).where(
+        and_(Order.customer == 1, Order.payment_status == PaymentStatusEnum.COMPLETED))),
+    ("order intent by code", select(Order).where(
+        and_(Order.verification_code == "abc", Order.payment_status == PaymentStatusEnum.INITIATED))),
+    ("order items by order", select(OrderItem).where(OrderItem.order_id == 1)),
+    ("order items by recipe and date", select(OrderItem).where(
+        and_(OrderItem.recipe_id == 1, OrderItem.order_date >= "2023-06-01"))),
+    ("cart by code", select(Cart).where(Cart.verification_code == "abc")),
+    ("promo code by name", select(PromoCode).where(PromoCode.promo_code_name.in_(["WELCOME15"]))),
+    ("promo code by owner", select(PromoCode).where(PromoCode.redeemable_by_verification_code == "abc")),
+    ("recipe by name", select(Recipe).where(Recipe.name == "Aloo Gobi")),
+    ("recipe price", select(RecipePrice).where(
+        and_(RecipePrice.recipe_id == 1, RecipePrice.serving_size == 2))),
+    ("recipe ingredients", select(RecipeIngredient).where(
+        and_(RecipeIngredient.recipe_id == 1, RecipeIngredient.serving_size == 2))),
+    ("recipe in your kitchen", select(RecipeInYourKitchen).where(RecipeInYourKitchen.recipe_id == 1)),
+    ("recipe steps", select(RecipeStep).where(
+        and_(RecipeStep.recipe_id == 1, RecipeStep.serving_size == 2))),
+    ("starred recipes", select(StarredRecipe).where(StarredRecipe.verified_sign_up_id == 1)),
+    ("cooking history", select(CookingHistory).where(CookingHistory.order_id == "12345678")),
+]
+
+
+def main() -> int:
+    engine = get_engine()
+    failures: List[str] = []
+    with engine.connect() as connection:
+        for name, query in QUERIES:
+            sql = str(query.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            for row in connection.execute(text("explain " + sql)).mappings().all():
+                # tiny tables may still be scanned by choice; a scan with no candidate index is what we guard against
+                if row["type"] == "ALL" and row["possible_keys"] is None:
+                    failures.append("{}: full scan of {}".format(name, row["table"]))
+
+    for failure in failures:
+        print(failure)
+    print("{} of {} queries have no usable index.".format(len(failures), len(QUERIES)))
+    return 1 if len(failures) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import sys
+import time
+from typing import Any, Callable, List, Tuple
+
+import stripe
+
+from dependencies.database import SessionLocal
+from dependencies.stripe_cache import stripe_cache, handle_stripe_object_event, bump_stripe_cache_version, \
+    load_stripe_cache_version
+from dependencies.stripe_utils import get_stripe_product_from_id, create_promo_code_from_coupon, find_promo_code_id
+
+# Exercises the stripe object cache against stripe-mock (https://github.com/stripe/stripe-mock), counting the requests
+# that reach it: lookups read through once, created objects are written through, webhook events update or drop what is
+# cached, and a bumped shared version makes a process drop its copies. Exits non-zero if any check fails. Start
+# stripe-mock, migrate the database, then from the repo root:
+#   STRIPE_API_BASE=http://localhost:12111 STRIPE_SECRET_KEY=sk_test_123 python -m scripts.check_stripe_cache
+
+requests: List[Tuple[str, str]] = []
+
+
+def count_requests():
+    base = stripe.http_client.new_default_http_client()
+
+    class CountingClient(type(base)):
+        def request_with_retries(self, method, url, headers, post_data=None):
+            requests.append((method, url))
+            return super().request_with_retries(method, url, headers, post_data)
+
+    stripe.default_http_client = CountingClient()
+
+
+def expect(name: str, expected_requests: int, call: Callable[[], Any], check: Callable[[Any], bool] = lambda x: True) \
+        -> Tuple[bool, Any]:
+    before = len(requests)
+    result = call()
+    made = len(requests) - before
+    ok = made == expected_requests and check(result)
+    print("{} {}: {} requests, expected {}".format("ok  " if ok else "FAIL", name, made, expected_requests))
+    return ok, result
+
+
+def event(event_type: str, obj: Any) -> dict:
+    return {"id": "evt_check", "type": event_type, "created": int(time.time()) + 1, "data": {"object": obj}}
+
+
+def main() -> int:
+    if stripe.api_base.startswith("https://api.stripe.com"):
+        print("Set STRIPE_API_BASE to a stripe-mock server, this sends requests.")
+        return 2
+    count_requests()
+    db = SessionLocal()
+    results: List[bool] = []
+    load_version = stripe_cache.load_version
+    try:
+        # this process on its own first
+        stripe_cache.load_version = None
+        stripe_cache.clear()
+        ok, product = expect("product reads through", 1, lambda: get_stripe_product_from_id("prod_check"))
+        results.append(ok)
+        results.append(expect("product read again is cached", 0, lambda: get_stripe_product_from_id(product["id"]),
+                              lambda x: x["id"] == product["id"])[0])
+
+        ok, promotion_code = expect("promotion code create", 1, lambda: create_promo_code_from_coupon("co_check",
+                                                                                                      "CHECK10"))
+        results.append(ok)
+        code: str = promotion_code["code"]
+        results.append(expect("created promotion code is written through", 0, lambda: find_promo_code_id(code),
+                              lambda x: x is not None and x["id"] == promotion_code["id"])[0])
+
+        changed = stripe.util.convert_to_stripe_object({**product.to_dict_recursive(), "description": "changed"})
+        handle_stripe_object_event(event("product.updated", changed.to_dict_recursive()), db)
+        results.append(expect("product.updated is applied", 0, lambda: get_stripe_product_from_id(product["id"]),
+                              lambda x: x["description"] == "changed")[0])
+
+        deactivated = {**promotion_code.to_dict_recursive(), "active": False}
+        handle_stripe_object_event(event("promotion_code.updated", deactivated), db)
+        results.append(expect("deactivated promotion code is dropped", 1, lambda: find_promo_code_id(code))[0])
+
+        # another process handling an event
+        stripe_cache.load_version = load_version
+        stripe_cache.version_check_seconds = 0.0
+        expect("version is read", 0, lambda: stripe_cache.get("check", "check"))
+        get_stripe_product_from_id(product["id"])
+        results.append(expect("cached product before the version moves", 0,
+                              lambda: get_stripe_product_from_id(product["id"]))[0])
+        version = load_stripe_cache_version()
+        bump_stripe_cache_version(db)
+        results.append(load_stripe_cache_version() == version + 1)
+        results.append(expect("product reads through after the version moved", 1,
+                              lambda: get_stripe_product_from_id(product["id"]))[0])
+    finally:
+        db.close()
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
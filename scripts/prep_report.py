@@ -0,0 +1,33 @@
+import argparse
+import time
+from datetime import date
+
+from dependencies.database import SessionLocal
+from dependencies.prep_report import build_prep_report
+
+# Prints the ingredient shopping list for completed orders delivered in [start, end). Run from the repo root:
+#   python -m scripts.prep_report --start 2023-06-04 --end 2023-06-11 [--csv prep.csv]
+
+
+def main(start: date, end: date, csv_path: str):
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        report = build_prep_report(start, end, db)
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    if csv_path is not None:
+        report.to_csv(csv_path, index=False)
+    print(report.to_string(index=False))
+    print("{} ingredients in {:.3f}s".format(len(report), elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--start", type=date.fromisoformat, required=True)
+    parser.add_argument("--end", type=date.fromisoformat, required=True)
+    parser.add_argument("--csv", default=None)
+    args = parser.parse_args()
+    main(args.start, args.end, args.csv)
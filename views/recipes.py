@@ -1,10 +1,22 @@
+from typing import Any
+
 from sqladmin import ModelView
 
+from dependencies.catalog import invalidate_catalog
 from models.recipes import RecipeContributor, StarredRecipe, Recipe, RecipeSchedule, InYourKitchen, Ingredient, \
     RecipeIngredient, RecipeInYourKitchen, RecipeStep, RecipePrice
 
 
-class RecipeContributorAdmin(ModelView, model=RecipeContributor):
+class CatalogModelView(ModelView):
+    # edits made through the admin must be visible to the cached catalog and the step lists built from it
+    async def after_model_change(self, data: dict, model: Any, is_created: bool) -> None:
+        invalidate_catalog()
+
+    async def after_model_delete(self, model: Any) -> None:
+        invalidate_catalog()
+
+
+class RecipeContributorAdmin(CatalogModelView, model=RecipeContributor):
     column_list = [
         RecipeContributor.id,
         RecipeContributor.name,
@@ -12,7 +24,7 @@ class RecipeContributorAdmin(ModelView, model=RecipeContributor):
     ]
 
 
-class RecipeAdmin(ModelView, model=Recipe):
+class RecipeAdmin(CatalogModelView, model=Recipe):
     column_list = [
         Recipe.id,
         Recipe.name,
@@ -36,7 +48,7 @@ class StarredRecipeAdmin(ModelView, model=StarredRecipe):
     ]
 
 
-class RecipeScheduleAdmin(ModelView, model=RecipeSchedule):
+class RecipeScheduleAdmin(CatalogModelView, model=RecipeSchedule):
     column_list = [
         RecipeSchedule.id,
         RecipeSchedule.recipe_id,
@@ -46,7 +58,7 @@ class RecipeScheduleAdmin(ModelView, model=RecipeSchedule):
     column_sortable_list = [RecipeSchedule.schedule_start_date]
 
 
-class InYourKitchenAdmin(ModelView, model=InYourKitchen):
+class InYourKitchenAdmin(CatalogModelView, model=InYourKitchen):
     column_list = [
         InYourKitchen.id,
         InYourKitchen.name
@@ -55,7 +67,7 @@ class InYourKitchenAdmin(ModelView, model=InYourKitchen):
     column_searchable_list = [InYourKitchen.name]
 
 
-class IngredientsAdmin(ModelView, model=Ingredient):
+class IngredientsAdmin(CatalogModelView, model=Ingredient):
     column_list = [
         Ingredient.id,
         Ingredient.name,
@@ -91,7 +103,7 @@ class RecipeInYourKitchenAdmin(ModelView, model=RecipeInYourKitchen):
     column_sortable_list = [RecipeInYourKitchen.recipe_id]
 
 
-class RecipeStepAdmin(ModelView, model=RecipeStep):
+class RecipeStepAdmin(CatalogModelView, model=RecipeStep):
     column_list = [
         RecipeStep.id,
         RecipeStep.step_number,
@@ -109,12 +121,13 @@ class RecipeStepAdmin(ModelView, model=RecipeStep):
     column_sortable_list = [RecipeStep.recipe_id]
 
 
-class RecipePriceAdmin(ModelView, model=RecipePrice):
+class RecipePriceAdmin(CatalogModelView, model=RecipePrice):
     column_list = [
         RecipePrice.id,
         RecipePrice.recipe_id,
         RecipePrice.serving_size,
         RecipePrice.price,
         RecipePrice.stripe_product_id,
-        RecipePrice.stripe_price_id
+        RecipePrice.stripe_price_id,
+        RecipePrice.pending_price
     ]